@@ -0,0 +1,241 @@
+#
+# Copyright (c) 2015 Juniper Networks, Inc. All rights reserved.
+#
+import gevent
+from gevent import monkey
+monkey.patch_all()
+import unittest
+from flexmock import flexmock
+
+from cfgm_common.ifmap.metadata import Metadata
+from vnc_cfg_api_server import vnc_cfg_ifmap
+
+
+class TestIfmapPublish(unittest.TestCase):
+    def setUp(self):
+        self.published = []
+        self.publish_failures = 0
+        self.resyncs = 0
+        self.db_client_mgr = flexmock(_sandesh=None,
+            config_log=lambda *args, **kwargs: None)
+        flexmock(vnc_cfg_ifmap.VncIfmapClient).should_receive('_init_conn')
+        flexmock(vnc_cfg_ifmap.VncIfmapClient).should_receive(
+            '_publish_config_root')
+        flexmock(vnc_cfg_ifmap.VncIfmapClient, _PUBLISH_RETRY_INTERVAL=0)
+        self.ifmap = self._ifmap_client(publish_batch_size=100,
+                                        publish_flush_interval=0.01,
+                                        publish_max_inflight=2,
+                                        publish_buffer_size=300)
+
+    def tearDown(self):
+        self.ifmap._publish_flusher.kill()
+
+    def _ifmap_client(self, **kwargs):
+        ifmap = vnc_cfg_ifmap.VncIfmapClient(self.db_client_mgr,
+            '127.0.0.1', 8443, 'user', 'passwd', {}, **kwargs)
+        ifmap._publish_to_ifmap = self._publish_to_ifmap
+        ifmap._reconnect_and_resync = self._reconnect_and_resync
+        return ifmap
+
+    def _publish_to_ifmap(self, oper, oper_body, async, do_trace=True):
+        if self.publish_failures:
+            self.publish_failures -= 1
+            raise Exception('publish failed')
+        self.published.append((oper, oper_body))
+
+    def _reconnect_and_resync(self):
+        self.resyncs += 1
+        self.ifmap._reset_cache_and_accumulator()
+
+    def _wait_for(self, cond, timeout=1):
+        with gevent.Timeout(timeout):
+            while not cond():
+                gevent.sleep(0.001)
+
+    def test_flush_interval(self):
+        self.ifmap._publish_enqueue('update', 'a' * 10, ('id-a',))
+        gevent.sleep(0)
+        self.assertEqual(self.published, [])
+        self._wait_for(lambda: self.published)
+        self.assertEqual(self.published, [('update', 'a' * 10)])
+
+        # flush interval of 0 is kept, not taken as the default
+        ifmap = self._ifmap_client(publish_flush_interval=0)
+        self.assertEqual(ifmap._publish_flush_interval, 0)
+        ifmap._publish_flusher.kill()
+
+    def test_batch_split(self):
+        for i in range(5):
+            self.ifmap._publish_enqueue(
+                'update' if i % 2 else 'delete', str(i) * 40, ('id-%d' % i,))
+        self._wait_for(lambda: len(self.published) == 3)
+        self.assertEqual(self.published,
+                         [('delete/update', '0' * 40 + '1' * 40),
+                          ('delete/update', '2' * 40 + '3' * 40),
+                          ('delete', '4' * 40)])
+        stats = self.ifmap.get_publish_stats()
+        self.assertEqual(stats['batches'], 3)
+        self.assertEqual(stats['operations'], 5)
+        self.assertEqual(stats['max_batch_bytes'], 80)
+
+        # an operation larger than a batch goes out on its own
+        self.ifmap._publish_enqueue('update', 'x' * 150, ('id-x',))
+        self._wait_for(lambda: len(self.published) == 4)
+        self.assertEqual(self.published[-1], ('update', 'x' * 150))
+
+    def test_backpressure(self):
+        blocked = gevent.event.Event()
+        def _publish_blocked(*args, **kwargs):
+            blocked.wait()
+            self.published.append(args[:2])
+        self.ifmap._publish_to_ifmap = _publish_blocked
+
+        # 2 batches in flight on distinct ids, the rest fills the buffer
+        enqueued = []
+        def _enqueue():
+            for i in range(10):
+                self.ifmap._publish_enqueue('update', str(i) * 100,
+                                            ('id-%d' % i,))
+                enqueued.append(i)
+        enqueuer = gevent.spawn(_enqueue)
+        self._wait_for(lambda: len(enqueued) == 6)
+        gevent.sleep(0.01)
+        self.assertTrue(self.ifmap.get_publish_stats()['backpressure_waits'])
+        self.assertEqual(len(self.ifmap._publish_inflight), 2)
+        self.assertEqual(enqueued, range(6))
+        self.assertEqual(self.ifmap.get_publish_stats()['pending_bytes'],
+                         300)
+
+        blocked.set()
+        enqueuer.join(timeout=1)
+        self._wait_for(lambda: len(self.published) == 10)
+        # batches on distinct ids may complete in any order
+        self.assertEqual(sorted(body[0] for _, body in self.published),
+                         [str(i) for i in range(10)])
+
+    def test_generation_drop(self):
+        self.ifmap._publish_enqueue('update', 'a' * 10, ('id-a',))
+        self.ifmap._publish_enqueue('update', 'b' * 10, ('id-b',))
+        generation = self.ifmap._publish_generation
+        (oper, bodies, batch_ids, batch_len) = \
+            self.ifmap._publish_take_batch()
+        self.assertEqual(batch_ids, set(['id-a', 'id-b']))
+
+        # a reconnect drops the buffer and the batches taken before it
+        self.ifmap._reset_cache_and_accumulator()
+        self.assertEqual(self.ifmap.get_publish_stats()['pending_operations'],
+                         0)
+        self.ifmap._publish_batch(generation, oper, bodies, batch_ids,
+                                  batch_len)
+        self.assertEqual(self.published, [])
+        self.assertEqual(self.ifmap.get_publish_stats()['dropped'], 1)
+
+    def test_retry(self):
+        self.publish_failures = 2
+        self.ifmap._publish_enqueue('delete', 'a' * 10, ('id-a',))
+        self._wait_for(lambda: self.published)
+        self.assertEqual(self.published, [('delete', 'a' * 10)])
+        stats = self.ifmap.get_publish_stats()
+        self.assertEqual((stats['failures'], stats['retries'],
+                          stats['resyncs']), (2, 2, 0))
+
+    def test_resync_after_retries(self):
+        retries = vnc_cfg_ifmap.VncIfmapClient._PUBLISH_RETRIES
+        self.publish_failures = retries + 1
+        self.ifmap._publish_enqueue('delete', 'a' * 10, ('id-a',))
+        self._wait_for(lambda: self.resyncs)
+        gevent.sleep(0.01)
+        self.assertEqual(self.published, [])
+        stats = self.ifmap.get_publish_stats()
+        self.assertEqual((stats['failures'], stats['retries'],
+                          stats['resyncs']), (retries + 1, retries, 1))
+        self.assertEqual(self.resyncs, 1)
+        self.assertEqual(stats['inflight'], 0)
+
+    def test_meta_shadow(self):
+        ifmap = self.ifmap
+        ifmap._id_to_metas_set('id-vn', 'id-perms', None, 'd1')
+        ifmap._id_to_metas_set('id-vn', 'virtual-network-network-ipam',
+                               'id-ipam', 'd2')
+        ifmap._id_to_metas_set('id-ipam', 'virtual-network-network-ipam',
+                               'id-vn', 'd2')
+        self.assertEqual(ifmap._id_to_metas_digest('id-vn', 'id-perms'), 'd1')
+        self.assertEqual(ifmap._id_to_metas_digest(
+            'id-vn', 'virtual-network-network-ipam', 'id-ipam'), 'd2')
+        self.assertIsNone(ifmap._id_to_metas_digest('id-vn', 'display-name'))
+        self.assertIsNone(ifmap._id_to_metas_digest('id-x', 'id-perms'))
+
+        # iterates as the links the generated code walks
+        metas = ifmap._id_to_metas['id-vn']
+        self.assertEqual(list(metas['id-perms']), [{}])
+        self.assertEqual(list(metas['virtual-network-network-ipam']),
+                         [{'id': 'id-ipam'}])
+        self.assertIn('id-ipam', metas['virtual-network-network-ipam'])
+
+        # an imid is stored once however many links refer to it
+        peer = ''.join(['id-', 'vn'])
+        ifmap._id_to_metas_set('id-ipam', 'other-link', peer, 'd3')
+        ipam_metas = ifmap._id_to_metas['id-ipam']
+        (vn_imid,) = ipam_metas['virtual-network-network-ipam'].peers.keys()
+        self.assertIs(ipam_metas['other-link'].peers.keys()[0], vn_imid)
+
+        # dropping the last link of a meta drops the meta, then the imid
+        ifmap._id_to_metas_discard('id-ipam', ['other-link'], 'id-vn')
+        self.assertNotIn('other-link', ipam_metas)
+        ifmap._id_to_metas_discard('id-ipam', None, 'id-vn')
+        self.assertNotIn('id-ipam', ifmap._id_to_metas)
+        self.assertNotIn('id-ipam', ifmap._imids)
+        ifmap._id_to_metas_discard('id-vn', 'id-perms')
+        self.assertEqual(ifmap._id_to_metas['id-vn'].keys(),
+                         ['virtual-network-network-ipam'])
+        ifmap._id_to_metas_discard('id-vn')
+        self.assertEqual(ifmap._id_to_metas, {})
+        self.assertEqual(ifmap._imids, {})
+
+    def _meta(self, name, value):
+        return Metadata(name, value, {'ifmap-cardinality': 'singleValue'},
+                        ns_prefix='contrail')
+
+    def test_unchanged_meta(self):
+        ifmap = self.ifmap
+        ifmap._publish_update('id-vn', {
+            'self': [self._meta('display-name', 'vn')],
+            'id-ipam': [self._meta('virtual-network-network-ipam', '')]})
+        self._wait_for(lambda: self.published)
+        self.assertEqual(len(self.published), 1)
+
+        # only the changed meta is published again
+        ifmap._publish_update('id-vn', {
+            'self': [self._meta('display-name', 'vn-1')],
+            'id-ipam': [self._meta('virtual-network-network-ipam', '')]})
+        self._wait_for(lambda: len(self.published) == 2)
+        self.assertIn('vn-1', self.published[1][1])
+        self.assertNotIn('id-ipam', self.published[1][1])
+        self.assertEqual(ifmap.get_publish_stats()['unchanged'], 1)
+
+        ifmap._publish_update('id-vn', {
+            'self': [self._meta('display-name', 'vn-1')]})
+        gevent.sleep(0.05)
+        self.assertEqual(len(self.published), 2)
+        self.assertEqual(ifmap.get_publish_stats()['unchanged'], 2)
+
+    def test_failed_meta_republished(self):
+        ifmap = self.ifmap
+        update = {'self': [self._meta('display-name', 'vn')],
+                  'id-ipam': [self._meta('virtual-network-network-ipam', '')]}
+        self.publish_failures = 1
+        ifmap._publish_update('id-vn', update)
+        self._wait_for(lambda: self.published)
+        self.assertEqual(ifmap.get_publish_stats()['failures'], 1)
+
+        # the same metas are not taken as already published
+        ifmap._publish_update('id-vn', update)
+        self._wait_for(lambda: len(self.published) == 2)
+        self.assertEqual(self.published[1], self.published[0])
+        self.assertEqual(ifmap.get_publish_stats()['unchanged'], 0)
+
+        ifmap._publish_update('id-vn', update)
+        gevent.sleep(0.05)
+        self.assertEqual(len(self.published), 2)
+        self.assertEqual(ifmap.get_publish_stats()['unchanged'], 2)
+# end class TestIfmapPublish
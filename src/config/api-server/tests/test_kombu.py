@@ -41,7 +41,7 @@ class TestIfmapKombuClient(unittest.TestCase):
         self._url_template = "pyamqp://%s:%s@%s:%d/%s/"
         self.mock_producer = flexmock(operational = True)
         self.mock_consumer = flexmock(operational = True)
-        vnc_kombu.kombu.Connection = lambda x: self.mock_connect
+        vnc_kombu.kombu.Connection = lambda x, **kwargs: self.mock_connect
         vnc_kombu.kombu.Producer = lambda x, **kwargs: self.mock_producer
         vnc_kombu.kombu.Consumer = lambda x, **kwargs: self.mock_consumer
 
@@ -58,7 +58,7 @@ class TestIfmapKombuClient(unittest.TestCase):
                      "skipping because kombu client is older")
     def test_url_parsing(self):
         check_value = []
-        def Connection(urls):
+        def Connection(urls, **kwargs):
             if set(urls) != set(check_value):
                 raise WrongValueException()
             else:
@@ -151,3 +151,108 @@ class TestIfmapKombuClient(unittest.TestCase):
         self.assertEqual(len(req_id), 2)
         self.assertEqual(len(set(req_id)), 1)
 
+    @unittest.skipIf(is_kombu_client_v1,
+                     "skipping because kombu client is older")
+    def test_connection_publish_envelope(self):
+        flexmock(self.mock_connect).should_receive("close").once()
+        flexmock(self.mock_connect).should_receive("connect").once()
+        flexmock(self.mock_connect).should_receive("ensure_connection").once()
+        flexmock(self.mock_connect).should_receive("channel").once()
+        flexmock(self.db_client_mgr).should_receive("wait_for_resync_done"). \
+            with_args().once()
+        flexmock(self.mock_consumer).should_receive("consume").once()
+        flexmock(self.mock_connect).should_receive("drain_events"). \
+            replace_with(lambda: gevent.sleep(1000))
+
+        published = []
+        flexmock(self.mock_producer).should_receive("publish"). \
+            replace_with(published.append).once()
+        servers = "a.a.a.a"
+        kc = vnc_cfg_ifmap.VncServerKombuClient(self.db_client_mgr,
+                                     servers, self.port,
+                                     None, self.username,
+                                     self.password,
+                                     self.vhost, False,
+                                     publish_envelope=True)
+        kc.dbe_create_publish("network", [], {})
+        kc.dbe_create_publish("network", [], {})
+        gevent.sleep(0.01)
+
+        # messages queued meanwhile go out in one envelope
+        self.assertEqual(len(published), 1)
+        messages = kc._unpack(published[0])
+        self.assertEqual(len(messages), 2)
+        self.assertEqual([msg['oper'] for msg in messages],
+                         ['CREATE', 'CREATE'])
+
+
+class TestIfmapKombuCoalesce(unittest.TestCase):
+    def setUp(self):
+        vnc_kombu.kombu.Connection = lambda *args, **kwargs: flexmock()
+        flexmock(vnc_kombu.VncKombuClient).should_receive('_start')
+        flexmock(vnc_cfg_ifmap.VncServerKombuClient,
+                 _UPDATE_COALESCE_WINDOW=0.01)
+        self.db_client_mgr = flexmock(operational=True, _sandesh=None,
+                       config_log=lambda *args, **kwargs: None,
+                       get_server_port=lambda: 8082,
+                       wait_for_resync_done=lambda: None)
+        self.kc = vnc_cfg_ifmap.VncServerKombuClient(self.db_client_mgr,
+                                     "a.a.a.a", 5672, None, "guest",
+                                     "contrail123", "vhost0", False)
+        self.handled = []
+        self.kc._dbe_handle_notification = \
+            lambda oper_info: self.handled.append(
+                (oper_info['oper'], oper_info['uuid'], oper_info.get('seq')))
+
+    def _notify(self, oper, obj_uuid, seq=None):
+        self.kc._dbe_subscribe_callback(
+            {'oper': oper, 'type': 'virtual-network', 'uuid': obj_uuid,
+             'seq': seq})
+
+    def test_update_coalesce(self):
+        self._notify('UPDATE', 'uuid-1', 1)
+        self._notify('UPDATE', 'uuid-2', 2)
+        self._notify('UPDATE', 'uuid-1', 3)
+        self.assertEqual(self.handled, [])
+
+        # latest update of each uuid, in order of first arrival
+        gevent.sleep(0.05)
+        self.assertEqual(self.handled, [('UPDATE', 'uuid-1', 3),
+                                        ('UPDATE', 'uuid-2', 2)])
+        self.assertEqual(self.kc.coalesced_updates, 1)
+
+        # a new window starts with the next update
+        self._notify('UPDATE', 'uuid-1', 4)
+        gevent.sleep(0.05)
+        self.assertEqual(self.handled[-1], ('UPDATE', 'uuid-1', 4))
+
+    def test_update_flushed_before_create_delete(self):
+        self._notify('UPDATE', 'uuid-1')
+        self._notify('DELETE', 'uuid-2')
+        self.assertEqual(self.handled, [('UPDATE', 'uuid-1', None),
+                                        ('DELETE', 'uuid-2', None)])
+        self._notify('CREATE', 'uuid-3')
+        gevent.sleep(0.05)
+        self.assertEqual(len(self.handled), 3)
+
+    def test_update_waits_for_flush(self):
+        blocked = gevent.event.Event()
+        def _handle_blocked(oper_info):
+            blocked.wait()
+            self.handled.append((oper_info['oper'], oper_info['uuid'],
+                                 oper_info.get('seq')))
+        self.kc._dbe_handle_notification = _handle_blocked
+
+        self._notify('UPDATE', 'uuid-1')
+        gevent.sleep(0.05)
+        # the flush is held up, as by ifmap publish back-pressure, and so
+        # is the consumer
+        consumer = gevent.spawn(self._notify, 'UPDATE', 'uuid-2')
+        gevent.sleep(0.05)
+        self.assertFalse(consumer.ready())
+        blocked.set()
+        consumer.join(timeout=1)
+        self.assertTrue(consumer.ready())
+        gevent.sleep(0.05)
+        self.assertEqual(self.handled, [('UPDATE', 'uuid-1', None),
+                                        ('UPDATE', 'uuid-2', None)])
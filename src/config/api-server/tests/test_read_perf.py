@@ -0,0 +1,94 @@
+#
+# Copyright (c) 2015 Juniper Networks, Inc. All rights reserved.
+#
+import sys
+import json
+import uuid
+import time
+import logging
+
+from vnc_api.vnc_api import *
+
+sys.path.append('../common/tests')
+from test_utils import *
+import test_common
+import test_case
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+class TestReadPerf(test_case.ApiServerTestCase):
+    _BACK_REF_COUNTS = [10, 100, 1000, 5000]
+
+    def _add_fake_back_refs(self, obj_uuid, count):
+        # write instance-ip rows + back-ref columns directly in the db to
+        # keep setup time independent of api-server create path
+        cassandra_db = self._api_server._db_conn._cassandra_db
+        obj_uuid_cf = cassandra_db._obj_uuid_cf
+        for i in range(count):
+            iip_uuid = str(uuid.uuid4())
+            obj_uuid_cf.insert(iip_uuid, {
+                'fq_name': json.dumps(['%s-iip-%s' % (self.id(), iip_uuid)]),
+                'type': json.dumps('instance_ip')})
+            obj_uuid_cf.insert(obj_uuid, {
+                'backref:instance_ip:%s' % (iip_uuid): json.dumps(None)})
+    # end _add_fake_back_refs
+
+    def test_back_ref_read_latency(self):
+        cassandra_db = self._api_server._db_conn._cassandra_db
+        batch_size = cassandra_db._fq_name_batch_size
+        obj_uuid_cf = cassandra_db._obj_uuid_cf
+        orig_multiget = obj_uuid_cf.multiget
+        multiget_calls = []
+        def counting_multiget(*args, **kwargs):
+            multiget_calls.append(len(args[0]))
+            return orig_multiget(*args, **kwargs)
+        obj_uuid_cf.multiget = counting_multiget
+
+        vn_obj = VirtualNetwork('%s-vn' % (self.id()))
+        self._vnc_lib.virtual_network_create(vn_obj)
+
+        results = []
+        try:
+            n_back_refs = 0
+            for count in self._BACK_REF_COUNTS:
+                self._add_fake_back_refs(vn_obj.uuid, count - n_back_refs)
+                n_back_refs = count
+
+                # cold fq_name cache
+                cassandra_db._cache_uuid_to_fq_name.clear()
+                del multiget_calls[:]
+                start = time.time()
+                (ok, vn_dicts) = cassandra_db.read('virtual_network',
+                                                   [vn_obj.uuid])
+                cold_time = time.time() - start
+                cold_calls = len(multiget_calls)
+
+                # warm fq_name cache
+                del multiget_calls[:]
+                start = time.time()
+                (ok, vn_dicts) = cassandra_db.read('virtual_network',
+                                                   [vn_obj.uuid])
+                warm_time = time.time() - start
+                warm_calls = len(multiget_calls)
+
+                self.assertEqual(
+                    len(vn_dicts[0]['instance_ip_back_refs']), count)
+                # one multiget for the row + one per batch of back-refs
+                self.assertEqual(cold_calls,
+                                 1 + (count + batch_size - 1) / batch_size)
+                self.assertEqual(warm_calls, 1)
+                results.append((count, cold_time, cold_calls,
+                                warm_time, warm_calls))
+        finally:
+            obj_uuid_cf.multiget = orig_multiget
+
+        report = ['back-refs  cold(ms)  multigets  warm(ms)  multigets']
+        for (count, cold_time, cold_calls, warm_time, warm_calls) in results:
+            report.append('%9d  %8.2f  %9d  %8.2f  %9d' % (count,
+                cold_time * 1000, cold_calls, warm_time * 1000, warm_calls))
+        self._add_detail('\n'.join(report))
+        logger.info('\n'.join(report))
+    # end test_back_ref_read_latency
+# end class TestReadPerf
@@ -56,7 +56,15 @@ def parse_args(args_str):
         'rabbit_password': 'guest',
         'rabbit_vhost': None,
         'rabbit_ha_mode': False,
+        'rabbit_publish_envelope': False,
         'rabbit_max_pending_updates': '4096',
+        'object_cache_entries': '10000',
+        'object_cache_ttl': '30',
+        'ref_read_batch_size': '500',
+        'ifmap_publish_batch_size': '1048576',
+        'ifmap_publish_flush_interval': '0.05',
+        'ifmap_publish_max_inflight': '4',
+        'ifmap_publish_buffer_size': '8388608',
         'cluster_id': '',
     }
     # ssl options
@@ -86,6 +94,9 @@ def parse_args(args_str):
         if 'multi_tenancy' in config.options('DEFAULTS'):
             defaults['multi_tenancy'] = config.getboolean(
                 'DEFAULTS', 'multi_tenancy')
+        if 'rabbit_publish_envelope' in config.options('DEFAULTS'):
+            defaults['rabbit_publish_envelope'] = config.getboolean(
+                'DEFAULTS', 'rabbit_publish_envelope')
         if 'SECURITY' in config.sections() and\
                 'use_certs' in config.options('SECURITY'):
             if config.getboolean('SECURITY', 'use_certs'):
@@ -222,9 +233,34 @@ def parse_args(args_str):
     parser.add_argument(
         "--rabbit_ha_mode",
         help="True if the rabbitmq cluster is mirroring all queue")
+    parser.add_argument(
+        "--rabbit_publish_envelope", action="store_true",
+        help="Publish batches of messages in envelopes, only once all "
+             "subscribers unpack them")
     parser.add_argument(
         "--rabbit_max_pending_updates",
         help="Max updates before stateful changes disallowed")
+    parser.add_argument(
+        "--object_cache_entries",
+        help="Max number of objects cached on read, 0 disables the cache")
+    parser.add_argument(
+        "--object_cache_ttl",
+        help="Seconds a cached object read stays valid, 0 for no expiry")
+    parser.add_argument(
+        "--ref_read_batch_size",
+        help="Max uuids per cassandra multiget resolving refs of a read")
+    parser.add_argument(
+        "--ifmap_publish_batch_size",
+        help="Max size of serialized operations in one ifmap publish")
+    parser.add_argument(
+        "--ifmap_publish_flush_interval",
+        help="Max seconds an operation waits to be batched before publish")
+    parser.add_argument(
+        "--ifmap_publish_max_inflight",
+        help="Max ifmap publish requests outstanding at once")
+    parser.add_argument(
+        "--ifmap_publish_buffer_size",
+        help="Size of buffered ifmap operations that blocks further updates")
     parser.add_argument(
         "--cluster_id",
         help="Used for database keyspace separation")
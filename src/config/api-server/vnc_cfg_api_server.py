@@ -99,6 +99,9 @@ from cfgm_common.uve.cfgm_cpuinfo.ttypes import NodeStatusUVE, \
     NodeStatus
 
 from sandesh.traces.ttypes import RestApiTrace
+from sandesh.api_introspect.ttypes import DbCacheStatsReq, \
+    DbCacheStatsResp, DbCacheStats, IfmapPublishStatsReq, \
+    IfmapPublishStatsResp
 
 _ACTION_RESOURCES = [
     {'uri': '/ref-update', 'link_name': 'ref-update',
@@ -382,7 +385,9 @@ class VncApiServer(VncApiServerGen):
                                      self._args.collectors,
                                      'vnc_api_server_context',
                                      int(self._args.http_server_port),
-                                     ['cfgm_common'], self._disc)
+                                     ['cfgm_common',
+                                      'vnc_cfg_api_server.sandesh'],
+                                     self._disc)
         self._sandesh.trace_buffer_create(name="VncCfgTraceBuf", size=1000)
         self._sandesh.trace_buffer_create(name="RestApiTraceBuf", size=1000)
         self._sandesh.trace_buffer_create(name="DBRequestTraceBuf", size=1000)
@@ -447,6 +452,11 @@ class VncApiServer(VncApiServerGen):
             self._db_connect(self._args.reset_config)
             self._db_init_entries()
 
+        DbCacheStatsReq.handle_request = \
+            self.sandesh_db_cache_stats_handle_request
+        IfmapPublishStatsReq.handle_request = \
+            self.sandesh_ifmap_publish_stats_handle_request
+
         # Cpuinfo interface
         sysinfo_req = True
         config_node_ip = self.get_server_ip()
@@ -819,6 +829,13 @@ class VncApiServer(VncApiServerGen):
                                          --disc_server_port 5998
                                          --worker_id 1
                                          --rabbit_max_pending_updates 4096
+                                         --object_cache_entries 10000
+                                         --object_cache_ttl 30
+                                         --ref_read_batch_size 500
+                                         --ifmap_publish_batch_size 1048576
+                                         --ifmap_publish_flush_interval 0.05
+                                         --ifmap_publish_max_inflight 4
+                                         --ifmap_publish_buffer_size 8388608
                                          --cluster_id <testbed-name>
                                          [--auth keystone]
                                          [--ifmap_server_loc
@@ -1011,6 +1028,25 @@ class VncApiServer(VncApiServerGen):
         return self._db_conn
     # end get_db_connection
 
+    def sandesh_db_cache_stats_handle_request(self, req):
+        cache_resp = DbCacheStatsResp(caches=[])
+        for name, stats in self._db_conn.get_cache_stats():
+            cache_resp.caches.append(DbCacheStats(name=name, **stats))
+        cache_resp.response(req.context())
+    # end sandesh_db_cache_stats_handle_request
+
+    def sandesh_ifmap_publish_stats_handle_request(self, req):
+        stats = self._db_conn.get_ifmap_publish_stats()
+        if stats['batches']:
+            stats['flush_msecs_avg'] = \
+                stats['flush_msecs_total'] / stats['batches']
+            stats['operations_per_batch_avg'] = \
+                stats['operations'] / stats['batches']
+        del stats['flush_msecs_total']
+        stats_resp = IfmapPublishStatsResp(**stats)
+        stats_resp.response(req.context())
+    # end sandesh_ifmap_publish_stats_handle_request
+
     def generate_url(self, obj_type, obj_uuid):
         obj_uri_type = obj_type.replace('_', '-')
         try:
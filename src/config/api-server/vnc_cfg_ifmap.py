@@ -10,9 +10,17 @@ from gevent import ssl, monkey
 monkey.patch_all()
 import gevent
 import gevent.event
+import gevent.pool
 from gevent.queue import Queue
+try:
+    from gevent.lock import Semaphore
+except ImportError:
+    # older versions of gevent
+    from gevent.coros import Semaphore
 import sys
 import time
+import collections
+import hashlib
 from pprint import pformat
 
 from lxml import etree, objectify
@@ -96,7 +104,55 @@ def trace_msg(trace_obj, trace_name, sandesh_hdl, error_msg=None):
         trace_obj.trace_msg(name=trace_name, sandesh=sandesh_hdl)
 # end trace_msg
 
+class IfmapMetaPeers(object):
+    """Published metas of one name on an ifmap identity.
+
+    Maps peer imid (None for a property) to the digest of the metadata
+    last published. Iterates as the [{'id': peer}, ...] list of links the
+    generated update/delete code walks, a property yielding {}.
+    """
+    __slots__ = ('peers',)
+
+    def __init__(self):
+        self.peers = {}
+    # end __init__
+
+    def __iter__(self):
+        for peer in self.peers:
+            if peer is None:
+                yield {}
+            else:
+                yield {'id': peer}
+    # end __iter__
+
+    def __len__(self):
+        return len(self.peers)
+    # end __len__
+
+    def __contains__(self, peer):
+        return peer in self.peers
+    # end __contains__
+
+    def __repr__(self):
+        return repr(dict((peer, digest.encode('hex'))
+                         for peer, digest in self.peers.iteritems()))
+    # end __repr__
+# end class IfmapMetaPeers
+
+
 class VncIfmapClient(VncIfmapClientGen):
+    # publish pipeline defaults: max size of one publish request (chars of
+    # serialized operations), max age of a buffered operation, number of
+    # publish requests in flight and the buffered size at which callers
+    # block till in flight requests drain
+    _PUBLISH_BATCH_SIZE = 1024*1024
+    _PUBLISH_FLUSH_INTERVAL = 0.05
+    _PUBLISH_MAX_INFLIGHT = 4
+    _PUBLISH_BUFFER_SIZE = 8*1024*1024
+    # a failed publish request is retried after 1, 2, .. secs, and ifmap
+    # resynced from the db when it still fails after the last retry
+    _PUBLISH_RETRIES = 3
+    _PUBLISH_RETRY_INTERVAL = 1
 
     def handler(self, signum, frame):
         file = open("/tmp/api-server-ifmap-cache.txt", "w")
@@ -104,7 +160,9 @@ class VncIfmapClient(VncIfmapClientGen):
         file.close()
 
     def __init__(self, db_client_mgr, ifmap_srv_ip, ifmap_srv_port,
-                 uname, passwd, ssl_options, ifmap_srv_loc=None):
+                 uname, passwd, ssl_options, ifmap_srv_loc=None,
+                 publish_batch_size=None, publish_flush_interval=None,
+                 publish_max_inflight=None, publish_buffer_size=None):
         super(VncIfmapClient, self).__init__()
         self._ifmap_srv_ip = ifmap_srv_ip
         self._ifmap_srv_port = ifmap_srv_port
@@ -139,6 +197,13 @@ class VncIfmapClient(VncIfmapClientGen):
         if ifmap_srv_loc:
             self._launch_mapserver(ifmap_srv_ip, ifmap_srv_port, ifmap_srv_loc)
 
+        if publish_flush_interval is None:
+            publish_flush_interval = self._PUBLISH_FLUSH_INTERVAL
+        self._init_publish_pipeline(
+            publish_batch_size or self._PUBLISH_BATCH_SIZE,
+            publish_flush_interval,
+            publish_max_inflight or self._PUBLISH_MAX_INFLIGHT,
+            publish_buffer_size or self._PUBLISH_BUFFER_SIZE)
         self._reset_cache_and_accumulator()
 
         # Set the signal handler
@@ -181,12 +246,60 @@ class VncIfmapClient(VncIfmapClientGen):
 
     def _reset_cache_and_accumulator(self):
         # Cache of metas populated in ifmap server. Useful in update to find
-        # what things to remove in ifmap server
+        # what things to remove in ifmap server. imid -> meta name ->
+        # IfmapMetaPeers, with imids interned through _imids so an imid
+        # referred to by many links is stored once.
         self._id_to_metas = {}
+        self._imids = {}
+        # list of serialized operations and their total length, set by
+        # db_resync to publish everything in few large requests
         self.accumulator = None
         self.accumulated_request_len = 0
+        # buffered operations predate the reset and are superseded by resync,
+        # batches already taken from the buffer are dropped by generation
+        self._publish_pending.clear()
+        self._publish_pending_len = 0
+        self._publish_generation += 1
+        self._publish_space.set()
     # end _reset_cache_and_accumulator
 
+    def _init_publish_pipeline(self, batch_size, flush_interval,
+                               max_inflight, buffer_size):
+        # Operations are serialized by the caller into a bounded buffer of
+        # (oper, body, ifmap ids, enqueue time). A flusher greenlet groups
+        # them into publish requests by size or age and runs up to
+        # max_inflight requests at once, never two touching the same id so
+        # that the map server sees each id's operations in order.
+        self._publish_batch_size = batch_size
+        self._publish_flush_interval = flush_interval
+        self._publish_buffer_size = max(buffer_size, batch_size)
+        self._publish_pending = collections.deque()
+        self._publish_pending_len = 0
+        self._publish_generation = 0
+        self._publish_wakeup = gevent.event.Event()
+        self._publish_space = gevent.event.Event()
+        self._publish_space.set()
+        self._publish_done = gevent.event.Event()
+        self._publish_inflight = gevent.pool.Pool(max_inflight)
+        self._publish_inflight_ids = {}
+        self._publish_stats = {
+            'batches': 0,
+            'operations': 0,
+            'bytes': 0,
+            'max_batch_bytes': 0,
+            'failures': 0,
+            'retries': 0,
+            'resyncs': 0,
+            'dropped': 0,
+            'unchanged': 0,
+            'backpressure_waits': 0,
+            'flush_msecs_total': 0,
+            'flush_msecs_max': 0,
+            'flush_msecs_last': 0,
+        }
+        self._publish_flusher = gevent.spawn(self._publish_flush_loop)
+    # end _init_publish_pipeline
+
 
     def _publish_config_root(self):
         # config-root
@@ -292,14 +405,177 @@ class VncIfmapClient(VncIfmapClientGen):
 
     def publish_accumulated(self):
         if self.accumulated_request_len:
-            upd_str = ''.join(''.join(request) \
-                              for request in self.accumulator)
-            self._publish_to_ifmap('update', upd_str,
+            self._publish_to_ifmap('update', ''.join(self.accumulator),
                                    async=True, do_trace=False)
         self.accumulator = None
         self.accumulated_request_len = 0
     # end publish_accumulated
 
+    def _publish_enqueue(self, oper, oper_body, ifmap_ids):
+        if not oper_body:
+            return
+
+        if self.accumulator is not None:
+            self.accumulator.append(oper_body)
+            self.accumulated_request_len += len(oper_body)
+            if self.accumulated_request_len >= self._publish_batch_size:
+                upd_str = ''.join(self.accumulator)
+                self.accumulator = []
+                self.accumulated_request_len = 0
+                self._publish_to_ifmap('update', upd_str,
+                                       async=True, do_trace=False)
+            return
+
+        # back-pressure: block the caller (message bus consumer) while the
+        # buffer is full, a single oversized operation is always accepted
+        while (self._publish_pending and
+               self._publish_pending_len + len(oper_body) >
+               self._publish_buffer_size):
+            self._publish_stats['backpressure_waits'] += 1
+            self._publish_space.clear()
+            self._publish_space.wait()
+
+        self._publish_pending.append(
+            (oper, oper_body, ifmap_ids, time.time()))
+        self._publish_pending_len += len(oper_body)
+        if (len(self._publish_pending) == 1 or
+            self._publish_pending_len >= self._publish_batch_size):
+            self._publish_wakeup.set()
+    # end _publish_enqueue
+
+    def _publish_take_batch(self):
+        opers = set()
+        bodies = []
+        batch_ids = set()
+        batch_len = 0
+        pending = self._publish_pending
+        while pending and (not bodies or
+            batch_len + len(pending[0][1]) <= self._publish_batch_size):
+            oper, oper_body, ifmap_ids, _ = pending.popleft()
+            opers.add(oper)
+            bodies.append(oper_body)
+            batch_ids.update(ifmap_ids)
+            batch_len += len(oper_body)
+        self._publish_pending_len -= batch_len
+        self._publish_space.set()
+
+        return '/'.join(sorted(opers)), bodies, batch_ids, batch_len
+    # end _publish_take_batch
+
+    def _publish_flush_loop(self):
+        while True:
+            try:
+                if not self._publish_pending:
+                    self._publish_wakeup.clear()
+                    self._publish_wakeup.wait()
+                    continue
+
+                oldest = self._publish_pending[0][3]
+                wait_time = oldest + self._publish_flush_interval - time.time()
+                if (self._publish_pending_len < self._publish_batch_size and
+                    wait_time > 0):
+                    self._publish_wakeup.clear()
+                    self._publish_wakeup.wait(wait_time)
+                    continue
+
+                generation = self._publish_generation
+                oper, bodies, batch_ids, batch_len = \
+                    self._publish_take_batch()
+
+                # wait for in flight requests on any of the same ids
+                while any(batch_ids & inflight_ids for inflight_ids in
+                          self._publish_inflight_ids.itervalues()):
+                    self._publish_done.clear()
+                    self._publish_done.wait()
+
+                # blocks while max_inflight requests are outstanding
+                self._publish_inflight.wait_available()
+                batch_greenlet = self._publish_inflight.spawn(
+                    self._publish_batch, generation, oper, bodies, batch_ids,
+                    batch_len)
+                self._publish_inflight_ids[batch_greenlet] = batch_ids
+            except Exception as e:
+                msg = 'Error in ifmap publish flusher: %s' % (str(e))
+                self.config_log(msg, level=SandeshLevel.SYS_ERR)
+    # end _publish_flush_loop
+
+    def _publish_batch(self, generation, oper, bodies, batch_ids, batch_len):
+        stats = self._publish_stats
+        try:
+            retries = 0
+            while True:
+                if generation != self._publish_generation:
+                    # taken before a reconnect, resync has republished
+                    stats['dropped'] += 1
+                    return
+
+                start_time = time.time()
+                try:
+                    self._publish_to_ifmap(oper, ''.join(bodies), async=True)
+                    break
+                except Exception:
+                    # logged and traced in _publish_to_ifmap
+                    stats['failures'] += 1
+
+                # the shadow took the batch's metas as published, have the
+                # next update of any of its ids published in full
+                if not retries:
+                    self._id_to_metas_invalidate(batch_ids)
+                if retries == self._PUBLISH_RETRIES:
+                    # let batches on the same ids go, resync may wait on
+                    # them for buffer space
+                    self._publish_inflight_ids.pop(gevent.getcurrent(), None)
+                    self._publish_done.set()
+                    self._publish_resync(generation, oper, len(bodies))
+                    return
+                retries += 1
+                stats['retries'] += 1
+                gevent.sleep(self._PUBLISH_RETRY_INTERVAL * retries)
+
+            flush_msecs = int((time.time() - start_time) * 1000)
+            stats['batches'] += 1
+            stats['operations'] += len(bodies)
+            stats['bytes'] += batch_len
+            stats['max_batch_bytes'] = max(stats['max_batch_bytes'],
+                                           batch_len)
+            stats['flush_msecs_total'] += flush_msecs
+            stats['flush_msecs_max'] = max(stats['flush_msecs_max'],
+                                           flush_msecs)
+            stats['flush_msecs_last'] = flush_msecs
+        finally:
+            self._publish_inflight_ids.pop(gevent.getcurrent(), None)
+            self._publish_done.set()
+    # end _publish_batch
+
+    def _publish_resync(self, generation, oper, num_opers):
+        # the map server missed operations of the current generation, the
+        # first batch to give up starts the next one by republishing all
+        if generation != self._publish_generation:
+            return
+        self._publish_stats['resyncs'] += 1
+        log_str = 'Failed to publish %s of %d operations to ifmap after ' \
+                  '%d retries, resyncing' %(oper, num_opers,
+                                            self._PUBLISH_RETRIES)
+        self.config_log(log_str, level=SandeshLevel.SYS_ERR)
+        self._reconnect_and_resync()
+    # end _publish_resync
+
+    def _reconnect_and_resync(self):
+        # this will block till connection is re-established
+        self._reset_cache_and_accumulator()
+        self._init_conn()
+        self._publish_config_root()
+        self._db_client_mgr.db_resync()
+    # end _reconnect_and_resync
+
+    def get_publish_stats(self):
+        stats = dict(self._publish_stats)
+        stats['pending_operations'] = len(self._publish_pending)
+        stats['pending_bytes'] = self._publish_pending_len
+        stats['inflight'] = len(self._publish_inflight)
+        return stats
+    # end get_publish_stats
+
     def _publish_to_ifmap(self, oper, oper_body, async, do_trace=True):
         # safety check, if we proceed ifmap-server reports error
         # asking for update|delete in publish
@@ -361,11 +637,7 @@ class VncIfmapClient(VncIfmapClientGen):
                                name='IfMap', status=ConnectionStatus.DOWN, message='',
                                server_addrs=["%s:%s" % (self._ifmap_srv_ip, self._ifmap_srv_port)])
 
-                # this will block till connection is re-established
-                self._reset_cache_and_accumulator()
-                self._init_conn()
-                self._publish_config_root()
-                self._db_client_mgr.db_resync()
+                self._reconnect_and_resync()
                 return
             else:
                 log_str = 'Failed to publish %s body %s to ifmap: %s' %(oper,
@@ -387,16 +659,14 @@ class VncIfmapClient(VncIfmapClientGen):
                                   other_type="extended")),
                           filter=meta_name))
 
-        self._publish_to_ifmap('delete', del_str, async=False)
+        self._publish_enqueue('delete', del_str, (self_imid,))
 
         # del meta from cache and del id if this was last meta
         if meta_name:
-            prop_name = meta_name.replace('contrail:', '')
-            del self._id_to_metas[self_imid][prop_name]
-            if not self._id_to_metas[self_imid]:
-                del self._id_to_metas[self_imid]
+            self._id_to_metas_discard(self_imid,
+                                      meta_name.replace('contrail:', ''))
         else:
-            del self._id_to_metas[self_imid]
+            self._id_to_metas_discard(self_imid)
     # end _delete_id_self_meta
 
     def _delete_id_pair_meta(self, id1, id2, metadata):
@@ -413,39 +683,72 @@ class VncIfmapClient(VncIfmapClientGen):
                               other_type="extended")),
                       filter=metadata))
 
-        self._publish_to_ifmap('delete', del_str, async=False)
+        self._publish_enqueue('delete', del_str, (id1, id2))
 
         # del meta,id2 from cache and del id if this was last meta
-        def _id_to_metas_delete(id1, id2, meta_name):
-            if id1 not in self._id_to_metas:
-                return
-            if meta_name not in self._id_to_metas[id1]:
-                return
-            if not self._id_to_metas[id1][meta_name]:
-                del self._id_to_metas[id1][meta_name]
-                if not self._id_to_metas[id1]:
-                    del self._id_to_metas[id1]
-                return
-
-            # if meta is prop, noop
-            if 'id' not in self._id_to_metas[id1][meta_name][0]:
-                return
-            self._id_to_metas[id1][meta_name] = \
-                 [{'id':m['id'], 'meta':m['meta']} \
-                 for m in self._id_to_metas[id1][meta_name] if m['id'] != id2]
-
         if metadata:
-            meta_name = metadata.replace('contrail:', '')
-            # replace with remaining refs
-            for (id_x, id_y) in [(id1, id2), (id2, id1)]:
-                _id_to_metas_delete(id_x, id_y, meta_name)
+            meta_names = [metadata.replace('contrail:', '')]
         else: # no meta specified remove all links from id1 to id2
-            for (id_x, id_y) in [(id1, id2), (id2, id1)]:
-                meta_names = self._id_to_metas.get(id_x, {}).keys()
-                for meta_name in meta_names:
-                    _id_to_metas_delete(id_x, id_y, meta_name)
+            meta_names = None
+        for (id_x, id_y) in [(id1, id2), (id2, id1)]:
+            self._id_to_metas_discard(id_x, meta_names, id_y)
     # end _delete_id_pair_meta
 
+    def _id_to_metas_digest(self, imid, meta_name, peer=None):
+        try:
+            return self._id_to_metas[imid][meta_name].peers.get(peer)
+        except KeyError:
+            return None
+    # end _id_to_metas_digest
+
+    def _id_to_metas_set(self, imid, meta_name, peer, digest):
+        imid = self._imids.setdefault(imid, imid)
+        if peer is not None:
+            peer = self._imids.setdefault(peer, peer)
+        metas = self._id_to_metas.get(imid)
+        if metas is None:
+            metas = self._id_to_metas[imid] = {}
+        meta_peers = metas.get(meta_name)
+        if meta_peers is None:
+            meta_peers = metas[meta_name] = IfmapMetaPeers()
+        meta_peers.peers[peer] = digest
+    # end _id_to_metas_set
+
+    def _id_to_metas_discard(self, imid, meta_names=None, peer=None):
+        # with no peer drop the whole metas of the names (all if None),
+        # else only the link to peer; drop imid when left without metas
+        metas = self._id_to_metas.get(imid)
+        if metas is None:
+            return
+        if meta_names is None and peer is None:
+            metas.clear()
+        else:
+            if isinstance(meta_names, basestring):
+                meta_names = [meta_names]
+            for meta_name in list(meta_names or metas):
+                meta_peers = metas.get(meta_name)
+                if meta_peers is None:
+                    continue
+                if peer is None:
+                    del metas[meta_name]
+                    continue
+                meta_peers.peers.pop(peer, None)
+                if not meta_peers.peers:
+                    del metas[meta_name]
+        if not metas:
+            del self._id_to_metas[imid]
+            self._imids.pop(imid, None)
+    # end _id_to_metas_discard
+
+    def _id_to_metas_invalidate(self, imids):
+        # forget the digests of all metas on imids, keeping the metas and
+        # links themselves for the deletes done by the generated code
+        for imid in imids:
+            for meta_peers in self._id_to_metas.get(imid, {}).itervalues():
+                for peer in meta_peers.peers:
+                    meta_peers.peers[peer] = None
+    # end _id_to_metas_invalidate
+
     def _update_id_self_meta(self, update, meta):
         """ update: dictionary of the type
                 update[<id> | 'self'] = list(metadata)
@@ -470,80 +773,47 @@ class VncIfmapClient(VncIfmapClientGen):
 
     def _publish_update(self, self_imid, update):
         if self_imid not in self._id_to_metas:
+            self_imid = self._imids.setdefault(self_imid, self_imid)
             self._id_to_metas[self_imid] = {}
 
-        def _build_request_id_self(imid, metalist):
-            request = ''
-            for m in metalist:
-                request += unicode(PublishUpdateOperation(
-                        id1=unicode(Identity(name=self_imid, type="other",
-                                         other_type="extended")),
-                        metadata=unicode(m),
-                        lifetime='forever'))
-            return request
-
-        def _build_request_id_pair(id1, id2, metalist):
-            request = ''
-            for m in metalist:
-                request += unicode(PublishUpdateOperation(
-                    id1=unicode(Identity(name=id1, type="other",
-                                     other_type="extended")),
-                    id2=unicode(Identity(name=id2, type="other",
-                                     other_type="extended")),
-                    metadata=unicode(m),
-                    lifetime='forever'))
-            return request
-
-        mapclient = self._mapclient
+        # each identity is serialized once and shared by its operations
+        self_id_str = unicode(Identity(name=self_imid, type="other",
+                                       other_type="extended"))
+        # publish only metas that differ from what was last published,
+        # removed ones were already deleted by the generated update code
         requests = []
-        if 'self' in update:
-            metalist = update['self']
-            requests.append(
-                _build_request_id_self(self_imid, metalist))
-
-            # remember what we wrote for diffing during next update
-            for m in metalist:
-                meta_name = m._Metadata__name.replace('contrail:', '')
-                self._id_to_metas[self_imid][meta_name] = [{'meta':m}]
-
-        for id2 in update:
+        ifmap_ids = set([self_imid])
+        for id2, metalist in update.items():
             if id2 == 'self':
-                continue
-            metalist = update[id2]
-            requests.append(
-                _build_request_id_pair(self_imid, id2, metalist))
-
-            # remember what we wrote for diffing during next update
+                peer = None
+            else:
+                peer = id2
+            id2_str = None
             for m in metalist:
+                meta_str = unicode(m)
                 meta_name = m._Metadata__name.replace('contrail:', '')
-                if meta_name in self._id_to_metas[self_imid]:
-                   self._id_to_metas[self_imid][meta_name].append({'meta':m,
-                                                                  'id': id2})
-                else:
-                   self._id_to_metas[self_imid][meta_name] = [{'meta':m,
-                                                               'id': id2}]
-
-                if id2 not in self._id_to_metas:
-                    self._id_to_metas[id2] = {}
-                if meta_name in self._id_to_metas[id2]:
-                   self._id_to_metas[id2][meta_name].append({'meta':m,
-                                                             'id': self_imid})
-                else:
-                   self._id_to_metas[id2][meta_name] = [{'meta':m,
-                                                         'id': self_imid}]
-        if self.accumulator is not None:
-            self.accumulator.append(requests)
-            self.accumulated_request_len += len(requests)
-            if self.accumulated_request_len >= 1024*1024:
-                upd_str = \
-                    ''.join(''.join(request) for request in \
-                        self._ifmap_db.accumulator)
-                self._publish_to_ifmap('update', upd_str, async=True)
-                self.accumulator = []
-                self.accumulated_request_len = 0
-        else:
-            upd_str = ''.join(requests)
-            self._publish_to_ifmap('update', upd_str, async=True)
+                digest = hashlib.md5(meta_str.encode('utf-8')).digest()
+                if self._id_to_metas_digest(
+                        self_imid, meta_name, peer) == digest:
+                    self._publish_stats['unchanged'] += 1
+                    continue
+
+                if peer is not None and id2_str is None:
+                    id2_str = unicode(Identity(name=id2, type="other",
+                                               other_type="extended"))
+                    ifmap_ids.add(id2)
+                requests.append(unicode(PublishUpdateOperation(
+                    id1=self_id_str,
+                    id2=id2_str,
+                    metadata=meta_str,
+                    lifetime='forever')))
+
+                # remember what we wrote for diffing during next update
+                self._id_to_metas_set(self_imid, meta_name, peer, digest)
+                if peer is not None:
+                    self._id_to_metas_set(id2, meta_name, self_imid, digest)
+
+        self._publish_enqueue('update', ''.join(requests), ifmap_ids)
     # end _publish_update
 
     def _search(self, start_id, match_meta=None, result_meta=None,
@@ -648,6 +918,26 @@ class VncServerCassandraClient(VncCassandraClient):
     _USERAGENT_KEYSPACE_NAME = 'useragent'
     _USERAGENT_KV_CF_NAME = 'useragent_keyval_table'
 
+    # walk: number of token range segments scanned in parallel, rows and
+    # columns fetched per get_range page, max concurrent fn invocations
+    # and seconds between progress logs
+    _WALK_SEGMENTS = 8
+    _WALK_PAGE_ROWS = 500
+    _WALK_PAGE_COLUMNS = 1000
+    _WALK_CONCURRENCY = 32
+    _WALK_PROGRESS_INTERVAL = 10
+
+    # walk_by_type: objects read per multiget and max outstanding reads
+    _WALK_READ_BATCH = 100
+    _WALK_READ_CONCURRENCY = 8
+
+    # (min, max) token of supported partitioners, min being the partitioner's
+    # minimum token as ranges exclude their start token
+    _PARTITIONER_TOKEN_RANGES = {
+        'org.apache.cassandra.dht.Murmur3Partitioner': (-2**63, 2**63 - 1),
+        'org.apache.cassandra.dht.RandomPartitioner': (-1, 2**127),
+    }
+
     @classmethod
     def get_db_info(cls):
         db_info = VncCassandraClient.get_db_info() + \
@@ -655,14 +945,16 @@ class VncServerCassandraClient(VncCassandraClient):
         return db_info
     # end get_db_info
 
-    def __init__(self, db_client_mgr, cass_srv_list, reset_config, db_prefix):
+    def __init__(self, db_client_mgr, cass_srv_list, reset_config, db_prefix,
+                 ref_read_batch_size=None):
         self._db_client_mgr = db_client_mgr
         keyspaces = {
             self._USERAGENT_KEYSPACE_NAME: [(self._USERAGENT_KV_CF_NAME, None)]
         }
         super(VncServerCassandraClient, self).__init__(
             cass_srv_list, reset_config, db_prefix,keyspaces, self.config_log,
-            db_client_mgr.generate_url)
+            db_client_mgr.generate_url,
+            fq_name_batch_size=ref_read_batch_size)
         self._useragent_kv_cf = self._cf_dict[self._USERAGENT_KV_CF_NAME]
     # end __init__
 
@@ -873,31 +1165,222 @@ class VncServerCassandraClient(VncCassandraClient):
         self._useragent_kv_cf.remove(key)
     # end useragent_kv_delete
 
-    def walk(self, fn):
+    def _walk_token_ranges(self, num_segments):
+        # split the ring in num_segments (start, finish] token ranges,
+        # whole ring as one segment if partitioner is not known
+        try:
+            sys_mgr = SystemManager(self._server_list[0])
+            partitioner = sys_mgr.describe_partitioner()
+            sys_mgr.close()
+        except Exception as e:
+            partitioner = None
+
+        if (num_segments <= 1 or
+            partitioner not in self._PARTITIONER_TOKEN_RANGES):
+            return [(None, None)]
+
+        (min_token, max_token) = self._PARTITIONER_TOKEN_RANGES[partitioner]
+        step = (max_token - min_token) / num_segments
+        boundaries = [min_token + i * step for i in range(num_segments)]
+        boundaries.append(max_token)
+        return [(str(boundaries[i]), str(boundaries[i+1]))
+                for i in range(num_segments)]
+    # end _walk_token_ranges
+
+    def walk(self, fn, num_segments=None, concurrency=None, columns=None):
+        # fn(obj_uuid, obj_cols) gets the given columns of each row, all of
+        # them if columns is None
+        num_segments = num_segments or self._WALK_SEGMENTS
+        concurrency = concurrency or self._WALK_CONCURRENCY
         walk_results = []
-        for obj_uuid, _ in self._obj_uuid_cf.get_range():
-            obj_cols_iter = self._obj_uuid_cf.xget(obj_uuid)
-            obj_cols = dict((k, v) for k, v in obj_cols_iter)
+        fn_pool = gevent.pool.Pool(concurrency)
+        progress = {'rows': 0, 'start': time.time(), 'logged': time.time()}
+
+        def _log_progress(done=False):
+            now = time.time()
+            if not done and (now - progress['logged'] <
+                             self._WALK_PROGRESS_INTERVAL):
+                return
+            progress['logged'] = now
+            elapsed = (now - progress['start']) or 1e-6
+            msg = 'Cassandra DB walk %s: %d rows in %.1f secs (%.0f rows/sec)' \
+                  %('completed' if done else 'in progress', progress['rows'],
+                    elapsed, progress['rows'] / elapsed)
+            self.config_log(msg, level=SandeshLevel.SYS_INFO)
+
+        def _walk_row(obj_uuid, obj_cols):
             result = fn(obj_uuid, obj_cols)
             if result:
                 walk_results.append(result)
 
+        def _walk_segment(start_token, finish_token):
+            # columns come with the row in the get_range page, only rows
+            # wider than a page need another round-trip
+            range_kwargs = {'buffer_size': self._WALK_PAGE_ROWS}
+            if columns is None:
+                range_kwargs['column_count'] = self._WALK_PAGE_COLUMNS
+            else:
+                range_kwargs['columns'] = columns
+            if start_token is not None:
+                range_kwargs['start_token'] = start_token
+                range_kwargs['finish_token'] = finish_token
+            for obj_uuid, obj_cols in self._obj_uuid_cf.get_range(
+                    **range_kwargs):
+                if not obj_cols:
+                    # range ghost of a deleted row
+                    continue
+                if (columns is None and
+                    len(obj_cols) >= self._WALK_PAGE_COLUMNS):
+                    obj_cols = dict(self._obj_uuid_cf.xget(obj_uuid))
+                # blocks while concurrency fn calls are outstanding
+                fn_pool.spawn(_walk_row, obj_uuid, obj_cols)
+                progress['rows'] += 1
+                _log_progress()
+
+        segment_greenlets = [gevent.spawn(_walk_segment, start, finish)
+            for (start, finish) in self._walk_token_ranges(num_segments)]
+        gevent.joinall(segment_greenlets, raise_error=True)
+        fn_pool.join(raise_error=True)
+        _log_progress(done=True)
+
         return walk_results
     # end walk
+
+    def get_obj_types(self):
+        # types with at least one object, from obj_fq_name_table row keys
+        return [obj_type for obj_type, _ in
+                self._obj_fq_name_cf.get_range(column_count=1)]
+    # end get_obj_types
+
+    def walk_by_type(self, fn, err_fn, obj_types):
+        """Read all objects of obj_types and call fn(obj_type, obj_uuid,
+        obj_dict) for each, parents before children.
+
+        Objects are found through obj_fq_name_table and ordered by fq_name
+        depth, then type, then fq_name, so the order is deterministic and
+        every object follows its parent. Objects missing from
+        obj_fq_name_table are found by a key scan of obj_uuid_table,
+        logged and called last. Each object row is read once, in
+        batched multigets that run concurrently while fn is called in
+        order. err_fn(obj_type, obj_uuid, err_str) reports read failures.
+        """
+        obj_types = set(obj_types)
+        # depth -> type -> list of (fq_name_str, uuid)
+        levels = {}
+        indexed_uuids = set()
+        for obj_type in obj_types:
+            for col_name, _ in self._obj_fq_name_cf.xget(obj_type):
+                (fq_name_str, obj_uuid) = col_name.rsplit(':', 1)
+                # non-ascii names are stored quoted, separators included.
+                # A ':' within a name still counts as a level, but a
+                # child's name extends its parent's so it stays deeper.
+                fq_name_str = utils.decode_string(fq_name_str)
+                depth = len(fq_name_str.split(':')) - 1
+                levels.setdefault(depth, {}).setdefault(
+                    obj_type, []).append((fq_name_str, obj_uuid))
+                indexed_uuids.add(obj_uuid)
+
+        def _unindexed_row(obj_uuid, obj_cols):
+            if obj_uuid in indexed_uuids:
+                return None
+            try:
+                obj_type = json.loads(obj_cols['type'])
+            except Exception as e:
+                return None
+            if obj_type in obj_types:
+                return (obj_type, obj_uuid)
+            return None
+
+        unindexed = self.walk(_unindexed_row, columns=['type'])
+        if unindexed:
+            msg = 'Cassandra DB walk by type: %d objects missing from %s: ' \
+                  '%s' %(len(unindexed), self._OBJ_FQ_NAME_CF_NAME,
+                         ' '.join('%s %s' % obj for obj in unindexed))
+            self.config_log(msg, level=SandeshLevel.SYS_WARN)
+            depth = max(levels or [0]) + 1
+            for (obj_type, obj_uuid) in unindexed:
+                levels.setdefault(depth, {}).setdefault(
+                    obj_type, []).append((obj_uuid, obj_uuid))
+
+        def _read_batch(batch):
+            (obj_type, obj_uuids) = batch
+            try:
+                (ok, obj_dicts) = self.read(obj_type, obj_uuids)
+                return (obj_type, obj_uuids, obj_dicts, {})
+            except Exception as e:
+                pass
+
+            # isolate the failing object(s) of the batch, objects deleted
+            # since the fq_name table was read are skipped
+            obj_dicts = []
+            errors = {}
+            for obj_uuid in obj_uuids:
+                try:
+                    (ok, result) = self.read(obj_type, [obj_uuid])
+                    obj_dicts.extend(result)
+                except NoIdError:
+                    pass
+                except Exception as e:
+                    errors[obj_uuid] = str(e)
+            return (obj_type, obj_uuids, obj_dicts, errors)
+
+        read_pool = gevent.pool.Pool(self._WALK_READ_CONCURRENCY)
+        batch_size = self._WALK_READ_BATCH
+        num_objs = 0
+        start_time = time.time()
+        for depth in sorted(levels):
+            batches = []
+            for obj_type in sorted(levels[depth]):
+                obj_uuids = [obj_uuid for _, obj_uuid in
+                             sorted(levels[depth][obj_type])]
+                batches.extend((obj_type, obj_uuids[i:i+batch_size])
+                               for i in range(0, len(obj_uuids), batch_size))
+
+            # reads run ahead concurrently, results come back in order
+            for (obj_type, obj_uuids, obj_dicts, errors) in read_pool.imap(
+                    _read_batch, batches):
+                obj_dicts = dict((obj_dict['uuid'], obj_dict)
+                                 for obj_dict in obj_dicts)
+                for obj_uuid in obj_uuids:
+                    if obj_uuid in errors:
+                        err_fn(obj_type, obj_uuid, errors[obj_uuid])
+                    elif obj_uuid in obj_dicts:
+                        fn(obj_type, obj_uuid, obj_dicts[obj_uuid])
+                        num_objs += 1
+
+            elapsed = (time.time() - start_time) or 1e-6
+            msg = 'Cassandra DB walk by type: depth %d done, %d objects in ' \
+                  '%.1f secs (%.0f objects/sec)' \
+                  %(depth + 1, num_objs, elapsed, num_objs / elapsed)
+            self.config_log(msg, level=SandeshLevel.SYS_INFO)
+    # end walk_by_type
 # end class VncCassandraClient
 
 
 class VncServerKombuClient(VncKombuClient):
+    # seconds an UPDATE notification waits for later ones on the same uuid
+    _UPDATE_COALESCE_WINDOW = 0.1
+
     def __init__(self, db_client_mgr, rabbit_ip, rabbit_port, ifmap_db,
-                 rabbit_user, rabbit_password, rabbit_vhost, rabbit_ha_mode):
+                 rabbit_user, rabbit_password, rabbit_vhost, rabbit_ha_mode,
+                 publish_envelope=False):
         self._db_client_mgr = db_client_mgr
         self._sandesh = db_client_mgr._sandesh
         self._ifmap_db = ifmap_db
+        # UPDATEs waiting for the coalesce window, uuid -> latest oper_info
+        # in order of first arrival. Notifications are processed under
+        # _notification_lock, pending UPDATEs being flushed ahead of any
+        # CREATE/DELETE so those stay ordered with respect to updates.
+        self._pending_updates = collections.OrderedDict()
+        self._pending_updates_flusher = None
+        self._notification_lock = Semaphore()
+        self.coalesced_updates = 0
         listen_port = db_client_mgr.get_server_port()
         q_name = 'vnc_config.%s-%s' %(socket.gethostname(), listen_port)
         super(VncServerKombuClient, self).__init__(
             rabbit_ip, rabbit_port, rabbit_user, rabbit_password, rabbit_vhost,
-            rabbit_ha_mode, q_name, self._dbe_subscribe_callback, self.config_log)
+            rabbit_ha_mode, q_name, self._dbe_subscribe_callback, self.config_log,
+            publish_envelope)
 
     # end __init__
 
@@ -928,6 +1411,44 @@ class VncServerKombuClient(VncKombuClient):
 
     def _dbe_subscribe_callback(self, oper_info):
         self._db_client_mgr.wait_for_resync_done()
+        if oper_info['oper'] == 'UPDATE':
+            self._dbe_update_coalesce(oper_info)
+            return
+
+        with self._notification_lock:
+            self._dbe_flush_pending_updates()
+            self._dbe_handle_notification(oper_info)
+    #end _dbe_subscribe_callback
+
+    def _dbe_update_coalesce(self, oper_info):
+        # an update notification only triggers a re-read, so of several
+        # pending for a uuid only the latest needs handling. A flush in
+        # progress, which ifmap publish back-pressure may hold up, holds
+        # up the consumer too.
+        self._notification_lock.wait()
+        obj_uuid = oper_info['uuid']
+        if obj_uuid in self._pending_updates:
+            self.coalesced_updates += 1
+        self._pending_updates[obj_uuid] = oper_info
+        if self._pending_updates_flusher is None:
+            self._pending_updates_flusher = gevent.spawn_later(
+                self._UPDATE_COALESCE_WINDOW,
+                self._dbe_pending_updates_timer)
+    # end _dbe_update_coalesce
+
+    def _dbe_pending_updates_timer(self):
+        with self._notification_lock:
+            self._pending_updates_flusher = None
+            self._dbe_flush_pending_updates()
+    # end _dbe_pending_updates_timer
+
+    def _dbe_flush_pending_updates(self):
+        while self._pending_updates:
+            _, oper_info = self._pending_updates.popitem(last=False)
+            self._dbe_handle_notification(oper_info)
+    # end _dbe_flush_pending_updates
+
+    def _dbe_handle_notification(self, oper_info):
         try:
             msg = "Notification Message: %s" %(pformat(oper_info))
             self.config_log(msg, level=SandeshLevel.SYS_DEBUG)
@@ -949,7 +1470,7 @@ class VncServerKombuClient(VncKombuClient):
                 level=SandeshLevel.SYS_ERR)
             trace_msg(trace, name='MessageBusNotifyTraceBuf',
                               sandesh=self._sandesh, error_msg=errmsg)
-    #end _dbe_subscribe_callback
+    # end _dbe_handle_notification
 
     def dbe_create_publish(self, obj_type, obj_ids, obj_dict):
         req_id = get_trace_id()
@@ -963,6 +1484,7 @@ class VncServerKombuClient(VncKombuClient):
 
     def _dbe_create_notification(self, obj_info):
         obj_dict = obj_info['obj_dict']
+        self._db_client_mgr.dbe_cache_invalidate(obj_info, obj_dict)
 
         try:
             r_class = self._db_client_mgr.get_resource_class(obj_info['type'])
@@ -988,11 +1510,14 @@ class VncServerKombuClient(VncKombuClient):
     # end dbe_update_publish
 
     def _dbe_update_notification(self, obj_info):
+        self._db_client_mgr.dbe_cache_invalidate(obj_info)
         (ok, result) = self._db_client_mgr.dbe_read(obj_info['type'], obj_info)
         if not ok:
             raise Exception(result)
 
         new_obj_dict = result
+        # back-refs of objects newly referred by this one have changed
+        self._db_client_mgr.dbe_cache_invalidate_refs(new_obj_dict)
 
         try:
             r_class = self._db_client_mgr.get_resource_class(obj_info['type'])
@@ -1023,6 +1548,7 @@ class VncServerKombuClient(VncKombuClient):
 
         db_client_mgr = self._db_client_mgr
         db_client_mgr._cassandra_db.cache_uuid_to_fq_name_del(obj_dict['uuid'])
+        db_client_mgr.dbe_cache_invalidate(obj_info, obj_dict)
 
         try:
             r_class = self._db_client_mgr.get_resource_class(obj_info['type'])
@@ -1170,19 +1696,34 @@ class VncDbClient(object):
 
         self._db_resync_done = gevent.event.Event()
 
+        # Cache of object reads keyed by uuid, value is a dict of
+        # requested field set to json encoded read result
+        self._obj_cache = utils.CacheContainer(
+            int(api_svr_mgr._args.object_cache_entries),
+            int(api_svr_mgr._args.object_cache_ttl) or None)
+        # uuids with reads in flight, and those invalidated meanwhile
+        # whose (possibly stale) read result must not be cached
+        self._obj_cache_pending_reads = {}
+        self._obj_cache_stale = set()
+
         msg = "Connecting to ifmap on %s:%s as %s" \
               % (ifmap_srv_ip, ifmap_srv_port, uname)
         self.config_log(msg, level=SandeshLevel.SYS_NOTICE)
 
         self._ifmap_db = VncIfmapClient(
             self, ifmap_srv_ip, ifmap_srv_port,
-            uname, passwd, ssl_options, ifmap_srv_loc)
+            uname, passwd, ssl_options, ifmap_srv_loc,
+            int(api_svr_mgr._args.ifmap_publish_batch_size),
+            float(api_svr_mgr._args.ifmap_publish_flush_interval),
+            int(api_svr_mgr._args.ifmap_publish_max_inflight),
+            int(api_svr_mgr._args.ifmap_publish_buffer_size))
 
         msg = "Connecting to cassandra on %s" % (cass_srv_list,)
         self.config_log(msg, level=SandeshLevel.SYS_NOTICE)
 
         self._cassandra_db = VncServerCassandraClient(
-            self, cass_srv_list, reset_config, db_prefix)
+            self, cass_srv_list, reset_config, db_prefix,
+            int(api_svr_mgr._args.ref_read_batch_size))
 
         msg = "Connecting to zookeeper on %s" % (zk_server_ip)
         self.config_log(msg, level=SandeshLevel.SYS_NOTICE)
@@ -1190,9 +1731,9 @@ class VncDbClient(object):
                                   reset_config, db_prefix, self.config_log)
 
         self._msgbus = VncServerKombuClient(self, rabbit_servers,
-                                            rabbit_port, self._ifmap_db,
-                                            rabbit_user, rabbit_password,
-                                            rabbit_vhost, rabbit_ha_mode)
+            rabbit_port, self._ifmap_db, rabbit_user, rabbit_password,
+            rabbit_vhost, rabbit_ha_mode,
+            api_svr_mgr._args.rabbit_publish_envelope)
     # end __init__
 
     def _update_default_quota(self):
@@ -1219,7 +1760,11 @@ class VncDbClient(object):
         self._ifmap_db.accumulator = []
         self._ifmap_db.accumulated_request_len = 0
         start_time = datetime.datetime.utcnow()
-        self._cassandra_db.walk(self._dbe_resync)
+        # types that have no ifmap representation need not be read at all
+        obj_types = [obj_type for obj_type in self._cassandra_db.get_obj_types()
+                     if hasattr(self._ifmap_db, '_ifmap_%s_create' % (obj_type))]
+        self._cassandra_db.walk_by_type(self._dbe_resync,
+                                        self._dbe_resync_read_error, obj_types)
         self.config_log("Cassandra DB walk completed.",
             level=SandeshLevel.SYS_INFO)
         self._ifmap_db.publish_accumulated()
@@ -1236,14 +1781,16 @@ class VncDbClient(object):
 
     def db_check(self):
         # Read contents from cassandra and report any read exceptions
-        check_results = self._cassandra_db.walk(self._dbe_check)
+        check_results = self._cassandra_db.walk(self._dbe_check,
+                                                columns=['type'])
 
         return check_results
     # end db_check
 
     def db_read(self):
         # Read contents from cassandra
-        read_results = self._cassandra_db.walk(self._dbe_read)
+        read_results = self._cassandra_db.walk(self._dbe_read,
+                                               columns=['type'])
         return read_results
     # end db_check
 
@@ -1320,15 +1867,16 @@ class VncDbClient(object):
         if updated and do_update:
             self._cassandra_db._cassandra_virtual_network_update(vn_uuid,
                                                                  vn_dict)
+            self.dbe_cache_invalidate({'uuid': vn_uuid})
     # end update_subnet_uuid
 
-    def _dbe_resync(self, obj_uuid, obj_cols):
-        obj_type = None
-        try:
-            obj_type = json.loads(obj_cols['type'])
-            (ok, obj_dicts) = self._cassandra_db.read(obj_type, [obj_uuid])
-            obj_dict = obj_dicts[0]
+    def _dbe_resync_read_error(self, obj_type, obj_uuid, err_str):
+        self.config_object_error(
+            obj_uuid, None, obj_type, 'dbe_resync:cassandra_read', err_str)
+    # end _dbe_resync_read_error
 
+    def _dbe_resync(self, obj_type, obj_uuid, obj_dict):
+        try:
             # TODO remove backward compat (use RT instead of VN->LR ref)
             if (obj_type == 'virtual_network' and
                 'logical_router_refs' in obj_dict):
@@ -1336,6 +1884,8 @@ class VncDbClient(object):
                     self._cassandra_db._delete_ref(None, obj_type, obj_uuid,
                                                    'logical_router',
                                                    router['uuid'])
+                    self.dbe_cache_invalidate({'uuid': router['uuid']})
+                self.dbe_cache_invalidate({'uuid': obj_uuid})
 
             if (obj_type == 'virtual_network' and
                 'network_ipam_refs' in obj_dict):
@@ -1452,6 +2002,7 @@ class VncDbClient(object):
     def dbe_create(self, obj_type, obj_ids, obj_dict):
         method_name = obj_type.replace('-', '_')
         (ok, result) = self._cassandra_db.create(method_name, obj_ids, obj_dict)
+        self.dbe_cache_invalidate(obj_ids, obj_dict)
 
         # publish to ifmap via msgbus
         self._msgbus.dbe_create_publish(obj_type, obj_ids, obj_dict)
@@ -1461,12 +2012,35 @@ class VncDbClient(object):
 
     # input id is ifmap-id + uuid
     def dbe_read(self, obj_type, obj_ids, obj_fields=None):
+        obj_uuid = obj_ids['uuid']
+        if obj_fields is not None:
+            fields_key = frozenset(obj_fields)
+        else:
+            fields_key = None
+
+        cached_reads = self._obj_cache.get(obj_uuid)
+        if cached_reads and fields_key in cached_reads:
+            return (True, json.loads(cached_reads[fields_key]))
+
         method_name = obj_type.replace('-', '_')
+        pending_reads = self._obj_cache_pending_reads
+        pending_reads[obj_uuid] = pending_reads.get(obj_uuid, 0) + 1
         try:
             (ok, cassandra_result) = self._cassandra_db.read(method_name,
-                                                             [obj_ids['uuid']], obj_fields)
+                                                             [obj_uuid], obj_fields)
         except NoIdError as e:
             return (False, str(e))
+        finally:
+            pending_reads[obj_uuid] -= 1
+            if not pending_reads[obj_uuid]:
+                del pending_reads[obj_uuid]
+                stale = obj_uuid in self._obj_cache_stale
+                self._obj_cache_stale.discard(obj_uuid)
+            else:
+                stale = obj_uuid in self._obj_cache_stale
+
+        if ok and not stale:
+            self._obj_cache_set(obj_uuid, fields_key, cassandra_result[0])
 
         return (ok, cassandra_result[0])
     # end dbe_read
@@ -1496,6 +2070,7 @@ class VncDbClient(object):
     def dbe_update(self, obj_type, obj_ids, new_obj_dict):
         method_name = obj_type.replace('-', '_')
         (ok, cassandra_result) = self._cassandra_db.update(method_name, obj_ids['uuid'], new_obj_dict)
+        self.dbe_cache_invalidate(obj_ids, new_obj_dict)
 
         # publish to ifmap via redis
         self._msgbus.dbe_update_publish(obj_type, obj_ids)
@@ -1517,6 +2092,7 @@ class VncDbClient(object):
     def dbe_delete(self, obj_type, obj_ids, obj_dict):
         method_name = obj_type.replace('-', '_')
         (ok, cassandra_result) = self._cassandra_db.delete(method_name, obj_ids['uuid'])
+        self.dbe_cache_invalidate(obj_ids, obj_dict)
 
         # publish to ifmap via redis
         self._msgbus.dbe_delete_publish(obj_type, obj_ids, obj_dict)
@@ -1532,10 +2108,77 @@ class VncDbClient(object):
         self._zk_db.delete_fq_name_to_uuid_mapping(obj_type, obj_fq_name)
     # end dbe_release
 
-    def dbe_cache_invalidate(self, obj_ids):
-        pass
+    def _obj_cache_set(self, obj_uuid, fields_key, obj_dict):
+        # a field set read later expires with those cached before it, the
+        # ttl bounding the age of the oldest read for missed notifications
+        cached_reads = self._obj_cache.peek(obj_uuid)
+        if cached_reads is None:
+            cached_reads = {}
+        cached_reads[fields_key] = json.dumps(obj_dict)
+        self._obj_cache.replace(obj_uuid, cached_reads)
+    # end _obj_cache_set
+
+    def _obj_cache_ref_uuids(self, obj_dict):
+        # uuids whose back-refs/children change with obj_dict
+        ref_uuids = set()
+        if not obj_dict:
+            return ref_uuids
+        if obj_dict.get('parent_uuid'):
+            ref_uuids.add(obj_dict['parent_uuid'])
+        for field, value in obj_dict.items():
+            if not field.endswith('_refs') or not isinstance(value, list):
+                continue
+            for ref in value:
+                if isinstance(ref, dict) and ref.get('uuid'):
+                    ref_uuids.add(ref['uuid'])
+        return ref_uuids
+    # end _obj_cache_ref_uuids
+
+    def dbe_cache_invalidate(self, obj_ids, obj_dict=None):
+        """Drop cached reads of obj_ids['uuid'] and, if obj_dict is given,
+        of its parent and referred objects (their children/back-refs).
+        """
+        obj_uuid = obj_ids['uuid']
+        stale_uuids = set([obj_uuid])
+        stale_uuids |= self._obj_cache_ref_uuids(obj_dict)
+        # refs recorded in cached version may be gone in the new version
+        for cached_json in (self._obj_cache.peek(obj_uuid) or {}).values():
+            stale_uuids |= self._obj_cache_ref_uuids(json.loads(cached_json))
+
+        for stale_uuid in stale_uuids:
+            self._obj_cache_evict(stale_uuid)
     # end dbe_cache_invalidate
 
+    def dbe_cache_invalidate_refs(self, obj_dict):
+        for stale_uuid in self._obj_cache_ref_uuids(obj_dict):
+            self._obj_cache_evict(stale_uuid)
+    # end dbe_cache_invalidate_refs
+
+    def _obj_cache_evict(self, obj_uuid):
+        self._obj_cache.pop(obj_uuid)
+        if obj_uuid in self._obj_cache_pending_reads:
+            self._obj_cache_stale.add(obj_uuid)
+    # end _obj_cache_evict
+
+    def get_cache_stats(self):
+        # list of (cache name, counters) for introspect
+        obj_cache = self._obj_cache
+        obj_cache_stats = {'entries': len(obj_cache),
+                           'max_entries': obj_cache.container_size,
+                           'hits': obj_cache.hits,
+                           'misses': obj_cache.misses,
+                           'evictions': obj_cache.evictions,
+                           'expirations': obj_cache.expirations,
+                           'invalidations': obj_cache.invalidations}
+        return [('object', obj_cache_stats),
+                ('uuid_to_fq_name',
+                 self._cassandra_db.get_fq_name_cache_stats())]
+    # end get_cache_stats
+
+    def get_ifmap_publish_stats(self):
+        return self._ifmap_db.get_publish_stats()
+    # end get_ifmap_publish_stats
+
     def dbe_oper_publish_pending(self):
         return self._msgbus.dbe_oper_publish_pending()
     # end dbe_oper_publish_pending
@@ -1614,6 +2257,8 @@ class VncDbClient(object):
 
     def ref_update(self, obj_type, obj_uuid, ref_type, ref_uuid, ref_data, operation):
         self._cassandra_db.ref_update(obj_type, obj_uuid, ref_type, ref_uuid, ref_data, operation)
+        self.dbe_cache_invalidate({'uuid': obj_uuid})
+        self.dbe_cache_invalidate({'uuid': ref_uuid})
         self._msgbus.dbe_update_publish(obj_type.replace('_', '-'), {'uuid':obj_uuid})
         return obj_uuid
     # ref_update
@@ -0,0 +1,78 @@
+#
+# Copyright (c) 2015 Juniper Networks, Inc. All rights reserved.
+#
+import unittest
+
+from cfgm_common.utils import CacheContainer
+
+
+class FakeTimer(object):
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class CacheContainerTest(unittest.TestCase):
+    def test_lru_eviction(self):
+        cache = CacheContainer(2)
+        cache['a'] = 1
+        cache['b'] = 2
+        # touch 'a' so 'b' becomes least recently used
+        self.assertEqual(cache['a'], 1)
+        cache['c'] = 3
+        self.assertNotIn('b', cache)
+        self.assertIn('a', cache)
+        self.assertIn('c', cache)
+        self.assertEqual(cache.evictions, 1)
+
+    def test_ttl_expiry(self):
+        timer = FakeTimer()
+        cache = CacheContainer(10, ttl=5, timer=timer)
+        cache['a'] = 1
+        timer.now = 4
+        self.assertEqual(cache.get('a'), 1)
+        timer.now = 5
+        self.assertIsNone(cache.get('a'))
+        self.assertNotIn('a', cache)
+        self.assertEqual(cache.expirations, 1)
+
+    def test_replace_keeps_expiry(self):
+        timer = FakeTimer()
+        cache = CacheContainer(10, ttl=5, timer=timer)
+        cache.replace('a', {'x': 1})
+        timer.now = 3
+        value = cache.peek('a')
+        value['y'] = 2
+        cache.replace('a', value)
+        timer.now = 4
+        self.assertEqual(cache.get('a'), {'x': 1, 'y': 2})
+        # expires 5s after it was first set, not after the replace
+        timer.now = 5
+        self.assertIsNone(cache.peek('a'))
+        self.assertIsNone(cache.get('a'))
+
+        # an expired entry is replaced with a fresh expiry
+        cache['b'] = 1
+        timer.now = 10
+        cache.replace('b', 2)
+        timer.now = 14
+        self.assertEqual(cache.get('b'), 2)
+
+    def test_counters(self):
+        cache = CacheContainer(10)
+        cache['a'] = 1
+        cache.get('a')
+        cache.get('b')
+        self.assertRaises(KeyError, cache.__getitem__, 'b')
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(cache.misses, 2)
+        self.assertEqual(cache.pop('a'), 1)
+        self.assertEqual(cache.invalidations, 1)
+        self.assertEqual(len(cache), 0)
+
+    def test_zero_size_disables(self):
+        cache = CacheContainer(0)
+        cache['a'] = 1
+        self.assertEqual(len(cache), 0)
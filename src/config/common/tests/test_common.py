@@ -191,7 +191,8 @@ def setup_common_flexmock():
 
     flexmock(pycassa.system_manager.Connection, __init__=stub)
     flexmock(pycassa.system_manager.SystemManager, create_keyspace=stub,
-             create_column_family=stub)
+             create_column_family=stub, describe_partitioner=stub,
+             close=stub)
     flexmock(pycassa.ConnectionPool, __init__=stub)
     flexmock(pycassa.ColumnFamily, __new__=FakeCF)
     flexmock(pycassa.util, convert_uuid_to_time=Fake_uuid_to_time)
@@ -1,3 +1,5 @@
 from test_analytics_client import *
 from test_importutils import *
+from test_cache_container import *
+from test_vnc_kombu import *
 from fake import *
@@ -149,6 +149,8 @@ class FakeCF(object):
             try:
                 result[key] = {}
                 for col_name in self._rows[key]:
+                    if columns and col_name not in columns:
+                        continue
                     if not self._column_within_range(col_name,
                                         column_start, column_finish):
                         continue
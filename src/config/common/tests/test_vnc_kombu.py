@@ -0,0 +1,46 @@
+#
+# Copyright (c) 2015 Juniper Networks, Inc. All rights reserved.
+#
+import mock
+import unittest
+
+from cfgm_common import vnc_kombu
+
+
+class VncKombuSubscribeTest(unittest.TestCase):
+    def setUp(self):
+        super(VncKombuSubscribeTest, self).setUp()
+        self.received = []
+        self.client = vnc_kombu.VncKombuClientBase.__new__(
+            vnc_kombu.VncKombuClientBase)
+        self.client._subscribe_cb = self.received.append
+        self.client._logger = mock.MagicMock()
+
+    def test_envelope_unpacked_in_order(self):
+        body = {vnc_kombu.ENVELOPE_VERSION_KEY: vnc_kombu.ENVELOPE_VERSION,
+                vnc_kombu.ENVELOPE_MESSAGES_KEY: [{'oper': 'CREATE'},
+                                                  {'oper': 'DELETE'}]}
+        message = mock.MagicMock()
+        self.client._subscribe(body, message)
+        self.assertEqual(self.received,
+                         [{'oper': 'CREATE'}, {'oper': 'DELETE'}])
+        message.ack.assert_called_once_with()
+
+    def test_bare_message(self):
+        message = mock.MagicMock()
+        self.client._subscribe({'oper': 'UPDATE'}, message)
+        self.assertEqual(self.received, [{'oper': 'UPDATE'}])
+        message.ack.assert_called_once_with()
+
+    def test_failed_message_does_not_drop_batch(self):
+        def subscribe_cb(msg):
+            if msg['oper'] == 'CREATE':
+                raise Exception('fake callback failure')
+            self.received.append(msg)
+        self.client._subscribe_cb = subscribe_cb
+        body = {vnc_kombu.ENVELOPE_VERSION_KEY: vnc_kombu.ENVELOPE_VERSION,
+                vnc_kombu.ENVELOPE_MESSAGES_KEY: [{'oper': 'CREATE'},
+                                                  {'oper': 'UPDATE'}]}
+        self.client._subscribe(body, mock.MagicMock())
+        self.assertEqual(self.received, [{'oper': 'UPDATE'}])
+        self.assertTrue(self.client._logger.called)
@@ -21,6 +21,8 @@
 # @author: Numan Siddique, eNovance.
 
 
+import collections
+import time
 import urllib
 
 def encode_string(enc_str, encoding='utf-8'):
@@ -61,3 +63,109 @@ def decode_string(dec_str, encoding='utf-8'):
         return ret_dec_str.decode(encoding)
     except Exception:
         return dec_str
+
+
+class CacheContainer(object):
+    """LRU mapping bounded by number of entries and optionally by age.
+
+    Entries older than ttl seconds are treated as misses and dropped on
+    access. Hit/miss/eviction counters are kept for introspection.
+    """
+    def __init__(self, size, ttl=None, timer=time.time):
+        self.container_size = size
+        self.ttl = ttl
+        self._timer = timer
+        self.dictionary = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key, default=None):
+        try:
+            value, expiry = self.dictionary.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+
+        if self._expired(expiry):
+            self.expirations += 1
+            self.misses += 1
+            return default
+
+        # item accessed - move it to the most recently used end
+        self.dictionary[key] = (value, expiry)
+        self.hits += 1
+        return value
+
+    def __getitem__(self, key):
+        value = self.get(key, self)
+        if value is self:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        if self.container_size <= 0:
+            return
+        if self.ttl:
+            expiry = self._timer() + self.ttl
+        else:
+            expiry = None
+        self.dictionary.pop(key, None)
+        self.dictionary[key] = (value, expiry)
+        while len(self.dictionary) > self.container_size:
+            # container is full, lose the least recently used item
+            self.dictionary.popitem(last=False)
+            self.evictions += 1
+
+    def replace(self, key, value):
+        # set value keeping the expiry of a live entry of key, so that
+        # updating an entry does not extend its life
+        try:
+            _, expiry = self.dictionary[key]
+        except KeyError:
+            expiry = None
+        else:
+            if self._expired(expiry):
+                expiry = None
+        if expiry is None:
+            self[key] = value
+            return
+        self.dictionary.pop(key)
+        self.dictionary[key] = (value, expiry)
+
+    def _expired(self, expiry):
+        return expiry is not None and expiry <= self._timer()
+
+    def __contains__(self, key):
+        return key in self.dictionary
+
+    def __len__(self):
+        return len(self.dictionary)
+
+    def peek(self, key, default=None):
+        # lookup of a live entry without touching LRU order or counters
+        try:
+            value, expiry = self.dictionary[key]
+        except KeyError:
+            return default
+        if self._expired(expiry):
+            return default
+        return value
+
+    def pop(self, key, default=None):
+        try:
+            value, _ = self.dictionary.pop(key)
+        except KeyError:
+            return default
+        self.invalidations += 1
+        return value
+
+    def clear(self):
+        self.invalidations += len(self.dictionary)
+        self.dictionary.clear()
+
+    def __repr__(self):
+        return str(self.dictionary)
+# end class CacheContainer
@@ -14,8 +14,11 @@ from pysandesh.connection_info import ConnectionState
 from pysandesh.gen_py.process_info.ttypes import ConnectionStatus, \
     ConnectionType
 from pysandesh.gen_py.sandesh.ttypes import SandeshLevel
+import gevent
+import gevent.pool
 import time
 import json
+import uuid
 import utils
 
 class VncCassandraClient(VncCassandraClientGen):
@@ -28,6 +31,14 @@ class VncCassandraClient(VncCassandraClientGen):
     # TODO describe layout
     _OBJ_FQ_NAME_CF_NAME = 'obj_fq_name_table'
 
+    # Max entries in uuid to (fq_name, type) cache
+    _FQ_NAME_CACHE_SIZE = 100000
+
+    # Max uuids per multiget when filling the fq_name cache, and max
+    # multigets of a single fill outstanding at a time
+    _FQ_NAME_BATCH_SIZE = 500
+    _FQ_NAME_BATCH_CONCURRENCY = 4
+
     @classmethod
     def get_db_info(cls):
         db_info = [(cls._UUID_KEYSPACE_NAME, [cls._OBJ_UUID_CF_NAME,
@@ -36,10 +47,20 @@ class VncCassandraClient(VncCassandraClientGen):
     # end get_db_info
 
     def __init__(self, server_list, reset_config, db_prefix, keyspaces, logger,
-                 generate_url=None):
+                 generate_url=None, fq_name_cache_size=None,
+                 fq_name_batch_size=None):
         super(VncCassandraClient, self).__init__()
         self._reset_config = reset_config
-        self._cache_uuid_to_fq_name = {}
+        self._fq_name_batch_size = (fq_name_batch_size or
+                                    self._FQ_NAME_BATCH_SIZE)
+        # keyed by 16 byte uuid, value is (fq_name tuple, obj_type)
+        self._cache_uuid_to_fq_name = utils.CacheContainer(
+            fq_name_cache_size or self._FQ_NAME_CACHE_SIZE)
+        # parent fq_name prefixes shared by all cached fq_names
+        self._fq_name_prefixes = utils.CacheContainer(
+            fq_name_cache_size or self._FQ_NAME_CACHE_SIZE)
+        # greenlet to list of ref/child/back-ref infos awaiting fq_name
+        self._deferred_fq_names = {}
         if db_prefix:
             self._db_prefix = '%s_' %(db_prefix)
         else:
@@ -59,9 +80,16 @@ class VncCassandraClient(VncCassandraClientGen):
         if keyspaces:
             self._keyspaces.update(keyspaces)
         self._cassandra_init(server_list)
-        self._cache_uuid_to_fq_name = {}
         self._obj_uuid_cf = self._cf_dict[self._OBJ_UUID_CF_NAME]
         self._obj_fq_name_cf = self._cf_dict[self._OBJ_FQ_NAME_CF_NAME]
+
+        # resolve fq_names of all refs/children/back-refs of an object read
+        # with one multiget instead of one get per referred uuid
+        for method_name in dir(self):
+            if (method_name.startswith('_cassandra_') and
+                method_name.endswith('_read')):
+                setattr(self, method_name,
+                        self._batch_fq_name_reads(getattr(self, method_name)))
     # end __init__
 
     def _update_sandesh_status(self, status, msg=''):
@@ -184,39 +212,113 @@ class VncCassandraClient(VncCassandraClientGen):
         self._logger(msg, level=SandeshLevel.SYS_NOTICE)
     # end _cassandra_init_conn_pools
 
-    def cache_uuid_to_fq_name_add(self, id, fq_name):
-        self._cache_uuid_to_fq_name[id] = fq_name
+    @staticmethod
+    def _fq_name_cache_key(id):
+        try:
+            return uuid.UUID(id).bytes
+        except (ValueError, TypeError, AttributeError):
+            return id
+    # end _fq_name_cache_key
+
+    def _intern_fq_name(self, fq_name):
+        parent_fq_name = tuple(fq_name[:-1])
+        interned = self._fq_name_prefixes.peek(parent_fq_name)
+        if interned is None:
+            interned = parent_fq_name
+            self._fq_name_prefixes[interned] = interned
+        return interned + tuple(fq_name[-1:])
+    # end _intern_fq_name
+
+    def cache_uuid_to_fq_name_add(self, id, fq_name, obj_type=None):
+        cached = (self._intern_fq_name(fq_name), obj_type)
+        self._cache_uuid_to_fq_name[self._fq_name_cache_key(id)] = cached
+        return cached
     # end cache_uuid_to_fq_name_add
 
     def cache_uuid_to_fq_name_del(self, id):
-        try:
-            del self._cache_uuid_to_fq_name[id]
-        except KeyError:
-            pass
+        self._cache_uuid_to_fq_name.pop(self._fq_name_cache_key(id))
     # end cache_uuid_to_fq_name_del
 
+    def get_fq_name_cache_stats(self):
+        cache = self._cache_uuid_to_fq_name
+        return {'entries': len(cache),
+                'max_entries': cache.container_size,
+                'hits': cache.hits,
+                'misses': cache.misses,
+                'evictions': cache.evictions,
+                'expirations': cache.expirations,
+                'invalidations': cache.invalidations}
+    # end get_fq_name_cache_stats
+
+    def _cache_uuid_to_fq_name_fill(self, ids):
+        # fetch fq_name and type of ids missing from cache in one multiget,
+        # returns dict of id to (fq_name tuple, obj_type) for ids found
+        found = {}
+        missing = []
+        for id in ids:
+            cached = self._cache_uuid_to_fq_name.get(
+                self._fq_name_cache_key(id))
+            if cached is None:
+                missing.append(id)
+            else:
+                found[id] = cached
+
+        if not missing:
+            return found
+
+        for obj_rows in self._multiget_batched(missing, ['fq_name', 'type']):
+            for id, obj_cols in obj_rows.items():
+                if 'fq_name' not in obj_cols:
+                    continue
+                fq_name = json.loads(obj_cols['fq_name'][0])
+                obj_type = None
+                if 'type' in obj_cols:
+                    obj_type = json.loads(obj_cols['type'][0])
+                found[id] = self.cache_uuid_to_fq_name_add(id, fq_name,
+                                                           obj_type)
+
+        return found
+    # end _cache_uuid_to_fq_name_fill
+
+    def _multiget_batched(self, keys, columns):
+        # split keys into batches read with a bounded number of concurrent
+        # multigets, returns list of per batch results
+        batch_size = self._fq_name_batch_size
+        batches = [keys[i:i+batch_size]
+                   for i in range(0, len(keys), batch_size)]
+
+        def _multiget(batch):
+            return self._obj_uuid_cf.multiget(batch, columns=columns,
+                                              include_timestamp=True)
+
+        if len(batches) == 1:
+            return [_multiget(batches[0])]
+
+        pool = gevent.pool.Pool(self._FQ_NAME_BATCH_CONCURRENCY)
+        return pool.map(_multiget, batches)
+    # end _multiget_batched
+
     def uuid_to_fq_name(self, id):
-        try:
-            return self._cache_uuid_to_fq_name[id]
-        except KeyError:
-            try:
-                fq_name_json = self._obj_uuid_cf.get(
-                    id, columns=['fq_name'])['fq_name']
-            except pycassa.NotFoundException:
-                raise NoIdError(id)
-
-            fq_name = json.loads(fq_name_json)
-            self.cache_uuid_to_fq_name_add(id, fq_name)
-            return fq_name
+        cached = self._cache_uuid_to_fq_name_fill([id]).get(id)
+        if cached is None:
+            raise NoIdError(id)
+        return list(cached[0])
     # end uuid_to_fq_name
 
     def uuid_to_obj_type(self, id):
+        cached = self._cache_uuid_to_fq_name.peek(self._fq_name_cache_key(id))
+        if cached is not None and cached[1] is not None:
+            return cached[1]
+
         try:
-            type_json = self._obj_uuid_cf.get(id, columns=['type'])['type']
+            obj_cols = self._obj_uuid_cf.get(id, columns=['fq_name', 'type'])
         except pycassa.NotFoundException:
             raise NoIdError(id)
-        return json.loads(type_json)
-    # end uuid_to_fq_name
+        obj_type = json.loads(obj_cols['type'])
+        self.cache_uuid_to_fq_name_add(id, json.loads(obj_cols['fq_name']),
+                                       obj_type)
+        return obj_type
+    # end uuid_to_obj_type
 
     def fq_name_to_uuid(self, obj_type, fq_name):
         method_name = obj_type.replace('-', '_')
@@ -246,7 +348,9 @@ class VncCassandraClient(VncCassandraClientGen):
             result['%ss' % (child_type)] = []
 
         child_info = {}
-        child_info['to'] = self.uuid_to_fq_name(child_uuid)
+        if not self._defer_fq_name(result, '%ss' % (child_type), child_info,
+                                   child_uuid, skip_missing=True):
+            child_info['to'] = self.uuid_to_fq_name(child_uuid)
         child_info['href'] = self._generate_url(child_type, child_uuid)
         child_info['uuid'] = child_uuid
         child_info['tstamp'] = child_tstamp
@@ -260,10 +364,12 @@ class VncCassandraClient(VncCassandraClientGen):
 
         ref_data = json.loads(ref_data_json)
         ref_info = {}
-        try:
-            ref_info['to'] = self.uuid_to_fq_name(ref_uuid)
-        except NoIdError as e:
-            ref_info['to'] = ['ERROR']
+        if not self._defer_fq_name(result, '%s_refs' % (ref_type), ref_info,
+                                   ref_uuid, skip_missing=False):
+            try:
+                ref_info['to'] = self.uuid_to_fq_name(ref_uuid)
+            except NoIdError as e:
+                ref_info['to'] = ['ERROR']
 
         if ref_data:
             try:
@@ -284,7 +390,10 @@ class VncCassandraClient(VncCassandraClientGen):
             result['%s_back_refs' % (back_ref_type)] = []
 
         back_ref_info = {}
-        back_ref_info['to'] = self.uuid_to_fq_name(back_ref_uuid)
+        if not self._defer_fq_name(result, '%s_back_refs' % (back_ref_type),
+                                   back_ref_info, back_ref_uuid,
+                                   skip_missing=True):
+            back_ref_info['to'] = self.uuid_to_fq_name(back_ref_uuid)
         back_ref_data = json.loads(back_ref_data_json)
         if back_ref_data:
             try:
@@ -299,4 +408,57 @@ class VncCassandraClient(VncCassandraClientGen):
         result['%s_back_refs' % (back_ref_type)].append(back_ref_info)
     # end _read_back_ref
 
+    def _defer_fq_name(self, result, field, info, obj_uuid, skip_missing):
+        # when called within a batched read, record info so its 'to' is
+        # filled in once all referred uuids of the read are known
+        deferred = self._deferred_fq_names.get(gevent.getcurrent())
+        if deferred is None:
+            return False
+        deferred.append((result, field, info, obj_uuid, skip_missing))
+        return True
+    # end _defer_fq_name
+
+    def _resolve_deferred_fq_names(self, deferred):
+        found = self._cache_uuid_to_fq_name_fill(
+            set(obj_uuid for _, _, _, obj_uuid, _ in deferred))
+
+        # children/back-refs to objects gone from db are left out of the
+        # result, refs to them are reported as ERROR
+        skipped = {}
+        for result, field, info, obj_uuid, skip_missing in deferred:
+            if obj_uuid in found:
+                info['to'] = list(found[obj_uuid][0])
+            elif skip_missing:
+                skipped.setdefault((id(result), field),
+                                   (result, field, set()))[2].add(id(info))
+            else:
+                info['to'] = ['ERROR']
+
+        # the read may have replaced the lists (children are re-sorted),
+        # so filter what the result holds now
+        for result, field, skipped_infos in skipped.values():
+            infos = result.get(field)
+            if infos is None:
+                continue
+            result[field] = [info for info in infos
+                             if id(info) not in skipped_infos]
+    # end _resolve_deferred_fq_names
+
+    def _batch_fq_name_reads(self, read_method):
+        def wrapper(*args, **kwargs):
+            current = gevent.getcurrent()
+            outer = self._deferred_fq_names.get(current)
+            deferred = []
+            self._deferred_fq_names[current] = deferred
+            try:
+                result = read_method(*args, **kwargs)
+            finally:
+                if outer is None:
+                    del self._deferred_fq_names[current]
+                else:
+                    self._deferred_fq_names[current] = outer
+            self._resolve_deferred_fq_names(deferred)
+            return result
 
+        return wrapper
+    # end _batch_fq_name_reads
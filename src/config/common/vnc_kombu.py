@@ -22,8 +22,21 @@ from pysandesh.gen_py.sandesh.ttypes import SandeshLevel
 
 __all__ = "VncKombuClient"
 
+# With publish_envelope set, messages are published as an envelope carrying
+# a batch of messages,
+# {ENVELOPE_VERSION_KEY: ENVELOPE_VERSION, ENVELOPE_MESSAGES_KEY: [...]}.
+# Subscribers predating the envelope drop it, so it is only to be enabled
+# once all of them have been upgraded; until then messages are published
+# bare. Subscribers accept both.
+ENVELOPE_VERSION_KEY = 'vnc_msg_version'
+ENVELOPE_MESSAGES_KEY = 'messages'
+ENVELOPE_VERSION = 2
+
 
 class VncKombuClientBase(object):
+    # max messages coalesced into one published envelope
+    _PUBLISH_BATCH_SIZE = 256
+
     def _update_sandesh_status(self, status, msg=''):
         ConnectionState.update(conn_type=ConnectionType.DATABASE,
             name='RabbitMQ', status=status, message=msg,
@@ -35,7 +48,8 @@ class VncKombuClientBase(object):
     # end publish
 
     def __init__(self, rabbit_ip, rabbit_port, rabbit_user, rabbit_password,
-                 rabbit_vhost, rabbit_ha_mode, q_name, subscribe_cb, logger):
+                 rabbit_vhost, rabbit_ha_mode, q_name, subscribe_cb, logger,
+                 publish_envelope=False):
         self._rabbit_ip = rabbit_ip
         self._rabbit_port = rabbit_port
         self._rabbit_user = rabbit_user
@@ -43,6 +57,7 @@ class VncKombuClientBase(object):
         self._rabbit_vhost = rabbit_vhost
         self._subscribe_cb = subscribe_cb
         self._logger = logger
+        self._publish_envelope = publish_envelope
         self._publish_queue = Queue()
         self._conn_lock = Semaphore()
 
@@ -106,18 +121,29 @@ class VncKombuClientBase(object):
     # end _connection_watch
 
     def _publisher(self):
-        message = None
+        messages = None
         while True:
             try:
-                if not message:
-                    # earlier was sent fine, dequeue one more
-                    message = self._publish_queue.get()
-
-                while True:
+                if not messages:
+                    # earlier batch was sent fine, wait for one more message
+                    # and take whatever else got queued meanwhile
+                    messages = [self._publish_queue.get()]
+                    while (len(messages) < self._PUBLISH_BATCH_SIZE and
+                           not self._publish_queue.empty()):
+                        messages.append(self._publish_queue.get_nowait())
+
+                while messages:
                     try:
-                        self._producer.publish(message)
-                        message = None
-                        break
+                        # with publisher confirms (VncKombuClientV2) this
+                        # returns once the broker has taken the message
+                        if self._publish_envelope:
+                            self._producer.publish(
+                                {ENVELOPE_VERSION_KEY: ENVELOPE_VERSION,
+                                 ENVELOPE_MESSAGES_KEY: messages})
+                            messages = None
+                        else:
+                            self._producer.publish(messages[0])
+                            del messages[0]
                     except self._conn.connection_errors + self._conn.channel_errors as e:
                         self._reconnect()
             except Exception as e:
@@ -125,12 +151,27 @@ class VncKombuClientBase(object):
                 self._logger(log_str, level=SandeshLevel.SYS_ERR)
     # end _publisher
 
+    @staticmethod
+    def _unpack(body):
+        if (isinstance(body, dict) and
+                body.get(ENVELOPE_VERSION_KEY) == ENVELOPE_VERSION):
+            return body[ENVELOPE_MESSAGES_KEY]
+        return [body]
+    # end _unpack
+
     def _subscribe(self, body, message):
         try:
-            self._subscribe_cb(body)
+            for msg in self._unpack(body):
+                # one failing message must not lose the rest of its batch
+                try:
+                    self._subscribe_cb(msg)
+                except Exception as e:
+                    log_str = "Exception in subscribe callback for %s: %s" \
+                              % (msg, str(e))
+                    self._logger(log_str, level=SandeshLevel.SYS_ERR)
         finally:
             message.ack()
-
+    # end _subscribe
 
     def _start(self):
         self._can_consume = False
@@ -149,11 +190,13 @@ class VncKombuClientBase(object):
 
 class VncKombuClientV1(VncKombuClientBase):
     def __init__(self, rabbit_ip, rabbit_port, rabbit_user, rabbit_password,
-                 rabbit_vhost, rabbit_ha_mode, q_name, subscribe_cb, logger):
+                 rabbit_vhost, rabbit_ha_mode, q_name, subscribe_cb, logger,
+                 publish_envelope=False):
         super(VncKombuClientV1, self).__init__(rabbit_ip, rabbit_port,
                                                rabbit_user, rabbit_password,
                                                rabbit_vhost, rabbit_ha_mode,
-                                               q_name, subscribe_cb, logger)
+                                               q_name, subscribe_cb, logger,
+                                               publish_envelope)
 
         self._conn = kombu.Connection(hostname=self._rabbit_ip,
                                       port=self._rabbit_port,
@@ -186,11 +229,13 @@ class VncKombuClientV2(VncKombuClientBase):
         return ret
 
     def __init__(self, rabbit_hosts, rabbit_port, rabbit_user, rabbit_password,
-                 rabbit_vhost, rabbit_ha_mode, q_name, subscribe_cb, logger):
+                 rabbit_vhost, rabbit_ha_mode, q_name, subscribe_cb, logger,
+                 publish_envelope=False):
         super(VncKombuClientV2, self).__init__(rabbit_hosts, rabbit_port,
                                                rabbit_user, rabbit_password,
                                                rabbit_vhost, rabbit_ha_mode,
-                                               q_name, subscribe_cb, logger)
+                                               q_name, subscribe_cb, logger,
+                                               publish_envelope)
 
         _hosts = self._parse_rabbit_hosts(rabbit_hosts)
         self._urls = []
@@ -203,7 +248,8 @@ class VncKombuClientV2(VncKombuClientBase):
         self._logger(msg, level=SandeshLevel.SYS_NOTICE)
         self._update_sandesh_status(ConnectionStatus.INIT)
         self._conn_state = ConnectionStatus.INIT
-        self._conn = kombu.Connection(self._urls)
+        self._conn = kombu.Connection(
+            self._urls, transport_options={'confirm_publish': True})
         queue_args = {"x-ha-policy": "all"} if rabbit_ha_mode else None
         self._update_queue_obj = kombu.Queue(q_name, self.obj_upd_exchange, queue_arguments=queue_args)
 
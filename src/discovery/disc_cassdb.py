@@ -27,13 +27,23 @@ class DiscoveryCassandraClient(object):
         return db_info
     # end get_db_info
 
-    def __init__(self, module, cass_srv_list, reset_config=False):
+    def __init__(self, module, cass_srv_list, reset_config=False,
+                 pub_cache_ttl=0):
         self._disco_cf_name = 'discovery'
         self._keyspace_name = 'DISCOVERY_SERVER'
         self._reset_config = reset_config
         self._cassandra_init(cass_srv_list)
 
+        # publisher lists per service type, served to subscribe/query for
+        # up to pub_cache_ttl seconds (0 disables). in_use is counted from
+        # the cached subscribers, kept current with the subscriptions made
+        # through this server; it may lag those made or expired elsewhere.
+        self._pub_cache_ttl = pub_cache_ttl
+        self._pub_cache = {}
+
         self._debug = {
+            'pub_cache_hits': 0,
+            'pub_cache_misses': 0,
         }
     #end __init__
 
@@ -126,19 +136,83 @@ class DiscoveryCassandraClient(object):
                 raise
         return error_handler
 
+    # return publisher entries of a service type with in_use filled in.
+    # 'service' and 'subscriber' columns are adjacent in the row, so both
+    # come back from a single slice read. The client ids subscribed to
+    # each publisher are added to subscribers if given.
+    def _service_row(self, service_type, subscribers=None):
+        services = []
+        if subscribers is None:
+            subscribers = {}
+        for col_name, col_value in self._disco_cf.xget(service_type,
+                column_start = ('service',), column_finish = ('subscriber',)):
+            if col_name[0] == 'service':
+                services.append(col_value)
+            else:
+                subscribers.setdefault(col_name[1], set()).add(col_name[2])
+        data = []
+        for col_value in services:
+            entry = json.loads(col_value)
+            entry['in_use'] = len(subscribers.get(entry['service_id'], ()))
+            data.append(entry)
+        return data
+    # end _service_row
+
+    def _pub_cache_lookup(self, service_type):
+        now = time.time()
+        cached = self._pub_cache.get(service_type)
+        if cached and cached[0] > now:
+            self._debug['pub_cache_hits'] += 1
+        else:
+            self._debug['pub_cache_misses'] += 1
+            subscribers = {}
+            cached = (now + self._pub_cache_ttl,
+                      self._service_row(service_type, subscribers),
+                      subscribers)
+            self._pub_cache[service_type] = cached
+        # callers update entries they are handed
+        data = []
+        for entry in cached[1]:
+            entry = dict(entry)
+            entry['in_use'] = len(cached[2].get(entry['service_id'], ()))
+            data.append(entry)
+        return data
+    # end _pub_cache_lookup
+
+    def _pub_cache_update(self, service_type, service_id, entry):
+        cached = self._pub_cache.get(service_type)
+        if not cached:
+            return
+        data = cached[1]
+        for i, old in enumerate(data):
+            if old['service_id'] == service_id:
+                data[i] = dict(entry)
+                return
+        # new publisher
+        del self._pub_cache[service_type]
+    # end _pub_cache_update
+
+    def _pub_cache_subscribe(self, service_type, service_id, client_id,
+                             subscribed=True):
+        cached = self._pub_cache.get(service_type)
+        if not cached:
+            return
+        subscribers = cached[2].setdefault(service_id, set())
+        if subscribed:
+            subscribers.add(client_id)
+        else:
+            subscribers.discard(client_id)
+    # end _pub_cache_subscribe
+
     # return all publisher entries
     @cass_error_handler
     def service_entries(self, service_type = None):
         col_name = ('service',)
         try:
-            data = self._disco_cf.get_range(column_start = col_name, column_finish = col_name)
+            data = self._disco_cf.get_range(column_start = col_name,
+                column_finish = col_name, column_count = 1)
             for service_type, services in data:
-                for col_name in services:
-                    col_value = services[col_name]
-                    entry = json.loads(col_value)
-                    col_name = ('subscriber', entry['service_id'],)
-                    entry['in_use'] = self._disco_cf.get_count(service_type, 
-                        column_start = col_name, column_finish = col_name)
+                for entry in self._service_row(service_type):
                     yield(entry)
         except pycassa.pool.AllServersUnavailable:
             raise disc_exceptions.ServiceUnavailable()
@@ -217,6 +291,7 @@ class DiscoveryCassandraClient(object):
     def insert_service(self, service_type, service_id, entry):
         col_name = ('service', service_id, 'service-entry')
         self._disco_cf.insert(service_type, {col_name : json.dumps(entry)})
+        self._pub_cache_update(service_type, service_id, entry)
     # end insert_service
 
     # forget service and subscribers
@@ -224,6 +299,7 @@ class DiscoveryCassandraClient(object):
     def delete_service(self, entry):
         col_name = ('service', entry['service_id'], 'service-entry')
         self._disco_cf.remove(entry['service_type'])
+        self._pub_cache.pop(entry['service_type'], None)
      #end delete_service
 
     # return service entry
@@ -238,16 +314,10 @@ class DiscoveryCassandraClient(object):
                 entry['in_use'] = self._disco_cf.get_count(service_type, 
                     column_start = col_name, column_finish = col_name)
                 return entry
+            elif self._pub_cache_ttl:
+                return self._pub_cache_lookup(service_type) or None
             else:
-                col_name = ('service',)
-                services = self._disco_cf.get(service_type, 
-                    column_start = col_name, column_finish = col_name)
-                data = [json.loads(val) for col,val in services.items()]
-                for entry in data:
-                    col_name = ('subscriber', entry['service_id'],)
-                    entry['in_use'] = self._disco_cf.get_count(service_type, 
-                        column_start = col_name, column_finish = col_name)
-                return data
+                return self._service_row(service_type) or None
         except pycassa.NotFoundException:
             return None
     # end lookup_service
@@ -274,6 +344,7 @@ class DiscoveryCassandraClient(object):
         col_name = ('client', client_id, service_id)
         self._disco_cf.insert(service_type, {col_name : col_val}, 
             ttl = ttl + disc_consts.TTL_EXPIRY_DELTA)
+        self._pub_cache_subscribe(service_type, service_id, client_id)
     # end insert_client
 
     # return client (subscriber) entry
@@ -327,6 +398,8 @@ class DiscoveryCassandraClient(object):
             columns = [('client', client_id, service_id)])
         self._disco_cf.remove(service_type,
             columns = [('subscriber', service_id, client_id)])
+        self._pub_cache_subscribe(service_type, service_id, client_id,
+                                  subscribed=False)
     # end
 
     # return tuple (service_type, client_id, service_id)
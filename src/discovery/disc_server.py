@@ -271,7 +271,8 @@ class DiscoveryServer():
 
     def _db_connect(self, reset_config):
         self._db_conn = DiscoveryCassandraClient("discovery",
-            self._args.cassandra_server_list, reset_config)
+            self._args.cassandra_server_list, reset_config,
+            self._args.pub_cache_ttl)
     # end _db_connect
 
     def cleanup(self):
@@ -959,6 +960,7 @@ def parse_args(args_str):
         'ttl_min': disc_consts._TTL_MIN,
         'ttl_max': disc_consts._TTL_MAX,
         'ttl_short': 0,
+        'pub_cache_ttl': 0,
         'hc_interval': disc_consts.HC_INTERVAL,
         'hc_max_miss': disc_consts.HC_MAX_MISS,
         'collectors': None,
@@ -1016,6 +1018,10 @@ def parse_args(args_str):
     parser.add_argument(
         "--ttl_short", type=int,
         help="Short TTL for agressively subscription schedule")
+    parser.add_argument(
+        "--pub_cache_ttl", type=int,
+        help="Seconds to cache publisher lists per service type for "
+        "subscribe and query, default 0 (disabled)")
     parser.add_argument(
         "--hc_interval", type=int,
         help="Heartbeat interval, default %d seconds"
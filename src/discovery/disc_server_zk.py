@@ -371,7 +371,11 @@ class DiscoveryServer():
         if entry['sequence'] == -1:
             self._db_conn.insert_service(
                 service_type, entry['service_id'], entry)
-        self._db_conn.update_service(
+            self._db_conn.update_service(
+                service_type, entry['service_id'], entry)
+        elif not self._db_conn.update_service_heartbeat(
+                service_type, entry['service_id'], entry['heartbeat']):
+            self._db_conn.update_service(
                 service_type, entry['service_id'], entry)
 
         m = sandesh.dsHeartBeat(
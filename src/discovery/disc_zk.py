@@ -13,13 +13,21 @@ import kazoo.recipe.election
 import logging
 import json
 import time
+import heapq
 import disc_consts
 
 from gevent.coros import BoundedSemaphore
+from gevent.queue import Queue
 
 
 class DiscoveryZkClient(object):
 
+    # Heartbeat timestamps are written to ZooKeeper in the background,
+    # every _HB_FLUSH_INTERVAL seconds
+    _HB_FLUSH_INTERVAL = 1
+    # Seconds between runs of the subscription expiry scheduler
+    _SUB_EXPIRY_INTERVAL = 1
+
     def __init__(self, discServer, zk_srv_ip='127.0.0.1',
                  zk_srv_port='2181', reset_config=False):
         self._reset_config = reset_config
@@ -29,6 +37,30 @@ class DiscoveryZkClient(object):
         self._election = None
         self._restarting = False
 
+        # In-memory registry of the publishers, built per service type on
+        # first use and kept current with ZooKeeper watches.
+        # service type -> service id -> {'entry', 'version', 'in_use',
+        # 'hb_persisted'}
+        self._registry = {}
+        # bumped on restart, invalidates the watches of the old session
+        self._registry_gen = 0
+        # (service type, service id) of heartbeats to persist
+        self._hb_dirty = set()
+
+        # Subscription expiry scheduler: heap of (deadline, service type,
+        # client id, service id) and the current deadline of each
+        # subscription; heap items with another deadline are stale.
+        # Subscriptions are scheduled by insert_client, and rescheduled on
+        # every renewal, also through other servers, by data watches on
+        # /clients/<service type>/<client id>/<service id>. Watches are
+        # set by sub_watch_loop on the paths queued in _sub_watch_queue,
+        # off the kazoo callback greenlet.
+        self._sub_heap = []
+        self._sub_deadline = {}
+        self._sub_watched = set()
+        self._sub_watch_gen = None
+        self._sub_watch_queue = Queue()
+
         zk_endpts = []
         for ip in zk_srv_ip.split(','):
             zk_endpts.append('%s:%s' %(ip, zk_srv_port))
@@ -64,6 +96,8 @@ class DiscoveryZkClient(object):
             'subscription_expires': 0,
             'oos_delete': 0,
             'db_excepts': 0,
+            'hb_writes': 0,
+            'hb_write_conflicts': 0,
         }
     # end __init__
 
@@ -92,6 +126,9 @@ class DiscoveryZkClient(object):
             except:
                 e = sys.exc_info()[0]
                 self.syslog('restart: exception %s' % str(e))
+            # watches are set again as the registry is rebuilt
+            self._registry = {}
+            self._registry_gen += 1
         self._restarting = False
         self._zk_sem.release()
 
@@ -113,11 +150,15 @@ class DiscoveryZkClient(object):
     # end
 
     def start_background_tasks(self):
-        # spawn loop to expire subscriptions
+        # spawn loops to watch and expire subscriptions
+        gevent.Greenlet.spawn(self.sub_watch_loop)
         gevent.Greenlet.spawn(self.inuse_loop)
 
         # spawn loop to expire services
         gevent.Greenlet.spawn(self.service_oos_loop)
+
+        # spawn loop to persist heartbeats
+        gevent.Greenlet.spawn(self.heartbeat_loop)
     # end
 
     def syslog(self, log_msg):
@@ -127,6 +168,7 @@ class DiscoveryZkClient(object):
     # end
 
     def get_debug_stats(self):
+        self._debug['subscriptions'] = len(self._sub_deadline)
         return self._debug
     # end
 
@@ -205,15 +247,103 @@ class DiscoveryZkClient(object):
                 self.restart()
     # end exists_node
 
+    def _registry_services(self, service_type):
+        # publishers of the service type, loaded and watched on first use
+        services = self._registry.get(service_type)
+        if services is not None:
+            return services
+        path = '/services/%s' % (service_type)
+        if not self.exists_node(path):
+            return None
+        services = {}
+        self._registry[service_type] = services
+        gen = self._registry_gen
+
+        def children_cb(children):
+            if self._registry.get(service_type) is not services or \
+                    gen != self._registry_gen:
+                return False
+            for service_id in children:
+                if service_id not in services:
+                    self._registry_watch(service_type, service_id, services,
+                                         gen)
+            for service_id in services.keys():
+                if service_id not in children:
+                    del services[service_id]
+        self._zk.ChildrenWatch(path, children_cb)
+        return services
+    # end _registry_services
+
+    def _registry_watch(self, service_type, service_id, services, gen):
+        path = '/services/%s/%s' % (service_type, service_id)
+
+        def valid():
+            return self._registry.get(service_type) is services and \
+                gen == self._registry_gen
+
+        def data_cb(data, stat):
+            if not valid():
+                return False
+            try:
+                entry = json.loads(data) if data else None
+            except ValueError:
+                entry = None
+            if entry is None:
+                services.pop(service_id, None)
+                # service type node is deleted with its last publisher
+                if not services:
+                    del self._registry[service_type]
+                return False
+            rec = services.get(service_id)
+            persisted = entry.get('heartbeat', 0)
+            if rec is not None:
+                # keep a heartbeat not persisted yet
+                entry['heartbeat'] = max(persisted,
+                                         rec['entry'].get('heartbeat', 0))
+            services[service_id] = {
+                'entry': entry,
+                'version': stat.version,
+                'in_use': rec['in_use'] if rec else 0,
+                'hb_persisted': persisted,
+            }
+
+        def children_cb(children):
+            if not valid() or service_id not in services:
+                return False
+            services[service_id]['in_use'] = len(children)
+        self._zk.DataWatch(path, data_cb)
+        self._zk.ChildrenWatch(path, children_cb)
+    # end _registry_watch
+
+    @staticmethod
+    def _registry_entry(rec):
+        data = dict(rec['entry'])
+        data['in_use'] = rec['in_use']
+        return data
+    # end _registry_entry
+
+    def _registry_update(self, service_type, service_id, data, stat):
+        services = self._registry.get(service_type)
+        if services is None:
+            return
+        rec = services.get(service_id)
+        services[service_id] = {
+            'entry': dict(data),
+            'version': getattr(stat, 'version', 0),
+            'in_use': rec['in_use'] if rec else 0,
+            'hb_persisted': data.get('heartbeat', 0),
+        }
+        self._hb_dirty.discard((service_type, service_id))
+    # end _registry_update
+
     def service_entries(self):
         service_types = self.get_children('/services')
         for service_type in service_types:
-            services = self.get_children('/services/%s' % (service_type))
-            for service_id in services:
-                data, stat = self.read_node(
-                    '/services/%s/%s' % (service_type, service_id))
-                entry = json.loads(data)
-                yield(entry)
+            services = self._registry_services(service_type)
+            if not services:
+                continue
+            for rec in services.values():
+                yield(dict(rec['entry']))
 
     def subscriber_entries(self):
         service_types = self.get_children('/clients')
@@ -227,9 +357,90 @@ class DiscoveryZkClient(object):
 
     def update_service(self, service_type, service_id, data):
         path = '/services/%s/%s' % (service_type, service_id)
-        self.create_node(path, value=json.dumps(data), makepath=True)
+        stat = self.create_node(path, value=json.dumps(data), makepath=True)
+        self._registry_update(service_type, service_id, data, stat)
     # end
 
+    def _hb_persist_interval(self):
+        # Age of the persisted heartbeat at which it is written again. It
+        # stays well within the expiry time seen by the other servers.
+        hc_interval = self._ds._args.hc_interval
+        if hc_interval <= 0:
+            return disc_consts.TTL_EXPIRY_DELTA
+        return max(hc_interval,
+                   hc_interval * (self._ds._args.hc_max_miss - 1) / 2)
+    # end _hb_persist_interval
+
+    def _hb_expiry_window(self):
+        # Age of the persisted heartbeat at which the other servers take
+        # the publisher as expired
+        hc_interval = self._ds._args.hc_interval
+        if hc_interval <= 0:
+            return 2 * self._hb_persist_interval()
+        return hc_interval * self._ds._args.hc_max_miss
+    # end _hb_expiry_window
+
+    # record heartbeat in the registry, it is persisted in the background
+    def update_service_heartbeat(self, service_type, service_id, heartbeat):
+        services = self._registry_services(service_type)
+        rec = services.get(service_id) if services else None
+        if rec is None:
+            return False
+        rec['entry']['heartbeat'] = heartbeat
+        if heartbeat - rec['hb_persisted'] >= self._hb_persist_interval():
+            self._hb_dirty.add((service_type, service_id))
+        return True
+    # end update_service_heartbeat
+
+    def _hb_flush(self):
+        # Heartbeats are written oldest persisted first, as many per flush
+        # as it takes to write each of them a flush before it expires.
+        now = time.time()
+        expiry = self._hb_expiry_window()
+        pending = []
+        for key in list(self._hb_dirty):
+            service_type, service_id = key
+            rec = self._registry.get(service_type, {}).get(service_id)
+            if rec is None:
+                self._hb_dirty.discard(key)
+                continue
+            pending.append((rec['hb_persisted'] + expiry, key, rec))
+        pending.sort()
+        count = 0
+        for i, (deadline, _, _) in enumerate(pending):
+            # flushes left before the deadline, keeping one in hand
+            flushes = max(
+                1, int((deadline - now) / self._HB_FLUSH_INTERVAL) - 1)
+            count = max(count, (i + flushes) // flushes)
+
+        for _, key, rec in pending[:count]:
+            self._hb_dirty.discard(key)
+            path = '/services/%s/%s' % key
+            try:
+                # fails if the publisher was changed meanwhile, the
+                # watch brings in the change and the next heartbeat is
+                # persisted over it
+                stat = self._zk.set(path, json.dumps(rec['entry']),
+                                    version=rec['version'])
+            except (kazoo.exceptions.BadVersionError,
+                    kazoo.exceptions.NoNodeException):
+                self._debug['hb_write_conflicts'] += 1
+                continue
+            except (kazoo.exceptions.SessionExpiredError,
+                    kazoo.exceptions.ConnectionLoss):
+                self.restart()
+                break
+            rec['version'] = stat.version
+            rec['hb_persisted'] = rec['entry']['heartbeat']
+            self._debug['hb_writes'] += 1
+    # end _hb_flush
+
+    def heartbeat_loop(self):
+        while True:
+            gevent.sleep(self._HB_FLUSH_INTERVAL)
+            self._hb_flush()
+    # end heartbeat_loop
+
     def insert_service(self, service_type, service_id, data):
 
         # ensure election path for service type exists
@@ -266,49 +477,40 @@ class DiscoveryZkClient(object):
 
         path = '/services/%s/%s' %(service_type, service_id)
         self.delete_node(path, recursive = recursive)
+        services = self._registry.get(service_type)
+        if services is not None:
+            services.pop(service_id, None)
 
         # delete service node if all services gone
         path = '/services/%s' %(service_type)
         if self.get_children(path):
             return
         self.delete_node(path)
+        self._registry.pop(service_type, None)
      #end delete_service
 
+    # publishers are served from the in-memory registry
     def lookup_service(self, service_type, service_id=None):
-        if not self.exists_node('/services/%s' % (service_type)):
+        services = self._registry_services(service_type)
+        if services is None:
             return None
         if service_id:
-            data = None
-            path = '/services/%s/%s' % (service_type, service_id)
-            datastr, stat = self.read_node(path)
-            if datastr:
-                data = json.loads(datastr)
-                clients = self.get_children(path)
-                data['in_use'] = len(clients)
-            return data
+            rec = services.get(service_id)
+            if rec is None:
+                return None
+            return self._registry_entry(rec)
         else:
-            r = []
-            services = self.get_children('/services/%s' % (service_type))
-            for service_id in services:
-                entry = self.lookup_service(service_type, service_id)
-                r.append(entry)
-            return r
+            return [self._registry_entry(rec) for rec in services.values()]
     # end lookup_service
 
+    # publishers in the order of their election sequence
     def query_service(self, service_type):
-        path = '/election/%s' % (service_type)
-        if not self.exists_node(path):
+        services = self._registry_services(service_type)
+        if services is None:
             return None
-        seq_list = self.get_children(path)
-        seq_list = sorted(seq_list)
-
-        r = []
-        for sequence in seq_list:
-            service_id, stat = self.read_node(
-                '/election/%s/%s' % (service_type, sequence))
-            entry = self.lookup_service(service_type, service_id)
-            r.append(entry)
-        return r
+        r = [self._registry_entry(rec) for rec in services.values()
+             if rec['entry'].get('sequence', -1) != -1]
+        return sorted(r, key=lambda entry: str(entry['sequence']))
     # end
 
     # TODO use include_data available in new versions of kazoo
@@ -324,6 +526,8 @@ class DiscoveryZkClient(object):
 
     def insert_client(self, service_type, service_id, client_id, blob, ttl):
         data = {'ttl': ttl, 'blob': blob}
+        self._sub_schedule(service_type, client_id, service_id,
+                           time.time() + ttl + disc_consts.TTL_EXPIRY_DELTA)
 
         path = '/services/%s/%s/%s' % (service_type, service_id, client_id)
         self.create_node(path, value=json.dumps(data))
@@ -400,6 +604,7 @@ class DiscoveryZkClient(object):
 
     # delete client subscription. Cleanup path if possible
     def delete_subscription(self, service_type, client_id, service_id):
+        self._sub_deadline.pop((service_type, client_id, service_id), None)
         path = '/clients/%s/%s/%s' % (service_type, client_id, service_id)
         self.delete_node(path)
 
@@ -446,38 +651,137 @@ class DiscoveryZkClient(object):
         return r
     # end get_all_clients
 
-    # reset in-use count of clients for each service
+    def _sub_schedule(self, service_type, client_id, service_id, deadline):
+        key = (service_type, client_id, service_id)
+        if self._sub_deadline.get(key) == deadline:
+            return
+        self._sub_deadline[key] = deadline
+        heapq.heappush(self._sub_heap,
+                       (deadline, service_type, client_id, service_id))
+    # end _sub_schedule
+
+    def _sub_watch(self, path, depth):
+        # queue path for sub_watch_loop to watch
+        self._sub_watch_queue.put((self._registry_gen, path, depth))
+    # end _sub_watch
+
+    def _sub_watch_set(self, path, depth):
+        # Watch the children of /clients down to the subscriptions of each
+        # client, at depth 0, 1 and 2 respectively, and the data of each
+        # subscription at depth 3. Callbacks run on the kazoo callback
+        # greenlet so they only queue paths and schedule deadlines.
+        gen = self._registry_gen
+
+        if depth == 3:
+            service_type, client_id, service_id = path.split('/')[2:5]
+            key = (service_type, client_id, service_id)
+
+            def data_cb(data, stat):
+                if gen != self._registry_gen or path not in self._sub_watched:
+                    return False
+                if data is None:
+                    self._sub_watched.discard(path)
+                    self._sub_deadline.pop(key, None)
+                    return False
+                try:
+                    ttl = json.loads(data)['ttl']
+                except (ValueError, KeyError):
+                    return
+                # created or renewed, through this server or another one
+                self._sub_schedule(service_type, client_id, service_id,
+                    stat.last_modified + ttl + disc_consts.TTL_EXPIRY_DELTA)
+            self._zk.DataWatch(path, data_cb)
+            return
+
+        known = set()
+
+        def children_cb(children):
+            if gen != self._registry_gen or path not in self._sub_watched:
+                return False
+            children = set(children)
+            for child in children - known:
+                self._sub_watch('%s/%s' % (path, child), depth + 1)
+            if depth < 2:
+                # a deleted node ends its watch
+                for child in known - children:
+                    self._sub_watched.discard('%s/%s' % (path, child))
+            known.clear()
+            known.update(children)
+        self._zk.ChildrenWatch(path, children_cb)
+    # end _sub_watch_set
+
+    def sub_watch_loop(self):
+        while True:
+            gen, path, depth = self._sub_watch_queue.get()
+            if gen != self._registry_gen or path in self._sub_watched:
+                continue
+            self._sub_watched.add(path)
+            try:
+                self._sub_watch_set(path, depth)
+            except (kazoo.exceptions.SessionExpiredError,
+                    kazoo.exceptions.ConnectionLoss):
+                # retried, unless the restart starts a new session whose
+                # watches are set again from /clients
+                self._sub_watched.discard(path)
+                self.restart()
+                self._sub_watch_queue.put((gen, path, depth))
+            except Exception as e:
+                self._sub_watched.discard(path)
+                self.syslog('Failed to watch %s: %s' % (path, str(e)))
+    # end sub_watch_loop
+
+    # expire subscriptions not renewed within their ttl
     def inuse_loop(self):
         while True:
-            service_types = self.get_children('/clients')
-            for service_type in service_types:
-                clients = self.get_children('/clients/%s' % (service_type))
-                for client_id in clients:
-                    services = self.get_children(
-                        '/clients/%s/%s' % (service_type, client_id))
-                    for service_id in services:
-                        path = '/clients/%s/%s/%s' % (
-                            service_type, client_id, service_id)
-                        datastr, stat = self.read_node(path)
-                        data = json.loads(datastr)
-                        now = time.time()
-                        exp_t = stat.last_modified + data['ttl'] +\
-                            disc_consts.TTL_EXPIRY_DELTA
-                        if now > exp_t:
-                            self.delete_subscription(
-                                service_type, client_id, service_id)
-                            self.syslog(
-                                'Expiring st:%s sid:%s cid:%s'
-                                % (service_type, service_id, client_id))
-                            self._debug['subscription_expires'] += 1
-            gevent.sleep(10)
+            if self._sub_watch_gen != self._registry_gen:
+                # (re)establish the watches, on start and on restart
+                self._sub_watch_gen = self._registry_gen
+                self._sub_watched = set()
+                self._sub_watch('/clients', 0)
+            now = time.time()
+            while self._sub_heap and self._sub_heap[0][0] <= now:
+                deadline, service_type, client_id, service_id = \
+                    heapq.heappop(self._sub_heap)
+                key = (service_type, client_id, service_id)
+                if self._sub_deadline.get(key) != deadline:
+                    continue
+                # not renewed as far as the watch has seen, read it once
+                # in case the renewal has not reached the watch yet
+                path = '/clients/%s/%s/%s' % (
+                    service_type, client_id, service_id)
+                datastr, stat = self.read_node(path)
+                if not datastr:
+                    del self._sub_deadline[key]
+                    continue
+                data = json.loads(datastr)
+                exp_t = stat.last_modified + data['ttl'] +\
+                    disc_consts.TTL_EXPIRY_DELTA
+                if now <= exp_t:
+                    self._sub_schedule(
+                        service_type, client_id, service_id, exp_t)
+                    continue
+                self.delete_subscription(
+                    service_type, client_id, service_id)
+                self.syslog(
+                    'Expiring st:%s sid:%s cid:%s'
+                    % (service_type, service_id, client_id))
+                self._debug['subscription_expires'] += 1
+            gevent.sleep(self._SUB_EXPIRY_INTERVAL)
 
     def service_oos_loop(self):
         if self._ds._args.hc_interval <= 0:
             return
 
         while True:
-            for entry in self.service_entries():
+            # publishers are checked in the registry, those already out
+            # of service (sequence -1) are skipped
+            for service_type in self.get_children('/services'):
+                self._registry_services(service_type)
+            entries = [dict(rec['entry'])
+                       for services in self._registry.values()
+                       for rec in services.values()
+                       if rec['entry'].get('sequence', -1) != -1]
+            for entry in entries:
                 if not self._ds.service_expired(entry, include_down=False):
                     continue
                 service_type = entry['service_type']
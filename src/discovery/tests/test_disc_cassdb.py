@@ -0,0 +1,157 @@
+#
+# Copyright (c) 2015 Juniper Networks, Inc. All rights reserved.
+#
+import unittest
+import mock
+
+import pycassa
+from discovery import disc_cassdb
+
+
+class FakeColumnFamily(object):
+    # Rows of composite columns kept sorted, as the discovery CF is.
+    # Slices compare the first component of the column names; slices
+    # counts the reads done.
+
+    def __init__(self):
+        self.rows = {}
+        self.slices = 0
+
+    def _columns(self, key, column_start, column_finish):
+        if key not in self.rows:
+            raise pycassa.NotFoundException()
+        for col_name in sorted(self.rows[key]):
+            if column_start <= col_name[:1] <= column_finish:
+                yield col_name, self.rows[key][col_name]
+
+    def xget(self, key, column_start, column_finish):
+        self.slices += 1
+        try:
+            for column in self._columns(key, column_start, column_finish):
+                yield column
+        except pycassa.NotFoundException:
+            return
+
+    def get(self, key, columns=None, column_start=None, column_finish=None):
+        self.slices += 1
+        if columns is not None:
+            row = self.rows.get(key, {})
+            found = dict((c, row[c]) for c in columns if c in row)
+            if not found:
+                raise pycassa.NotFoundException()
+            return found
+        return dict(self._columns(key, column_start, column_finish))
+
+    def get_count(self, key, column_start, column_finish):
+        self.slices += 1
+        return len(list(self._columns(key, column_start, column_finish)))
+
+    def insert(self, key, columns, ttl=None):
+        self.rows.setdefault(key, {}).update(columns)
+
+    def remove(self, key, columns=None):
+        if columns is None:
+            self.rows.pop(key, None)
+            return
+        for col_name in columns:
+            self.rows.get(key, {}).pop(col_name, None)
+# end class FakeColumnFamily
+
+
+class TestDiscCassdb(unittest.TestCase):
+    def setUp(self):
+        # skip the connection to cassandra
+        self.cf = FakeColumnFamily()
+        self.db = self._client(pub_cache_ttl=5)
+        self.now = 1000.0
+        time_patch = mock.patch.object(disc_cassdb.time, 'time',
+                                       side_effect=lambda: self.now)
+        time_patch.start()
+        self.addCleanup(time_patch.stop)
+
+    def _client(self, pub_cache_ttl):
+        with mock.patch.object(disc_cassdb.DiscoveryCassandraClient,
+                               '_cassandra_init'):
+            db = disc_cassdb.DiscoveryCassandraClient('discovery', [],
+                pub_cache_ttl=pub_cache_ttl)
+        db._disco_cf = self.cf
+        return db
+
+    def _in_use(self, db=None):
+        entries = (db or self.db).lookup_service('x')
+        return dict((entry['service_id'], entry['in_use'])
+                    for entry in entries)
+
+    def _publish(self, *service_ids):
+        for service_id in service_ids:
+            self.db.insert_service('x', service_id,
+                                   {'service_id': service_id})
+
+    def test_service_row(self):
+        self._publish('p1', 'p2')
+        self.db.insert_client('x', 'p1', 'c1', {}, 60)
+        self.db.insert_client('x', 'p1', 'c2', {}, 60)
+        self.db.insert_client('x', 'p2', 'c1', {}, 60)
+        self.db.insert_client_data('x', 'c1', {})
+
+        # publishers and their subscribers from one slice
+        subscribers = {}
+        self.assertEqual(
+            sorted(self.db._service_row('x', subscribers),
+                   key=lambda entry: entry['service_id']),
+            [{'service_id': 'p1', 'in_use': 2},
+             {'service_id': 'p2', 'in_use': 1}])
+        self.assertEqual(self.cf.slices, 1)
+        self.assertEqual(subscribers,
+                         {'p1': set(['c1', 'c2']), 'p2': set(['c1'])})
+        self.assertEqual(self.db._service_row('y'), [])
+
+    def test_cache_subscriptions(self):
+        self._publish('p1', 'p2')
+        self.db.insert_client('x', 'p1', 'c1', {}, 60)
+        self.assertEqual(self._in_use(), {'p1': 1, 'p2': 0})
+        slices = self.cf.slices
+
+        # renewal, new and removed subscriptions through this server
+        self.db.insert_client('x', 'p1', 'c1', {}, 60)
+        self.db.insert_client('x', 'p2', 'c2', {}, 60)
+        self.db.insert_client('x', 'p1', 'c3', {}, 60)
+        self.assertEqual(self._in_use(), {'p1': 2, 'p2': 1})
+        self.db.delete_subscription('x', 'c1', 'p1')
+        self.assertEqual(self._in_use(), {'p1': 1, 'p2': 1})
+
+        # publisher updated in place
+        self.db.update_service('x', 'p1', {'service_id': 'p1', 'v': 2})
+        entries = self.db.lookup_service('x')
+        self.assertTrue({'service_id': 'p1', 'v': 2, 'in_use': 1} in entries)
+        self.assertEqual(self.cf.slices, slices)
+        self.assertEqual(self.db.get_debug_stats()['pub_cache_misses'], 1)
+
+        # the entries handed out are copies
+        entries[0]['in_use'] = 10
+        self.assertEqual(self._in_use(), {'p1': 1, 'p2': 1})
+
+        # new publisher, read again
+        self._publish('p3')
+        self.assertEqual(self._in_use(), {'p1': 1, 'p2': 1, 'p3': 0})
+        self.assertEqual(self.cf.slices, slices + 1)
+
+        # and once expired
+        self.now += 5
+        self.assertEqual(self._in_use(), {'p1': 1, 'p2': 1, 'p3': 0})
+        self.assertEqual(self.cf.slices, slices + 2)
+        self.assertEqual(self.db.get_debug_stats()['pub_cache_misses'], 3)
+
+    def test_no_cache(self):
+        db = self._client(pub_cache_ttl=0)
+        db.insert_service('x', 'p1', {'service_id': 'p1'})
+        self.assertEqual(self._in_use(db), {'p1': 0})
+
+        # each lookup reads the row, subscriptions made elsewhere included
+        self.cf.insert('x', {('subscriber', 'p1', 'c1'): '{}'})
+        self.assertEqual(self._in_use(db), {'p1': 1})
+        self.assertEqual(self.cf.slices, 2)
+        self.assertEqual(db._pub_cache, {})
+        self.assertEqual(db.get_debug_stats()['pub_cache_misses'], 0)
+        self.assertEqual(db.lookup_service('y'), None)
+# end class TestDiscCassdb
@@ -0,0 +1,396 @@
+#
+# Copyright (c) 2015 Juniper Networks, Inc. All rights reserved.
+#
+import gevent
+from gevent import monkey
+monkey.patch_all()
+import json
+import logging
+import logging.handlers
+import unittest
+import mock
+
+import kazoo.exceptions
+from discovery import disc_consts
+from discovery import disc_zk
+
+
+class FakeStat(object):
+    def __init__(self, version, last_modified):
+        self.version = version
+        self.last_modified = last_modified
+
+
+class FakeZk(object):
+    # In-memory ZooKeeper tree. Watches fire synchronously on change, as
+    # kazoo's callback greenlet would; reads counts the reads done,
+    # including those of the watches.
+
+    def __init__(self, **kwargs):
+        self.now = 1000.0
+        self.state = 'CONNECTED'
+        self.nodes = {'/': ['', 0, self.now]}
+        self.reads = 0
+        self.watch_calls = 0
+        self._children_watches = {}
+        self._data_watches = {}
+
+    def start(self):
+        pass
+
+    def _parent(self, path):
+        return path.rsplit('/', 1)[0] or '/'
+
+    def _stat(self, path):
+        node = self.nodes[path]
+        return FakeStat(node[1], node[2])
+
+    def _fire_data(self, path):
+        node = self.nodes.get(path)
+        if node and self._data_watches.get(path):
+            self.reads += 1
+        for func in list(self._data_watches.get(path, [])):
+            if node:
+                ret = func(node[0], self._stat(path))
+            else:
+                ret = func(None, None)
+            if ret is False:
+                self._data_watches[path].remove(func)
+
+    def _fire_children(self, path):
+        if path not in self.nodes:
+            return
+        for func in list(self._children_watches.get(path, [])):
+            if func(self._children(path)) is False:
+                self._children_watches[path].remove(func)
+
+    def _children(self, path):
+        prefix = path.rstrip('/') + '/'
+        return [p[len(prefix):] for p in self.nodes
+                if p != path and self._parent(p) == path]
+
+    def create(self, path, value='', makepath=False, sequence=False):
+        if self._parent(path) not in self.nodes:
+            if not makepath:
+                raise kazoo.exceptions.NoNodeException()
+            self.create(self._parent(path), '', makepath=True)
+        self.nodes[path] = [value, 0, self.now]
+        self._fire_children(self._parent(path))
+        return path
+
+    def set(self, path, value, version=-1):
+        if path not in self.nodes:
+            raise kazoo.exceptions.NoNodeException()
+        node = self.nodes[path]
+        if version != -1 and version != node[1]:
+            raise kazoo.exceptions.BadVersionError()
+        self.nodes[path] = [value, node[1] + 1, self.now]
+        self._fire_data(path)
+        return self._stat(path)
+
+    def get(self, path):
+        self.reads += 1
+        if path not in self.nodes:
+            raise kazoo.exceptions.NoNodeException()
+        return self.nodes[path][0], self._stat(path)
+
+    def exists(self, path):
+        return path in self.nodes
+
+    def get_children(self, path):
+        if path not in self.nodes:
+            raise kazoo.exceptions.NoNodeException()
+        return self._children(path)
+
+    def delete(self, path, recursive=False):
+        if path not in self.nodes:
+            raise kazoo.exceptions.NoNodeException()
+        for child in [p for p in self.nodes if p.startswith(path + '/')]:
+            del self.nodes[child]
+            self._fire_data(child)
+        del self.nodes[path]
+        self._fire_data(path)
+        self._fire_children(self._parent(path))
+
+    def ChildrenWatch(self, path, func):
+        self.watch_calls += 1
+        if path not in self.nodes:
+            return
+        self.reads += 1
+        if func(self._children(path)) is not False:
+            self._children_watches.setdefault(path, []).append(func)
+
+    def DataWatch(self, path, func):
+        self.watch_calls += 1
+        self.reads += 1
+        node = self.nodes.get(path)
+        if node:
+            ret = func(node[0], self._stat(path))
+        else:
+            ret = func(None, None)
+        if ret is not False:
+            self._data_watches.setdefault(path, []).append(func)
+# end class FakeZk
+
+
+class TestDiscZkBase(unittest.TestCase):
+    def setUp(self):
+        self._patches = [
+            mock.patch.object(disc_zk.kazoo.client, 'KazooClient', FakeZk),
+            mock.patch.object(logging.handlers, 'RotatingFileHandler',
+                              lambda *args, **kwargs: logging.NullHandler()),
+        ]
+        for patch in self._patches:
+            patch.start()
+        self.ds = mock.MagicMock()
+        self.ds._args.hc_interval = 5
+        self.ds._args.hc_max_miss = 5
+        self.zk_client = disc_zk.DiscoveryZkClient(self.ds)
+        self.zk = self.zk_client._zk
+        time_patch = mock.patch.object(disc_zk, 'time')
+        self._patches.append(time_patch)
+        time_patch.start().time.side_effect = lambda: self.zk.now
+
+    def tearDown(self):
+        for patch in reversed(self._patches):
+            patch.stop()
+
+    def _run_once(self, loop):
+        greenlet = gevent.spawn(loop)
+        gevent.sleep(0)
+        greenlet.kill()
+# end class TestDiscZkBase
+
+
+class TestDiscZkSubscriptions(TestDiscZkBase):
+    def setUp(self):
+        super(TestDiscZkSubscriptions, self).setUp()
+        self._watcher = gevent.spawn(self.zk_client.sub_watch_loop)
+        # sets the watches of /clients
+        self._run_once(self.zk_client.inuse_loop)
+        self._run_watches()
+
+    def tearDown(self):
+        self._watcher.kill()
+        super(TestDiscZkSubscriptions, self).tearDown()
+
+    def _run_watches(self):
+        while not self.zk_client._sub_watch_queue.empty():
+            gevent.sleep(0)
+        gevent.sleep(0)
+
+    def _subscribe(self, client_id, ttl):
+        # a subscription made or renewed through another server
+        path = '/clients/x/%s/s1' % client_id
+        data = json.dumps({'ttl': ttl, 'blob': {}})
+        if path in self.zk.nodes:
+            self.zk.set(path, data)
+        else:
+            self.zk.create(path, data, makepath=True)
+
+    def test_watch_callbacks_queue(self):
+        calls = self.zk.watch_calls
+        reads = self.zk.reads
+        self._subscribe('c1', 60)
+        # the callbacks have only queued the new paths
+        self.assertEqual(self.zk.watch_calls, calls)
+        self.assertEqual(self.zk.reads, reads)
+        self.assertFalse(self.zk_client._sub_watch_queue.empty())
+
+        self._run_watches()
+        self.assertEqual(self.zk_client._sub_deadline,
+            {('x', 'c1', 's1'): 1060 + disc_consts.TTL_EXPIRY_DELTA})
+
+    def test_renewal_elsewhere(self):
+        delta = disc_consts.TTL_EXPIRY_DELTA
+        self._subscribe('c1', 60)
+        self._run_watches()
+        reads = self.zk.reads
+
+        # renewed, the data watch reschedules the subscription
+        self.zk.now = 1050.0
+        self._subscribe('c1', 60)
+        key = ('x', 'c1', 's1')
+        self.assertEqual(self.zk_client._sub_deadline[key], 1110 + delta)
+
+        # no read at the earlier deadline, only the one of the data watch
+        # on the renewal
+        self.zk.now = 1061.0 + delta
+        self._run_once(self.zk_client.inuse_loop)
+        self.assertTrue('/clients/x/c1/s1' in self.zk.nodes)
+        self.assertEqual(self.zk.reads - reads, 1)
+
+        # read once when it has expired, and deleted
+        reads = self.zk.reads
+        self.zk.now = 1111.0 + delta
+        self._run_once(self.zk_client.inuse_loop)
+        self.assertEqual(self.zk.reads - reads, 1)
+        self.assertFalse('/clients/x/c1/s1' in self.zk.nodes)
+        self.assertEqual(self.zk_client._sub_deadline, {})
+        self.assertEqual(
+            self.zk_client.get_debug_stats()['subscription_expires'], 1)
+
+    def test_deleted_elsewhere(self):
+        self._subscribe('c1', 60)
+        self._subscribe('c2', 60)
+        self._run_watches()
+        self.zk.delete('/clients/x/c1', recursive=True)
+        self.assertEqual(self.zk_client._sub_deadline.keys(),
+                         [('x', 'c2', 's1')])
+
+    def test_restart(self):
+        self._subscribe('c1', 60)
+        self._run_watches()
+        self.zk_client._registry_gen += 1
+        self._run_once(self.zk_client.inuse_loop)
+        self._run_watches()
+
+        # only the watches of the new session are in effect
+        self.zk.now = 1010.0
+        self._subscribe('c1', 60)
+        self.assertEqual(
+            [len(funcs) for funcs in self.zk._data_watches.values()], [1])
+        self.assertEqual(self.zk_client._sub_deadline,
+            {('x', 'c1', 's1'): 1070 + disc_consts.TTL_EXPIRY_DELTA})
+# end class TestDiscZkSubscriptions
+
+
+class TestDiscZkHeartbeats(TestDiscZkBase):
+    # hc_interval 5 and hc_max_miss 5: heartbeats are persisted once 10s
+    # old and expire for the other servers when 25s old
+
+    def _publish(self, service_id, now):
+        self.zk.now = now
+        self.zk_client.update_service('x', service_id,
+            {'service_id': service_id, 'heartbeat': int(now)})
+
+    def _heartbeat(self, service_id, now):
+        self.zk.now = now
+        return self.zk_client.update_service_heartbeat('x', service_id,
+                                                       int(now))
+
+    def _persisted(self, service_id):
+        return json.loads(
+            self.zk.nodes['/services/x/%s' % service_id][0])['heartbeat']
+
+    def _flush(self, now):
+        self.zk.now = now
+        writes = self.zk_client.get_debug_stats()['hb_writes']
+        self.zk_client._hb_flush()
+        return self.zk_client.get_debug_stats()['hb_writes'] - writes
+
+    def test_flush_count(self):
+        service_ids = ['p%d' % i for i in range(10)]
+        for service_id in service_ids:
+            self._publish(service_id, 1000)
+        self.zk_client.lookup_service('x')
+
+        # not persisted until 10s old
+        for service_id in service_ids:
+            self.assertTrue(self._heartbeat(service_id, 1005))
+        self.assertEqual(self._flush(1005), 0)
+
+        # written within the 5s left before they expire, keeping a flush
+        # in hand
+        for service_id in service_ids:
+            self._heartbeat(service_id, 1020)
+        self.assertEqual([self._flush(now) for now in range(1020, 1026)],
+                         [3, 3, 2, 2, 0, 0])
+        for service_id in service_ids:
+            self.assertEqual(self._persisted(service_id), 1020)
+
+    def test_flush_order(self):
+        self._publish('p1', 1005)
+        self._publish('p2', 1000)
+        self.zk_client.lookup_service('x')
+        self._heartbeat('p1', 1015)
+        self._heartbeat('p2', 1015)
+
+        # one a flush, the oldest persisted first
+        self.assertEqual(self._flush(1015), 1)
+        self.assertEqual(self._persisted('p2'), 1015)
+        self.assertEqual(self._persisted('p1'), 1005)
+        self.assertEqual(self._flush(1016), 1)
+        self.assertEqual(self._persisted('p1'), 1015)
+
+    def test_version_conflict(self):
+        self._publish('p1', 1000)
+        self.zk_client.lookup_service('x')
+
+        # changed through another server, the watch not fired yet
+        node = self.zk.nodes['/services/x/p1']
+        entry = json.loads(node[0])
+        entry['admin_state'] = 'down'
+        node[:2] = [json.dumps(entry), node[1] + 1]
+
+        self._heartbeat('p1', 1010)
+        self.assertEqual(self._flush(1010), 0)
+        self.assertEqual(
+            self.zk_client.get_debug_stats()['hb_write_conflicts'], 1)
+        # not retried before the change is in
+        self.assertEqual(self._flush(1011), 0)
+        self.assertEqual(
+            self.zk_client.get_debug_stats()['hb_write_conflicts'], 1)
+
+        # the watch brings in the change, keeping the last heartbeat
+        self.zk._fire_data('/services/x/p1')
+        self.assertEqual(self.zk_client.lookup_service('x', 'p1'),
+            {'service_id': 'p1', 'heartbeat': 1010, 'admin_state': 'down',
+             'in_use': 0})
+
+        # and the next heartbeat is persisted over it
+        self._heartbeat('p1', 1012)
+        self.assertEqual(self._flush(1012), 1)
+        self.assertEqual(json.loads(self.zk.nodes['/services/x/p1'][0]),
+            {'service_id': 'p1', 'heartbeat': 1012, 'admin_state': 'down'})
+
+    def test_deleted_conflict(self):
+        self._publish('p1', 1000)
+        self._publish('p2', 1000)
+        self.zk_client.lookup_service('x')
+
+        # deleted through another server, the watch not fired yet
+        del self.zk.nodes['/services/x/p1']
+        self._heartbeat('p1', 1010)
+        self.assertEqual(self._flush(1010), 0)
+        self.assertEqual(
+            self.zk_client.get_debug_stats()['hb_write_conflicts'], 1)
+        self.assertFalse('/services/x/p1' in self.zk.nodes)
+
+        self.zk._fire_data('/services/x/p1')
+        self.assertEqual(self.zk_client.lookup_service('x', 'p1'), None)
+        self.assertFalse(self._heartbeat('p1', 1011))
+        self.assertEqual(self._flush(1011), 0)
+
+    def test_registry_watches(self):
+        self._publish('p1', 1000)
+        self.zk_client.lookup_service('x')
+        reads = self.zk.reads
+
+        # publisher added, changed and subscribed to through other servers
+        self.zk.create('/services/x/p2',
+            json.dumps({'service_id': 'p2', 'heartbeat': 1001}))
+        self.zk.set('/services/x/p1',
+            json.dumps({'service_id': 'p1', 'heartbeat': 1002}))
+        self.zk.create('/services/x/p1/c1', '')
+        self.zk.create('/services/x/p1/c2', '')
+        watch_reads = self.zk.reads - reads
+
+        self.assertEqual(
+            sorted(self.zk_client.lookup_service('x'),
+                   key=lambda entry: entry['service_id']),
+            [{'service_id': 'p1', 'heartbeat': 1002, 'in_use': 2},
+             {'service_id': 'p2', 'heartbeat': 1001, 'in_use': 0}])
+        # served from the registry
+        self.assertEqual(self.zk.reads - reads, watch_reads)
+
+        # the heartbeats go with the registry
+        self.assertTrue(self._heartbeat('p2', 1011))
+        self.assertEqual(self._flush(1011), 1)
+        self.assertEqual(self._persisted('p2'), 1011)
+
+        # deleted through another server
+        self.zk.delete('/services/x/p1', recursive=True)
+        self.assertEqual(self.zk_client.lookup_service('x', 'p1'), None)
+        self.assertFalse(self._heartbeat('p1', 1012))
+# end class TestDiscZkHeartbeats
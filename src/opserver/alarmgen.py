@@ -10,10 +10,11 @@
 
 from gevent import monkey
 monkey.patch_all()
+import gevent
+from gevent.coros import BoundedSemaphore
 import sys
 import json
 import socket
-import pprint
 try:
     from collections import OrderedDict
 except ImportError:
@@ -35,7 +36,8 @@ from partition_handler import PartitionHandler, UveStreamProc
 from sandesh.alarmgen_ctrl.ttypes import PartitionOwnershipReq, \
     PartitionOwnershipResp, PartitionStatusReq, UVECollInfo, UVEGenInfo, \
     PartitionStatusResp, UVEAlarms, AlarmElement, UVETableAlarmReq, \
-    UVETableAlarmResp, UVEAlarmInfo, AlarmgenTrace, AlarmTrace, UVEKeyInfo
+    UVETableAlarmResp, UVEAlarmInfo, AlarmgenTrace, AlarmTrace, UVEKeyInfo, \
+    PartitionCatchupInfo
 from sandesh.discovery.ttypes import CollectorTrace
 
 from opserver_util import ServicePoller
@@ -109,6 +111,13 @@ class Controller(object):
         self._us = UVEServer(None, self._logger, self._conf.redis_password())
 
         self._workers = {}
+        # partition -> UVE Key -> aggregated UVE, kept up to date with
+        # the UVE Types reported as changed on the partition
+        self._uve_state = {}
+        # Partitions are acquired concurrently, a bounded number of them
+        # load their UVEs and catch up with Kafka at the same time
+        self._catchup_sem = BoundedSemaphore(
+            self._conf.partition_catchup_max())
 
         self.disc = None
         self._libpart_name = self._hostname + ":" + self._instance_id
@@ -186,16 +195,60 @@ class Controller(object):
             self._logger.error('Could not import libpartition: %s' % str(e))
             return None
 
-    def handle_uve_notif(self, uves):
+    def _uve_state_update(self, pstate, uv, types):
+        """
+        Update the materialized UVE with the given UVE Types, or with all
+        of them if types is None. Returns the updated UVE.
+        """
+        # multi, as for multi_uve_get: stats of the query type are not
+        # run against the analytics api
+        if types is None:
+            uve_data = self._us.get_uve(uv, True, multi=True)
+        else:
+            tfilter = dict((typ, set()) for typ in types)
+            tvals = self._us.get_uve(uv, True, tfilter=tfilter, multi=True)
+            uve_data = dict(pstate[uv])
+            for typ in types:
+                if typ in tvals:
+                    uve_data[typ] = tvals[typ]
+                elif typ in uve_data:
+                    del uve_data[typ]
+        if len(uve_data):
+            pstate[uv] = uve_data
+        elif uv in pstate:
+            del pstate[uv]
+        return uve_data
+
+    @staticmethod
+    def _alarm_affected(alarm, types):
+        if types is None:
+            return True
+        atypes = alarm.uve_types()
+        if atypes is None:
+            return True
+        return not types.isdisjoint(atypes)
+
+    @staticmethod
+    def _alarms_value(uve_alarms):
+        # Comparable contents of the alarms of a UVE
+        return dict((nm, (ai.type, ai.ack,
+                          [(ae.rule, ae.value) for ae in ai.description]))
+                    for nm, ai in uve_alarms.iteritems())
+
+    def handle_uve_notif(self, part, uves):
         self._logger.debug("Changed UVEs : %s" % str(uves))
         no_handlers = set()
-        for uv in uves:
+        if not self._uve_state.has_key(part):
+            self._uve_state[part] = {}
+        pstate = self._uve_state[part]
+        for uv, types in uves.iteritems():
             tab = uv.split(':',1)[0]
             if not self.mgrs.has_key(tab):
                 no_handlers.add(tab)
                 continue
-            itr = self._us.multi_uve_get(uv, True, None, None, None, None)
-            uve_data = itr.next()['value']
+            if not pstate.has_key(uv):
+                types = None
+            uve_data = self._uve_state_update(pstate, uv, types)
             if len(uve_data) == 0:
                 self._logger.info("UVE %s deleted" % uv)
                 if self.tab_alarms[tab].has_key(uv):
@@ -205,10 +258,20 @@ class Controller(object):
                     self._logger.info('send del alarm: %s' % (alarm_msg.log()))
                     alarm_msg.send()
                 continue
-            results = self.mgrs[tab].map_method("__call__", uv, uve_data)
-            new_uve_alarms = {}
-            for res in results:
-                nm, errs = res
+            # Only the alarms that depend on the changed UVE Types are
+            # evaluated again, the others keep their previous result
+            old_uve_alarms = self.tab_alarms[tab].get(uv)
+            new_uve_alarms = dict(old_uve_alarms or {})
+            for extn in self.mgrs[tab][tab]:
+                if old_uve_alarms is not None and \
+                        not Controller._alarm_affected(extn.obj, types):
+                    continue
+                try:
+                    nm, errs = extn.obj(uv, uve_data)
+                except Exception as e:
+                    self._logger.error("Alarm[%s] %s failed for %s: %s" % \
+                        (tab, extn.name, uv, str(e)))
+                    continue
                 self._logger.info("Alarm[%s] %s: %s" % (tab, nm, str(errs)))
                 elems = []
                 for ae in errs:
@@ -218,9 +281,11 @@ class Controller(object):
                 if len(elems):
                     new_uve_alarms[nm] = UVEAlarmInfo(type = nm,
                                            description = elems, ack = False)
-            if (not self.tab_alarms[tab].has_key(uv)) or \
-                       pprint.pformat(self.tab_alarms[tab][uv]) != \
-                       pprint.pformat(new_uve_alarms):
+                elif new_uve_alarms.has_key(nm):
+                    del new_uve_alarms[nm]
+            if old_uve_alarms is None or \
+                       Controller._alarms_value(old_uve_alarms) != \
+                       Controller._alarms_value(new_uve_alarms):
                 ustruct = UVEAlarms(name = uv, alarms = new_uve_alarms.values(),
                                     deleted = False)
                 alarm_msg = AlarmTrace(data=ustruct, table=tab)
@@ -271,11 +336,13 @@ class Controller(object):
             if self._workers.has_key(partno):
                 self._logger.info("Dup partition %d" % partno)
             else:
-                uvedb = self._us.get_part(partno)
+                self._uve_state[partno] = {}
                 ph = UveStreamProc(','.join(self._conf.kafka_broker_list()),
                                    partno, "uve-" + str(partno),
-                                   self._logger, uvedb,
-                                   self.handle_uve_notif)
+                                   self._logger, self._us.get_part,
+                                   self.handle_uve_notif,
+                                   self._catchup_sem,
+                                   self._conf.partition_snapshot())
                 ph.start()
                 self._workers[partno] = ph
                 status = True
@@ -289,6 +356,8 @@ class Controller(object):
                 for k,v in db.iteritems():
                     print "%s -> %s" % (k,str(v)) 
                 del self._workers[partno]
+                if self._uve_state.has_key(partno):
+                    del self._uve_state[partno]
                 status = True
             else:
                 self._logger.info("No partition %d" % partno)
@@ -317,6 +386,8 @@ class Controller(object):
             resp.partition = pt
             if self._workers.has_key(pt):
                 resp.enabled = True
+                resp.catchup = PartitionCatchupInfo(
+                    **self._workers[pt].catchup_status())
                 resp.uves = []
                 for kcoll,coll in self._workers[pt].contents().iteritems():
                     uci = UVECollInfo()
@@ -30,6 +30,8 @@ contrail-alarm-gen  --log_level SYS_DEBUG
                     --alarmgen_list 127.0.0.1:0
                     --kafka_broker_list 127.0.0.1:9092
                     --zk_list 127.0.0.1:2181
+                    --partition_catchup_max 4
+                    --partition_snapshot
                     --conf_file /etc/contrail/contrail-alarm-gen.conf
 
 [DEFAULTS]
@@ -63,7 +65,9 @@ log_file = /var/log/contrail/contrail-alarm-gen.log
             'partitions'        : 5,
             'zk_list'           : None,
             'redis_uve_list'    : ['127.0.0.1:6379'],
-            'alarmgen_list'     : ['127.0.0.1:0']
+            'alarmgen_list'     : ['127.0.0.1:0'],
+            'partition_catchup_max' : 4,
+            'partition_snapshot' : False,
         }
 
         redis_opts = {
@@ -147,6 +151,11 @@ log_file = /var/log/contrail/contrail-alarm-gen.log
         parser.add_argument("--alarmgen_list",
             help="List of alarmgens in ip:inst format. For internal use only",
             nargs="+")
+        parser.add_argument("--partition_catchup_max", type=int,
+            help="Maximum number of partitions catching up at the same time")
+        parser.add_argument("--partition_snapshot", action="store_true",
+            help="On acquiring a partition, load its UVEs from redis-uve "
+                 "and skip the replay of its queued messages")
         self._args = parser.parse_args(remaining_argv)
         if type(self._args.collectors) is str:
             self._args.collectors = self._args.collectors.split()
@@ -218,3 +227,12 @@ log_file = /var/log/contrail/contrail-alarm-gen.log
 
     def redis_server_port(self):
         return self._args.redis_server_port
+
+    def partition_catchup_max(self):
+        return self._args.partition_catchup_max
+
+    def partition_snapshot(self):
+        if isinstance(self._args.partition_snapshot, basestring):
+            return self._args.partition_snapshot.lower() in \
+                ['1', 'true', 'yes']
+        return self._args.partition_snapshot
@@ -7,6 +7,10 @@
 # Implementation of database purging
 #
 
+import json
+import time
+import gevent
+import gevent.pool
 import redis
 import pycassa
 from pycassa.pool import ConnectionPool
@@ -17,12 +21,30 @@ from sandesh.viz.constants import *
 from pysandesh.util import UTCTimestampUsec
 
 class AnalyticsDb(object):
+    # tables purged by key scans over token ranges, split into
+    # _PURGE_TOKEN_RANGES ranges per table and handled by
+    # _PURGE_WORKERS workers; removes are sent every _PURGE_BATCH_SIZE rows
+    _PURGE_WORKERS = 4
+    _PURGE_TOKEN_RANGES = 16
+    _PURGE_BATCH_SIZE = 1000
+    _PURGE_EXCLUDED_TABLES = ['MessageTable', 'FlowRecordTable',
+                              'MessageTableTimestamp', 'SystemObjectTable']
+    # token space of the hashing partitioners, the ranges (start, end]
+    # split from it cover all keys. Keys of other partitioners are scanned
+    # in one range.
+    _PARTITIONER_TOKENS = {
+        'org.apache.cassandra.dht.Murmur3Partitioner': (-2**63, 2**63 - 1),
+        'org.apache.cassandra.dht.RandomPartitioner': (-1, 2**127),
+    }
+
     def __init__(self, logger, cassandra_server_list,
-                 redis_query_port, redis_password):
+                 redis_query_port, redis_password, purge_rate_limit=0):
         self._logger = logger
         self._cassandra_server_list = cassandra_server_list
         self._redis_query_port = redis_query_port
         self._redis_password = redis_password
+        # rows deleted per second by a purge, 0 for no limit
+        self._purge_rate_limit = purge_rate_limit
         self._pool = None
         self.connect_db()
         self.number_of_purge_requests = 0
@@ -103,7 +125,8 @@ class AnalyticsDb(object):
         try:
             redish = redis.StrictRedis(db=0, host='127.0.0.1',
                      port=self._redis_query_port, password=self._redis_password)
-            redish.delete('ANALYTICS_DB_PURGE')
+            redish.delete('ANALYTICS_DB_PURGE',
+                          'ANALYTICS_DB_PURGE_CHECKPOINT')
         except redis.exceptions.ConnectionError:
             self._logger.error("Exception: "
                                "Failure in connection to redis-server")
@@ -136,8 +159,121 @@ class AnalyticsDb(object):
         return None
     # end get_analytics_db_purge_status
 
+    def get_pending_purge(self):
+        # purge that was running when analytics-api went down, if any
+        try:
+            redish = redis.StrictRedis(db=0, host='127.0.0.1',
+                     port=self._redis_query_port, password=self._redis_password)
+            status = redish.hmget('ANALYTICS_DB_PURGE',
+                                  ['status', 'purge_id', 'purge_input'])
+        except (redis.exceptions.ConnectionError,
+                redis.exceptions.ResponseError) as e:
+            self._logger.error("Exception: Failed to read the purge status "
+                               "%s" % e)
+            return None
+        if status[0] != 'running' or not status[1] or not status[2]:
+            return None
+        return (status[1], float(status[2]))
+    # end get_pending_purge
+
+    def _purge_token_ranges(self, partitioner):
+        tokens = self._PARTITIONER_TOKENS.get(partitioner)
+        if tokens is None:
+            return [(None, None)]
+        start, end = tokens
+        step = (end - start) / self._PURGE_TOKEN_RANGES
+        bounds = [start + i * step for i in range(self._PURGE_TOKEN_RANGES)]
+        bounds.append(end)
+        return [(str(bounds[i]), str(bounds[i + 1])) \
+                for i in range(len(bounds) - 1)]
+    # end _purge_token_ranges
+
+    def _purge_throttle(self, state, rows):
+        state['rows_deleted'] += rows
+        state['rows_sent'] += rows
+        if not self._purge_rate_limit:
+            return
+        wait = state['rows_sent'] / float(self._purge_rate_limit) - \
+            (time.time() - state['start_time'])
+        if wait > 0:
+            gevent.sleep(wait)
+    # end _purge_throttle
+
+    def _purge_range(self, state, table, tokens, purge_time):
+        # returns the number of rows deleted from the token range of the
+        # table, or None if the table can not be purged
+        try:
+            cf = pycassa.ColumnFamily(self._pool, table)
+        except Exception as e:
+            self._logger.error("purge_id %s Failure in fetching "
+                "the columnfamily %s: %s" % (state['purge_id'], table, e))
+            return None
+        deleted = 0
+        b = cf.batch()
+        pending = 0
+        try:
+            for key, _ in cf.get_range(start_token=tokens[0],
+                    finish_token=tokens[1], column_count=0,
+                    filter_empty=False, buffer_size=self._PURGE_BATCH_SIZE):
+                t2 = key[0]
+                # each row will have equivalent of 2^23 = 8388608 usecs
+                row_time = (float(t2)*pow(2, RowTimeInBits))
+                if (row_time < purge_time):
+                    b.remove(key)
+                    pending += 1
+                    if pending == self._PURGE_BATCH_SIZE:
+                        b.send()
+                        deleted += pending
+                        self._purge_throttle(state, pending)
+                        pending = 0
+            b.send()
+            deleted += pending
+            self._purge_throttle(state, pending)
+        except Exception as e:
+            self._logger.error("Exception: Purge_id %s This table "
+                "doesnot have row time %s" % (state['purge_id'], e))
+            return None
+        return deleted
+    # end _purge_range
+
+    def _purge_progress(self, state, table, index, deleted):
+        # record the range as done so that an interrupted purge resumes
+        # after it, and publish the progress of the table
+        progress = state['tables'][table]
+        progress['ranges_done'] += 1
+        progress['rows_deleted'] += deleted
+        try:
+            pipe = state['redis'].pipeline()
+            pipe.hset('ANALYTICS_DB_PURGE_CHECKPOINT',
+                      '%s:%d' % (table, index), deleted)
+            pipe.hset('ANALYTICS_DB_PURGE', 'table:' + table,
+                      json.dumps(progress))
+            pipe.hset('ANALYTICS_DB_PURGE', 'rows_deleted',
+                      state['rows_deleted'])
+            pipe.execute()
+        except (redis.exceptions.ConnectionError,
+                redis.exceptions.ResponseError) as e:
+            self._logger.error("Exception: Purge_id %s Failed to update "
+                "purge progress %s" % (state['purge_id'], e))
+    # end _purge_progress
+
+    def _purge_checkpoint(self, redish, purge_id):
+        try:
+            checkpoint = redish.hgetall('ANALYTICS_DB_PURGE_CHECKPOINT')
+            if checkpoint.pop('purge_id', None) != purge_id:
+                checkpoint = {}
+                redish.delete('ANALYTICS_DB_PURGE_CHECKPOINT')
+                redish.hset('ANALYTICS_DB_PURGE_CHECKPOINT', 'purge_id',
+                            purge_id)
+        except (redis.exceptions.ConnectionError,
+                redis.exceptions.ResponseError) as e:
+            self._logger.error("Exception: Purge_id %s Failed to read "
+                "purge checkpoint %s" % (purge_id, e))
+            return {}
+        return checkpoint
+    # end _purge_checkpoint
+
     def purge_old_data(self, purge_id, purge_time):
-        total_rows_deleted = 0 # total number of rows deleted
         if (self._pool == None):
             self.connect_db()
         if not self._pool:
@@ -149,42 +285,59 @@ class AnalyticsDb(object):
             return -1
         try:
             table_list = sysm.get_keyspace_column_families(COLLECTOR_KEYSPACE)
+            partitioner = sysm.describe_partitioner()
         except Exception as e:
             self._logger.error("Exception: Purge_id %s Failed to get "
                 "Analytics Column families %s" % (purge_id, e))
             return -1
-        excluded_table_list = ['MessageTable', 'FlowRecordTable',
-                               'MessageTableTimestamp', 'SystemObjectTable']
+        token_ranges = self._purge_token_ranges(partitioner)
+        redish = redis.StrictRedis(db=0, host='127.0.0.1',
+                 port=self._redis_query_port, password=self._redis_password)
+        checkpoint = self._purge_checkpoint(redish, purge_id)
+
+        state = {'purge_id': purge_id, 'redis': redish, 'tables': {},
+                 'rows_deleted': 0, 'rows_sent': 0,
+                 'start_time': time.time()}
+        work = []
         for table in table_list:
             # purge from index tables
-            if (table not in excluded_table_list):
-                self._logger.info("purge_id %s deleting old records from "
-                                  "table: %s" % (purge_id, table))
-                # total number of rows deleted from each table
-                per_table_deleted = 0
-                try:
-                    cf = pycassa.ColumnFamily(self._pool, table)
-                except Exception as e:
-                    self._logger.error("purge_id %s Failure in fetching "
-                        "the columnfamily %s" % e)
-                    return -1
-                b = cf.batch()
-                try:
-                    for key, cols in cf.get_range():
-                        t2 = key[0]
-                        # each row will have equivalent of 2^23 = 8388608 usecs
-                        row_time = (float(t2)*pow(2, RowTimeInBits))
-                        if (row_time < purge_time):
-                            per_table_deleted +=1
-                            total_rows_deleted +=1
-                            b.remove(key)
-                    b.send()
-                except Exception as e:
-                    self._logger.error("Exception: Purge_id %s This table "
-                        "doesnot have row time %s" % (purge_id, e))
-                    continue
-                self._logger.info("Purge_id %s deleted %d rows from table: %s"
-                    % (purge_id, per_table_deleted, table))
+            if table in self._PURGE_EXCLUDED_TABLES:
+                continue
+            progress = {'ranges': len(token_ranges), 'ranges_done': 0,
+                        'rows_deleted': 0}
+            state['tables'][table] = progress
+            for index, tokens in enumerate(token_ranges):
+                done = checkpoint.get('%s:%d' % (table, index))
+                if done is not None:
+                    progress['ranges_done'] += 1
+                    progress['rows_deleted'] += int(done)
+                    state['rows_deleted'] += int(done)
+                else:
+                    work.append((table, index, tokens))
+
+        failed = set()
+        def purge_range(item):
+            table, index, tokens = item
+            if table in failed:
+                return
+            deleted = self._purge_range(state, table, tokens, purge_time)
+            if deleted is None:
+                failed.add(table)
+            else:
+                self._purge_progress(state, table, index, deleted)
+
+        self._logger.info("purge_id %s deleting old records from %d tables, "
+            "%d token ranges to scan" % (purge_id, len(state['tables']),
+                                         len(work)))
+        pool = gevent.pool.Pool(self._PURGE_WORKERS)
+        for item in work:
+            pool.spawn(purge_range, item)
+        pool.join()
+
+        for table, progress in state['tables'].iteritems():
+            self._logger.info("Purge_id %s deleted %d rows from table: %s"
+                % (purge_id, progress['rows_deleted'], table))
+        total_rows_deleted = state['rows_deleted']
         self._logger.info("Purge_id %s total rows deleted: %s"
             % (purge_id, total_rows_deleted))
         return total_rows_deleted
@@ -16,6 +16,7 @@ except ImportError:
     # python 2.6 or earlier, use backport
     from ordereddict import OrderedDict
 from uveserver import UVEServer
+from query_cache import QueryResultCache
 import sys
 import ConfigParser
 import bottle
@@ -74,6 +75,14 @@ _ERRORS = {
     errno.EBUSY: 503
 }
 
+# Seconds to block for a query status update before checking that the
+# query is still known to the query engine
+_QUERY_WAIT_TIMEOUT = 10
+# Lifetime the query engine gives to REPLY/QUERY keys of a finished query
+_QUERY_EXPIRY = 300
+# Result rows read from Redis per LRANGE
+_QUERY_RESULT_PAGE = 1000
+
 @bottle.error(400)
 @bottle.error(403)
 @bottle.error(404)
@@ -99,9 +108,7 @@ def obj_to_dict(obj):
 # end obj_to_dict
 
 
-def redis_query_start(host, port, redis_password, qid, inp):
-    redish = redis.StrictRedis(db=0, host=host, port=port,
-                                   password=redis_password)
+def redis_query_start(redish, qid, inp):
     for key, value in inp.items():
         redish.hset("QUERY:" + qid, key, json.dumps(value))
     query_metadata = {}
@@ -147,7 +154,30 @@ def redis_query_status(host, port, redis_password, qid):
 # end redis_query_status
 
 
+def redis_query_wait(redish, qid, timeout):
+    # The query engine RPUSHes every progress update on REPLY:<qid>;
+    # consume them in order as they arrive
+    res = redish.blpop("REPLY:" + qid, timeout)
+    if res is None:
+        return None
+    return json.loads(res[1])
+# end redis_query_wait
+
+
+def redis_query_final(redish, qid, stat):
+    # Put back the final status consumed by redis_query_wait for the
+    # status URI and the result reader
+    key = "REPLY:" + qid
+    pipe = redish.pipeline()
+    pipe.rpush(key, json.dumps(stat))
+    pipe.expire(key, _QUERY_EXPIRY)
+    pipe.execute()
+# end redis_query_final
+
+
 def redis_query_chunk_iter(host, port, redis_password, qid, chunk_id):
+    # Yield the result rows as lists of at most _QUERY_RESULT_PAGE json
+    # strings, so that only one page is held in memory at a time
     redish = redis.StrictRedis(db=0, host=host, port=port,
                                password=redis_password)
 
@@ -155,15 +185,21 @@ def redis_query_chunk_iter(host, port, redis_password, qid, chunk_id):
     fin = False
 
     while not fin:
-        #import pdb; pdb.set_trace()
+        key = "RESULT:" + qid + ":" + str(iters)
         # Keep the result line valid while it is being read
-        redish.persist("RESULT:" + qid + ":" + str(iters))
-        elems = redish.lrange("RESULT:" + qid + ":" + str(iters), 0, -1)
-        yield elems
-        if elems == []:
+        redish.persist(key)
+        start = 0
+        while True:
+            elems = redish.lrange(key, start, start + _QUERY_RESULT_PAGE - 1)
+            if elems:
+                yield elems
+            if len(elems) < _QUERY_RESULT_PAGE:
+                break
+            start += _QUERY_RESULT_PAGE
+        if start == 0 and elems == []:
             fin = True
         else:
-            redish.delete("RESULT:" + qid + ":" + str(iters), 0, -1)
+            redish.delete(key)
         iters += 1
 
     return
@@ -173,31 +209,13 @@ def redis_query_chunk_iter(host, port, redis_password, qid, chunk_id):
 def redis_query_chunk(host, port, redis_password, qid, chunk_id):
     res_iter = redis_query_chunk_iter(host, port, redis_password, qid, chunk_id)
 
-    dli = u''
-    starter = True
-    fin = False
+    sep = u'\n'
     yield u'{"value": ['
-    outcount = 0
-    while not fin:
-
-        #import pdb; pdb.set_trace()
-        # Keep the result line valid while it is being read
-        elems = res_iter.next()
-
-        fin = True
-        for elem in elems:
-            fin = False
-            outcount += 1
-            if starter:
-                dli += '\n' + elem
-                starter = False
-            else:
-                dli += ', ' + elem
-        if not fin:
-            yield dli + '\n'
-            dli = u''
+    for elems in res_iter:
+        yield sep + u', '.join(elems) + u'\n'
+        sep = u', '
 
-    if outcount == 0:
+    if sep == u'\n':
         yield '\n' + u']}'
     else:
         yield u']}'
@@ -205,6 +223,15 @@ def redis_query_chunk(host, port, redis_password, qid, chunk_id):
 # end redis_query_chunk
 
 
+def redis_query_result_iter(host, port, redis_password, qid):
+    # Rows of a completed query, decoded one at a time for in-process
+    # consumers
+    for elems in redis_query_chunk_iter(host, port, redis_password, qid, 0):
+        for elem in elems:
+            yield json.loads(elem)
+# end redis_query_result_iter
+
+
 
 def redis_query_result(host, port, redis_password, qid):
     try:
@@ -252,18 +279,8 @@ def redis_query_result_dict(host, port, redis_password, qid):
     prg = int(stat["progress"])
     res = []
 
-    if (prg < 0) or (prg == 100):
-
-        done = False
-        gen = redis_query_result(host, port, redis_password, qid)
-        result = u''
-        while not done:
-            try:
-                result += gen.next()
-                #import pdb; pdb.set_trace()
-            except StopIteration:
-                done = True
-        res = (json.loads(result))['value']
+    if prg == 100:
+        res = list(redis_query_result_iter(host, port, redis_password, qid))
 
     return prg, res
 # end redis_query_result_dict
@@ -321,6 +338,45 @@ class OpStateServer(object):
 
 # end class OpStateServer
 
+class QueryStats(object):
+    """Latency of synchronous queries, split into time spent waiting
+    for the query engine to pick the query up, executing it, and
+    streaming the result back. Times are kept in usec."""
+
+    _STAGES = ['enqueue', 'exec', 'result']
+
+    def __init__(self):
+        self._queries = 0
+        self._errors = 0
+        self._total = dict((stage, 0) for stage in self._STAGES)
+        self._max = dict((stage, 0) for stage in self._STAGES)
+    # end __init__
+
+    def update(self, enqueue, execute, result):
+        self._queries += 1
+        for stage, val in zip(self._STAGES, [enqueue, execute, result]):
+            self._total[stage] += val
+            self._max[stage] = max(self._max[stage], val)
+    # end update
+
+    def error(self):
+        self._errors += 1
+    # end error
+
+    def get(self):
+        stats = {'queries': self._queries, 'errors': self._errors}
+        for stage in self._STAGES:
+            avg = 0
+            if self._queries:
+                avg = self._total[stage] / self._queries
+            stats[stage + '_time_avg'] = avg / 1000
+            stats[stage + '_time_max'] = self._max[stage] / 1000
+        return stats
+    # end get
+
+# end class QueryStats
+
+
 class OpServer(object):
 
     """
@@ -509,6 +565,15 @@ class OpServer(object):
                                       self._args.redis_server_port),
                                      self._logger,
                                      self._args.redis_password)
+        self._redis_query_pool = redis.ConnectionPool(
+            host='127.0.0.1', port=int(self._args.redis_query_port),
+            password=self._args.redis_password, db=0)
+        self._query_stats = QueryStats()
+        self._query_cache = None
+        if self._args.query_cache_ttl > 0:
+            self._query_cache = QueryResultCache(
+                self._args.query_cache_ttl,
+                self._args.query_cache_size * 1024 * 1024)
 
         self._LEVEL_LIST = []
         for k in SandeshLevel._VALUES_TO_NAMES:
@@ -606,7 +671,14 @@ class OpServer(object):
         self._analytics_db = AnalyticsDb(self._logger,
                                          self._args.cassandra_server_list,
                                          self._args.redis_query_port,
-                                         self._args.redis_password)
+                                         self._args.redis_password,
+                                         self._args.db_purge_rate_limit)
+        # resume the purge interrupted by a restart
+        pending_purge = self._analytics_db.get_pending_purge()
+        if pending_purge is not None:
+            purge_id, purge_input = pending_purge
+            self._logger.info("purge_id %s resuming purge" % purge_id)
+            gevent.spawn(self.db_purge_operation, purge_input, purge_id)
 
         bottle.route('/', 'GET', self.homepage_http_get)
         bottle.route('/analytics', 'GET', self.analytics_http_get)
@@ -720,7 +792,10 @@ class OpServer(object):
             'use_syslog'         : False,
             'syslog_facility'    : Sandesh._DEFAULT_SYSLOG_FACILITY,
             'dup'                : False,
-            'redis_uve_list'     : ['127.0.0.1:6379']
+            'redis_uve_list'     : ['127.0.0.1:6379'],
+            'query_cache_ttl'    : 0,
+            'query_cache_size'   : 64,
+            'db_purge_rate_limit' : 0,
         }
         redis_opts = {
             'redis_server_port'  : 6379,
@@ -807,6 +882,17 @@ class OpServer(object):
         parser.add_argument("--cassandra_server_list",
             help="List of cassandra_server_ip in ip:port format",
             nargs="+")
+        parser.add_argument("--query_cache_ttl",
+            type=int,
+            help="Seconds for which results of a sync query are served to "
+                 "identical queries, 0 to disable")
+        parser.add_argument("--query_cache_size",
+            type=int,
+            help="Memory for cached query results, in MB")
+        parser.add_argument("--db_purge_rate_limit",
+            type=int,
+            help="Rows deleted per second by a database purge, "
+                 "0 for no limit")
 
         self._args = parser.parse_args(remaining_argv)
         if type(self._args.collectors) is str:
@@ -829,6 +915,22 @@ class OpServer(object):
         return self._uve_server
     # end get_uve_server
 
+    def get_query_stats(self):
+        return self._query_stats.get()
+    # end get_query_stats
+
+    def get_query_cache_stats(self):
+        stats = {'enabled': self._query_cache is not None}
+        if self._query_cache is not None:
+            stats.update({
+                'entries': len(self._query_cache),
+                'size': self._query_cache.size(),
+                'hits': self._query_cache.hits,
+                'misses': self._query_cache.misses,
+                'evictions': self._query_cache.evictions})
+        return stats
+    # end get_query_cache_stats
+
     def homepage_http_get(self):
         json_body = {}
         json_links = []
@@ -1008,17 +1110,18 @@ class OpServer(object):
             if tabl == OVERLAY_TO_UNDERLAY_FLOW_MAP:
                 overlay_to_underlay_map = OverlayToUnderlayMapper(
                     request.json, self._args.host_ip,
-                    self._args.rest_api_port, self._logger)
+                    self._args.rest_api_port, self._logger,
+                    self._query_rows)
                 try:
                     yield overlay_to_underlay_map.process_query()
                 except OverlayToUnderlayMapperError as e:
                     yield bottle.HTTPError(_ERRORS[errno.EIO], str(e))
                 return
 
-            prg = redis_query_start('127.0.0.1',
-                                    int(self._args.redis_query_port),
-                                    self._args.redis_password,
-                                    qid, request.json)
+            enqueue_time = UTCTimestampUsec()
+            redish = redis.StrictRedis(
+                connection_pool=self._redis_query_pool)
+            prg = redis_query_start(redish, qid, request.json)
             if prg is None:
                 # Update connection info
                 ConnectionState.update(conn_type = ConnectionType.REDIS,
@@ -1065,47 +1168,80 @@ class OpServer(object):
                 # In Async mode, we should return with "202 Accepted" here
                 # and also give back the status URI "/analytic/query/<qid>"
                 # OpServers's client will poll the status URI
-                if request.get_header('Expect') == '202-accepted' or\
-                   request.get_header('Postman-Expect') == '202-accepted':
+                if OpServer._query_async(request):
                     href = '/analytics/query/%s' % (qid)
                     resp_data = json.dumps({'href': href})
                     yield bottle.HTTPResponse(
                         resp_data, 202, {'Content-type': 'application/json'})
                 else:
-                    for gen in self._sync_query(request, qid):
+                    for gen in self._sync_query(request, qid, enqueue_time):
                         yield gen
     # end _query
 
-    def _sync_query(self, request, qid):
-        # In Sync mode, Keep polling query status until final result is
-        # available
-        try:
-            self._logger.info("Polling %s for query result" % ("REPLY:" + qid))
-            prg = 0
-            done = False
-            while not done:
-                gevent.sleep(1)
-                resp = redis_query_status(host='127.0.0.1',
-                                          port=int(
-                                              self._args.redis_query_port),
-                                          redis_password=self._args.redis_password,
-                                          qid=qid)
-
-                # We want to print progress only if it has changed
-                if int(resp["progress"]) == prg:
+    def _query_wait(self, qid):
+        # Wait for query status updates until the query is complete or has
+        # failed, and return the final progress
+        self._logger.info("Waiting on %s for query result" % ("REPLY:" + qid))
+        redish = redis.StrictRedis(connection_pool=self._redis_query_pool)
+        prg = 0
+        done = False
+        while not done:
+            stat = redis_query_wait(redish, qid, _QUERY_WAIT_TIMEOUT)
+            if stat is None:
+                if redish.exists("QUERY:" + qid):
                     continue
+                # The query engine has dropped the query
+                stat = {"progress": -errno.EIO}
 
-                self._logger.info(
-                    "Query Progress is %s time %d" % (str(resp), time.time()))
-                prg = int(resp["progress"])
+            # We want to print progress only if it has changed
+            if int(stat["progress"]) == prg:
+                continue
 
-                # Either there was an error, or the query is complete
-                if (prg < 0) or (prg == 100):
-                    done = True
+            self._logger.info(
+                "Query Progress is %s time %d" % (str(stat), time.time()))
+            prg = int(stat["progress"])
+
+            # Either there was an error, or the query is complete
+            if (prg < 0) or (prg == 100):
+                done = True
+        redis_query_final(redish, qid, stat)
+        return prg
+    # end _query_wait
+
+    def _query_rows(self, query):
+        # Run a query for OverlayToUnderlayMapper without going through
+        # the REST API. Returns the result rows, or None on failure.
+        redis_query_ip, = struct.unpack('>I', socket.inet_pton(
+                                    socket.AF_INET, self._args.host_ip))
+        qid = str(uuid.uuid1(redis_query_ip))
+        port = int(self._args.redis_query_port)
+        redish = redis.StrictRedis(connection_pool=self._redis_query_pool)
+        prg = redis_query_start(redish, qid, json.loads(query))
+        if prg is None:
+            self._logger.error('QE Not Responding')
+            return None
+        if prg >= 0:
+            prg = self._query_wait(qid)
+        if prg < 0:
+            self._logger.error("Query %s Found Error %s" %
+                               (qid, errno.errorcode[-prg]))
+            return None
+        return list(redis_query_result_iter('127.0.0.1', port,
+                                            self._args.redis_password, qid))
+    # end _query_rows
+
+    def _sync_query(self, request, qid, enqueue_time):
+        # In Sync mode, wait for query status updates until final result is
+        # available
+        try:
+            accept_time = UTCTimestampUsec()
+            prg = self._query_wait(qid)
+            done_time = UTCTimestampUsec()
 
             if prg < 0:
                 cod = -prg
                 self._logger.error("Found Error %s" % errno.errorcode[cod])
+                self._query_stats.error()
                 reply = bottle.HTTPError(_ERRORS[cod], errno.errorcode[cod])
                 yield reply
                 return
@@ -1123,6 +1259,15 @@ class OpServer(object):
                     yield gen.next()
                 except StopIteration:
                     done = True
+            end_time = UTCTimestampUsec()
+            self._query_stats.update(accept_time - enqueue_time,
+                                     done_time - accept_time,
+                                     end_time - done_time)
+            self._logger.info(
+                "Query [%s] latency (ms) enqueue %d exec %d result %d" %
+                (qid, (accept_time - enqueue_time) / 1000,
+                 (done_time - accept_time) / 1000,
+                 (end_time - done_time) / 1000))
             '''
             final_res = {}
             prg, final_res['value'] =\
@@ -1139,6 +1284,7 @@ class OpServer(object):
                 message = 'Sync Query[%s] Connection Error' % qid,
                 server_addrs = ['127.0.0.1' + ':' + 
                     str(self._args.redis_query_port)])  
+            self._query_stats.error()
             yield bottle.HTTPError(_ERRORS[errno.EIO],
                     'Failure in connection to the query DB')
         except Exception as e:
@@ -1149,6 +1295,7 @@ class OpServer(object):
                 server_addrs = ['127.0.0.1' + ':' + 
                     str(self._args.redis_query_port)])  
             self._logger.error("Exception: %s" % str(e))
+            self._query_stats.error()
             yield bottle.HTTPError(_ERRORS[errno.EIO], 
                     'Error: %s' % e)
         else:
@@ -1163,8 +1310,66 @@ class OpServer(object):
         return
     # end _sync_query
 
+    @staticmethod
+    def _query_async(request):
+        return request.get_header('Expect') == '202-accepted' or\
+               request.get_header('Postman-Expect') == '202-accepted'
+    # end _query_async
+
+    def _cached_query(self, request):
+        try:
+            query = request.json
+        except Exception:
+            query = None
+        if not isinstance(query, dict):
+            # not a query to cache, leave the error reply to _query
+            for gen in self._query(request):
+                yield gen
+            return
+        cache_key = self._query_cache.key(query)
+        while True:
+            result = self._query_cache.get(cache_key)
+            if result is not None:
+                self._logger.info("Query result served from cache")
+                bottle.response.set_header('Content-Type', 'application/json')
+                yield result
+                return
+            inflight = self._query_cache.acquire(cache_key)
+            if inflight is None:
+                break
+            # identical query running, use its result
+            inflight.wait()
+
+        # Keep the response for the cache as it is streamed, unless it is
+        # an error or grows too large
+        parts = []
+        size = 0
+        cacheable = True
+        done = False
+        try:
+            for gen in self._query(request):
+                if cacheable:
+                    if isinstance(gen, basestring) and \
+                       size + len(gen) <= self._query_cache.max_entry_size():
+                        parts.append(gen)
+                        size += len(gen)
+                    else:
+                        cacheable = False
+                        parts = []
+                yield gen
+            done = True
+        finally:
+            result = None
+            if done and cacheable:
+                result = u''.join(parts)
+            self._query_cache.release(cache_key, result)
+    # end _cached_query
+
     def query_process(self):
         self._post_common(bottle.request, None)
+        if self._query_cache is not None and \
+           not OpServer._query_async(bottle.request):
+            return self._cached_query(bottle.request)
         result = self._query(bottle.request)
         return result
     # end query_process
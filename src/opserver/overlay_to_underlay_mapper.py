@@ -9,6 +9,7 @@
 #
 
 import json
+import gevent.pool
 
 from sandesh.viz.constants import *
 from opserver_util import OpServerUtils
@@ -26,12 +27,22 @@ class OverlayToUnderlayMapperError(Exception):
 
 class OverlayToUnderlayMapper(object):
 
+    # OR terms per UFlowData query. Larger where clauses are split into
+    # sub-queries, of which up to _UFLOW_DATA_QUERY_PARALLEL are run
+    # at a time.
+    _UFLOW_DATA_WHERE_MAX = 1000
+    _UFLOW_DATA_QUERY_PARALLEL = 4
+
     def __init__(self, query_json, analytics_api_ip,
-                 analytics_api_port, logger):
+                 analytics_api_port, logger, query_handler=None):
         self.query_json = query_json
         self._analytics_api_ip = analytics_api_ip
         self._analytics_api_port = analytics_api_port
         self._logger = logger
+        # Called with the query JSON to run it in-process, returns the
+        # result rows or None if the query failed. Queries are posted to
+        # the analytics-api server if it is not set.
+        self._query_handler = query_handler
         if self.query_json is not None:
             self._start_time = self.query_json['start_time']
             self._end_time = self.query_json['end_time']
@@ -145,33 +156,43 @@ class OverlayToUnderlayMapper(object):
         if not len(flow_record_data):
             return []
 
+        # flows carried in the same tunnel have the same underlay flows
+        tunnel_fields = [
+            FlowRecordNames[FlowRecordFields.FLOWREC_VROUTER_IP],
+            FlowRecordNames[FlowRecordFields.FLOWREC_OTHER_VROUTER_IP],
+            FlowRecordNames[FlowRecordFields.FLOWREC_UNDERLAY_SPORT],
+            FlowRecordNames[FlowRecordFields.FLOWREC_UNDERLAY_PROTO]
+        ]
+        tunnels = []
+        tunnel_set = set()
+        for row in flow_record_data:
+            tunnel = tuple(row[field] for field in tunnel_fields)
+            if tunnel not in tunnel_set:
+                tunnel_set.add(tunnel)
+                tunnels.append(tunnel)
+
         # populate where clause for Underlay Flow query
         uflow_data_where = []
-        for row in flow_record_data:
+        for vrouter, other_vrouter, usport, uproto in tunnels:
             uflow_data_where_and_list = []
             ufname = self._flowrecord_to_uflowdata_name(
                 FlowRecordNames[FlowRecordFields.FLOWREC_VROUTER_IP])
-            val = row[FlowRecordNames[FlowRecordFields.FLOWREC_VROUTER_IP]]
-            sip = OpServerUtils.Match(name=ufname, value=val,
+            sip = OpServerUtils.Match(name=ufname, value=vrouter,
                 op=OpServerUtils.MatchOp.EQUAL)
             uflow_data_where_and_list.append(sip.__dict__)
             ufname = self._flowrecord_to_uflowdata_name(
                 FlowRecordNames[FlowRecordFields.FLOWREC_OTHER_VROUTER_IP])
-            val = \
-                row[FlowRecordNames[FlowRecordFields.FLOWREC_OTHER_VROUTER_IP]]
-            dip = OpServerUtils.Match(name=ufname, value=val,
+            dip = OpServerUtils.Match(name=ufname, value=other_vrouter,
                 op=OpServerUtils.MatchOp.EQUAL)
             uflow_data_where_and_list.append(dip.__dict__)
             ufname = self._flowrecord_to_uflowdata_name(
                 FlowRecordNames[FlowRecordFields.FLOWREC_UNDERLAY_SPORT])
-            val = row[FlowRecordNames[FlowRecordFields.FLOWREC_UNDERLAY_SPORT]]
-            sport = OpServerUtils.Match(name=ufname, value=val,
+            sport = OpServerUtils.Match(name=ufname, value=usport,
                     op=OpServerUtils.MatchOp.EQUAL)
             ufname = self._flowrecord_to_uflowdata_name(
                     FlowRecordNames[FlowRecordFields.FLOWREC_UNDERLAY_PROTO])
-            val = row[FlowRecordNames[FlowRecordFields.FLOWREC_UNDERLAY_PROTO]]
             # get the protocol from tunnel_type
-            val = OpServerUtils.tunnel_type_to_protocol(val)
+            val = OpServerUtils.tunnel_type_to_protocol(uproto)
             protocol = OpServerUtils.Match(name=ufname, value=val,
                     op=OpServerUtils.MatchOp.EQUAL, suffix=sport)
             uflow_data_where_and_list.append(protocol.__dict__)
@@ -206,23 +227,49 @@ class OverlayToUnderlayMapper(object):
                     match_term['name'] = self._underlay_to_uflowdata_name(
                                             match_term['name'])
 
-        uflow_data_query = OpServerUtils.Query(
+        uflow_data_queries = []
+        for i in range(0, len(uflow_data_where), self._UFLOW_DATA_WHERE_MAX):
+            uflow_data_query = OpServerUtils.Query(
                                 table='StatTable.UFlowData.flow',
                                 start_time=self._start_time,
                                 end_time=self._end_time,
                                 select_fields=uflow_data_select,
-                                where=uflow_data_where,
+                                where=uflow_data_where[
+                                    i:i + self._UFLOW_DATA_WHERE_MAX],
                                 sort=uflow_data_sort_type,
                                 sort_fields=uflow_data_sort_fields,
                                 limit=uflow_data_limit,
                                 filter=uflow_data_filter)
-        return self._send_query(json.dumps(uflow_data_query.__dict__))
+            uflow_data_queries.append(json.dumps(uflow_data_query.__dict__))
+        if len(uflow_data_queries) == 1:
+            return self._send_query(uflow_data_queries[0])
+
+        self._logger.debug('Splitting UFlowData query for %d tunnels '
+            'into %d queries' % (len(tunnels), len(uflow_data_queries)))
+        pool = gevent.pool.Pool(self._UFLOW_DATA_QUERY_PARALLEL)
+        uflow_data = []
+        for value in pool.map(self._send_query, uflow_data_queries):
+            uflow_data.extend(value)
+        # each sub-query is sorted and limited on its own
+        if uflow_data_sort_fields:
+            uflow_data.sort(
+                key=lambda row: [row.get(f) for f in uflow_data_sort_fields],
+                reverse=(uflow_data_sort_type ==
+                         OpServerUtils.SortOp.DESCENDING))
+        if uflow_data_limit:
+            uflow_data = uflow_data[:uflow_data_limit]
+        return uflow_data
     # end _get_underlay_flow_data
 
     def _send_query(self, query):
-        """Post the query to the analytics-api server and returns the
-        response."""
+        """Run the query in-process through the query handler, or post
+        it to the analytics-api server, and returns the response."""
         self._logger.debug('Sending query: %s' % (query))
+        if self._query_handler is not None:
+            value = self._query_handler(query)
+            if value is None:
+                raise _QueryError(query)
+            return value
         opserver_url = OpServerUtils.opserver_query_url(self._analytics_api_ip,
                            str(self._analytics_api_port))
         resp = OpServerUtils.post_url_http(opserver_url, query, True)
@@ -288,5 +335,5 @@ class _QueryError(OverlayToUnderlayMapperError):
         self.query = query
 
     def __str__(self):
-        return 'Error in query processing: %s' % (query)
+        return 'Error in query processing: %s' % (self.query)
 # end class _QueryError
@@ -10,9 +10,28 @@ from uveserver import UVEServer
 import os
 import json
 import copy
+import time
 
 class PartitionHandler(gevent.Greenlet):
-    def __init__(self, brokers, partition, group, topic, logger, limit):
+    # Messages fetched and handled together
+    _FETCH_COUNT = 100
+    # Seconds to wait for a batch to fill up
+    _FETCH_TIMEOUT = 0.1
+    # Offsets are committed every _COMMIT_COUNT messages, or when
+    # _COMMIT_INTERVAL seconds have passed since the last commit
+    _COMMIT_COUNT = 1000
+    _COMMIT_INTERVAL = 1.0
+
+    # Arguments:
+    #
+    #  catchup_sem : Semaphore bounding the partitions catching up
+    #                at the same time, shared by the handlers
+    #  snapshot    : Instead of replaying the partition from the last
+    #                committed offset, load a snapshot of the state
+    #                (see _load) and consume only the messages queued
+    #                from then on
+    def __init__(self, brokers, partition, group, topic, logger, limit,
+                 catchup_sem=None, snapshot=False):
         gevent.Greenlet.__init__(self)
         self._brokers = brokers
         self._partition = partition
@@ -22,21 +41,126 @@ class PartitionHandler(gevent.Greenlet):
         self._limit = limit
         self._partdb = {}
         self._partoffset = None
+        self._uncommitted = 0
+        self._last_commit = time.time()
+        self._catchup_sem = catchup_sem
+        self._snapshot = snapshot
+        self._catchup_state = "init"
+        self._catchup_offset = None
+        self._catchup_last_offset = None
+        self._catchup_count = 0
+
+    def catchup_status(self):
+        return {'status': self._catchup_state,
+                'offset': self._catchup_offset,
+                'last_offset': self._catchup_last_offset,
+                'messages': self._catchup_count}
+
+    def _load(self):
+        '''
+        Load the state of the partition, before the messages that were
+        queued for it are handled
+        '''
+        pass
+
+    def msg_handler(self, mlist):
+        for om in mlist:
+            self._partoffset = om.offset
+            self._partdb[om.message.key] = om.message.value 
+            self._logger.info("%d Reading %s" % (self._partition, str(om)))
+        return True
+
+    def _commit(self, consumer, force=False):
+        if not self._uncommitted:
+            return
+        if force or self._uncommitted >= self._COMMIT_COUNT or \
+                time.time() - self._last_commit >= self._COMMIT_INTERVAL:
+            consumer.commit()
+            self._uncommitted = 0
+            self._last_commit = time.time()
 
-    def msg_handler(self, om):
-        self._partoffset = om.offset
-        self._partdb[om.message.key] = om.message.value 
-        self._logger.info("%d Reading %s" % (self._partition, str(om)))
+    def _catchup(self, consumer):
+        '''
+        Bring the partition up to date with the messages queued for it.
+        Returns False if the catch-up has to be retried.
+        '''
+        self._catchup_state = "catching up"
+        self._catchup_offset = None
+        self._catchup_last_offset = None
+        self._catchup_count = 0
+
+        # Find the offset of the last message that has been queued
+        consumer.seek(0,2)
+        if self._snapshot:
+            # The snapshot is taken after the end of the partition was
+            # found, only the messages queued from there on are needed
+            self._load()
+            self._logger.info("Loaded snapshot for %d" % self._partition)
+            return True
+
+        try:
+            mi = consumer.get_message(timeout=0.1)
+        except common.OffsetOutOfRangeError:
+            mi = None
+        self._logger.info("Last Queued for %d is %s" % \
+                          (self._partition,str(mi)))
+
+        # start reading from last previously processed message
+        consumer.seek(0,1)
+        self._load()
+
+        if mi == None:
+            return True
+
+        count = 0
+        self._logger.info("Catching Up %d" % self._partition)
+        loff = mi.offset
+        coff = 0
+        self._catchup_last_offset = loff
+        while True:
+            try:
+                mlist = consumer.get_messages(self._FETCH_COUNT,
+                    timeout=self._FETCH_TIMEOUT)
+                if not mlist:
+                    continue
+                count += len(mlist)
+                if not self.msg_handler(mlist):
+                    self._logger.info("%d could not process %s" % (self._partition, str(mlist)))
+                    # the consumer offsets include mlist, leave them
+                    # uncommitted so that it is read again
+                    self._uncommitted = 0
+                    raise gevent.GreenletExit
+                self._uncommitted += len(mlist)
+                coff = mlist[-1].offset
+                self._catchup_offset = coff
+                self._catchup_count = count
+                self._logger.info("Syncing offset %d" % coff)
+                if coff >= loff:
+                    self._commit(consumer, True)
+                    break
+                self._commit(consumer)
+            except gevent.GreenletExit:
+                raise
+            except Exception as ex:
+                self._logger.info("Sync Error %s" % str(ex))
+                break
+        if coff < loff:
+            self._logger.info("Sync Failed for %d count %d" % (self._partition, count))
+            return False
+        self._logger.info("Sync Completed for %d count %d" % (self._partition, count))
         return True
 
     def _run(self):
 	pcount = 0
         while True:
+            consumer = None
             try:
                 self._logger.info("New KafkaClient %d" % self._partition)
                 kafka = KafkaClient(self._brokers ,str(os.getpid()))
                 try:
-                    consumer = SimpleConsumer(kafka, self._group, self._topic, buffer_size = 4096*4, max_buffer_size=4096*32)
+                    consumer = SimpleConsumer(kafka, self._group, self._topic,
+                        auto_commit = False, buffer_size = 4096*4,
+                        max_buffer_size=4096*32)
                     #except:
                 except Exception as ex:
                     template = "Consumer Failure {0} occured. Arguments:\n{1!r}"
@@ -46,64 +170,46 @@ class PartitionHandler(gevent.Greenlet):
 
                 self._logger.info("Starting %d" % self._partition)
 
-                # Find the offset of the last message that has been queued
-                consumer.seek(0,2)
+                self._catchup_state = "waiting"
+                if self._catchup_sem is not None:
+                    self._catchup_sem.acquire()
                 try:
-                    mi = consumer.get_message(timeout=0.1)
-                except common.OffsetOutOfRangeError:
-                    mi = None
-                #import pdb; pdb.set_trace()
-                self._logger.info("Last Queued for %d is %s" % \
-                                  (self._partition,str(mi)))
-
-                # start reading from last previously processed message
-                consumer.seek(0,1)
-
-                if mi != None:
-                    count = 0
-                    self._logger.info("Catching Up %d" % self._partition)
-                    loff = mi.offset
-                    coff = 0
-                    while True:
-                        try:
-                            mm = consumer.get_message(timeout=None)
-                            count +=1
-                            if not self.msg_handler(mm):
-                                self._logger.info("%d could not process %s" % (self._partition, str(mm)))
-                                raise gevent.GreenletExit
-                            consumer.commit()
-                            coff = mm.offset
-                            self._logger.info("Syncing offset %d" % coff)
-                            if coff == loff:
-                                break
-                        except Exception as ex:
-                            self._logger.info("Sync Error %s" % str(ex))
-                            break
-                    if coff != loff:
-                        self._logger.info("Sync Failed for %d count %d" % (self._partition, count))
-                        continue
-                    else:
-                        self._logger.info("Sync Completed for %d count %d" % (self._partition, count))
-                    
+                    synced = self._catchup(consumer)
+                finally:
+                    if self._catchup_sem is not None:
+                        self._catchup_sem.release()
+                if not synced:
+                    continue
+                self._catchup_state = "running"
+
                 if self._limit:
                     raise gevent.GreenletExit
 
                 while True:
                     try:
-                        mm = consumer.get_message(timeout=None)
-                        if mm is None:
-                            continue
-                        consumer.commit()
-                        pcount += 1
-		        if not self.msg_handler(mm):
-                            self._logger.info("%d could not handle %s" % (self._partition, str(mm)))
-                            raise gevent.GreenletExit
+                        mlist = consumer.get_messages(self._FETCH_COUNT,
+                            timeout=self._FETCH_TIMEOUT)
+                        if mlist:
+                            pcount += len(mlist)
+                            if not self.msg_handler(mlist):
+                                self._logger.info("%d could not handle %s" % (self._partition, str(mlist)))
+                                self._uncommitted = 0
+                                raise gevent.GreenletExit
+                            self._uncommitted += len(mlist)
+                        self._commit(consumer)
                     except TypeError:
                         gevent.sleep(0.1)
                     except common.FailedPayloadsError as ex:
                         self._logger.info("Payload Error: %s" %  str(ex.args))
                         gevent.sleep(0.1)
             except gevent.GreenletExit:
+                # keep the offsets of the messages processed so far
+                if consumer is not None:
+                    try:
+                        self._commit(consumer, True)
+                    except Exception as ex:
+                        self._logger.info("Commit Error %d: %s" % \
+                                          (self._partition, str(ex)))
                 break
             except Exception as ex:
                 template = "An exception of type {0} occured. Arguments:\n{1!r}"
@@ -121,64 +227,85 @@ class UveStreamProc(PartitionHandler):
     #  partition : partition number
     #  uve_topic : topic to subscribe to
     #  logger    : logging object to use  
-    #  uvedb     : initial UVE DB (map of collector info,
-    #                  leading to map of generator info,
-    #                  which leads to set of UVE Keys
-    #  callback  : Callback function for reporting the set of the UVEs
-    #              that may have changed for a given notification
-    def __init__(self, brokers, partition, uve_topic, logger, uvedb, callback):
-        super(UveStreamProc, self).__init__(brokers, partition, "workers", uve_topic, logger, False)
+    #  uvedb_cb  : Function returning the initial UVE DB of a partition
+    #              (map of collector info, leading to map of generator
+    #              info, which leads to set of UVE Keys)
+    #  callback  : Callback function for reporting the UVEs that may
+    #              have changed for a given notification, called with
+    #              the partition and a map of UVE Key to the set of
+    #              changed UVE Types (None if any Type may have changed)
+    #  catchup_sem, snapshot : see PartitionHandler
+    def __init__(self, brokers, partition, uve_topic, logger, uvedb_cb,
+                 callback, catchup_sem=None, snapshot=False):
+        super(UveStreamProc, self).__init__(brokers, partition, "workers",
+            uve_topic, logger, False, catchup_sem, snapshot)
         self._uvedb = {}
-        self._uvedb = uvedb
+        self._uvedb_cb = uvedb_cb
         self._callback = callback
+
+    def _load(self):
+        self._uvedb = self._uvedb_cb(self._partition)
         uves  = set()
         for kcoll,coll in self._uvedb.iteritems():
             for kgen,gen in coll.iteritems():
                 uves.update(set(gen.keys()))
         self._logger.info("Existing UVE keys %s" % str(uves))
-        self._callback(uves)
+        self._callback(self._partition, dict.fromkeys(uves))
 
     def contents(self):
         return self._uvedb
 
-    def msg_handler(self, om):
-        self._partoffset = om.offset
-        chg = set()
+    @staticmethod
+    def _chg_add(chg, key, types):
+        # None (any UVE Type) absorbs all other changes of the key
+        if types is None or (chg.has_key(key) and chg[key] is None):
+            chg[key] = None
+        elif chg.has_key(key):
+            chg[key].update(types)
+        else:
+            chg[key] = set(types)
+
+    def msg_handler(self, mlist):
+        # The changes of all messages of the batch are reported together
+        chg = {}
         try:
-            uv = json.loads(om.message.value)
-            self._partdb[om.message.key] = uv
-            self._logger.debug("%d Reading UVE %s" % (self._partition, str(om)))
-            gen = uv["gen"]
-            coll = uv["coll"]
-
-
-            if (uv["message"] == "UVEUpdate"):
-                if not self._uvedb.has_key(coll):
-                    self._uvedb[coll] = {}
-                if not self._uvedb[coll].has_key(gen):
-                    self._uvedb[coll][gen] = {}
-                if self._uvedb[coll][gen].has_key(uv["key"]):
-                    self._uvedb[coll][gen][uv["key"]] += 1
+            for om in mlist:
+                self._partoffset = om.offset
+                uv = json.loads(om.message.value)
+                self._partdb[om.message.key] = uv
+                self._logger.debug("%d Reading UVE %s" % (self._partition, str(om)))
+                gen = uv["gen"]
+                coll = uv["coll"]
+
+                if (uv["message"] == "UVEUpdate"):
+                    if not self._uvedb.has_key(coll):
+                        self._uvedb[coll] = {}
+                    if not self._uvedb[coll].has_key(gen):
+                        self._uvedb[coll][gen] = {}
+                    if self._uvedb[coll][gen].has_key(uv["key"]):
+                        self._uvedb[coll][gen][uv["key"]] += 1
+                    else:
+                        self._uvedb[coll][gen][uv["key"]] = 1
+                    UveStreamProc._chg_add(chg, uv["key"], [uv["type"]])
                 else:
-                    self._uvedb[coll][gen][uv["key"]] = 1
-                chg.add(uv["key"])
-            else:
-                # when a generator is delelted, we need to 
-                # notify for *ALL* its UVEs
-                if self._uvedb.has_key(coll):
-                    if self._uvedb[coll].has_key(gen):
-                        chg = set(self._uvedb[coll][gen].keys())
-                        del self._uvedb[coll][gen]
+                    # when a generator is delelted, we need to 
+                    # notify for *ALL* its UVEs
+                    if self._uvedb.has_key(coll):
+                        if self._uvedb[coll].has_key(gen):
+                            for key in self._uvedb[coll][gen].keys():
+                                UveStreamProc._chg_add(chg, key, None)
+                            del self._uvedb[coll][gen]
                 
-                # TODO : For the collector's generator, notify all
-                #        UVEs of all generators of the collector
+                    # TODO : For the collector's generator, notify all
+                    #        UVEs of all generators of the collector
         except Exception as ex:
             template = "An exception of type {0} in uve proc . Arguments:\n{1!r}"
             messag = template.format(type(ex).__name__, ex.args)
             self._logger.info("%s" % messag)
             return False
         else:
-            self._callback(chg)
+            if len(chg):
+                self._callback(self._partition, chg)
         return True
            
 if __name__ == '__main__':
@@ -8,6 +8,14 @@ class AlarmBase(object):
     def __init__(self):
         pass
 
+    def uve_types(self):
+        """UVE Types this alarm is evaluated on
+        :returns: list of UVE Type names, or None for all Types.
+            The alarm is re-evaluated for a UVE only when one of
+            these Types of the UVE has changed.
+        """
+        return None
+
     @abc.abstractmethod
     def __call__(self, uve_key, uve_data):
         """Evaluate whether alarm should be raised
@@ -3,6 +3,9 @@ from  opserver.plugins.alarm_base import AlarmBase
 
 class ProcessConnectivity(AlarmBase):
 
+    def uve_types(self):
+        return ["NodeStatus"]
+
     def __call__(self, uve_key, uve_data):
         err_list = []
         if not uve_data.has_key("NodeStatus"):
@@ -0,0 +1,107 @@
+#
+# Copyright (c) 2015 Juniper Networks, Inc. All rights reserved.
+#
+
+#
+# QueryResultCache
+#
+# Results of analytics queries shared by identical queries
+#
+
+import json
+import time
+try:
+    from collections import OrderedDict
+except ImportError:
+    # python 2.6 or earlier, use backport
+    from ordereddict import OrderedDict
+from gevent.event import Event
+
+
+class QueryResultCache(object):
+    '''
+    LRU cache of complete query responses, keyed by the query JSON with
+    absolute start/end times rounded down to ttl buckets. Entries live
+    for ttl seconds and the total size is kept under max_size. A query
+    that matches one still running waits for that one to finish instead
+    of going to the query engine.
+    '''
+
+    def __init__(self, ttl, max_size):
+        self._ttl = ttl
+        self._max_size = max_size
+        # larger responses are streamed to the client but not kept
+        self._max_entry_size = max_size / 4
+        self._size = 0
+        # key -> (expiry time, response)
+        self._cache = OrderedDict()
+        # key -> Event set when the running query completes
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._cache)
+
+    def size(self):
+        return self._size
+
+    def max_entry_size(self):
+        return self._max_entry_size
+
+    def key(self, query):
+        query = dict(query)
+        bucket = max(int(self._ttl * 1000000), 1)
+        for field in ['start_time', 'end_time']:
+            try:
+                tval = int(query[field])
+            except (KeyError, TypeError, ValueError):
+                # missing, or relative to now
+                continue
+            query[field] = tval - tval % bucket
+        return json.dumps(query, sort_keys=True)
+    # end key
+
+    def get(self, key):
+        entry = self._cache.pop(key, None)
+        if entry is None or entry[0] <= time.time():
+            if entry is not None:
+                self._size -= len(entry[1])
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._cache[key] = entry
+        return entry[1]
+    # end get
+
+    def acquire(self, key):
+        '''
+        Returns None if the caller is to run the query, and must then
+        release() the key. Otherwise returns an Event to wait on for the
+        query already running; get() the key again once it is set.
+        '''
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            return inflight
+        self._inflight[key] = Event()
+        return None
+    # end acquire
+
+    def release(self, key, response):
+        if response is not None and len(response) <= self._max_entry_size:
+            old = self._cache.pop(key, None)
+            if old is not None:
+                self._size -= len(old[1])
+            self._cache[key] = (time.time() + self._ttl, response)
+            self._size += len(response)
+            while self._size > self._max_size:
+                _, (_, evicted) = self._cache.popitem(last=False)
+                self._size -= len(evicted)
+                self.evictions += 1
+        inflight = self._inflight.pop(key, None)
+        if inflight is not None:
+            inflight.set()
+    # end release
+
+# end class QueryResultCache
@@ -7,11 +7,22 @@
 #
 
 from sandesh.redis.ttypes import RedisUveInfo, RedisUVERequest, RedisUVEResponse
+from sandesh.uve_introspect.ttypes import UVEParseCacheStats, \
+    UVEParseCacheStatsReq, UVEParseCacheStatsResp
+from sandesh.query_introspect.ttypes import QueryLatencyStats, \
+    QueryLatencyStatsReq, QueryLatencyStatsResp, QueryCacheStats, \
+    QueryCacheStatsReq, QueryCacheStatsResp
 
 class OpserverSandeshReqImpl(object):
     def __init__(self, opserver):
         self._opserver = opserver
         RedisUVERequest.handle_request = self.handle_redis_uve_info_req
+        UVEParseCacheStatsReq.handle_request = \
+            self.handle_uve_parse_cache_stats_req
+        QueryLatencyStatsReq.handle_request = \
+            self.handle_query_latency_stats_req
+        QueryCacheStatsReq.handle_request = \
+            self.handle_query_cache_stats_req
     # end __init__
 
     def handle_redis_uve_info_req(self, req):
@@ -22,4 +33,23 @@ class OpserverSandeshReqImpl(object):
         redis_uve_resp.response(req.context())
     # end handle_redis_uve_info_req
 
+    def handle_uve_parse_cache_stats_req(self, req):
+        uve_server = self._opserver.get_uve_server()
+        stats = UVEParseCacheStats(**uve_server.get_parse_cache_stats())
+        stats_resp = UVEParseCacheStatsResp(stats)
+        stats_resp.response(req.context())
+    # end handle_uve_parse_cache_stats_req
+
+    def handle_query_latency_stats_req(self, req):
+        stats = QueryLatencyStats(**self._opserver.get_query_stats())
+        stats_resp = QueryLatencyStatsResp(stats)
+        stats_resp.response(req.context())
+    # end handle_query_latency_stats_req
+
+    def handle_query_cache_stats_req(self, req):
+        stats = QueryCacheStats(**self._opserver.get_query_cache_stats())
+        stats_resp = QueryCacheStatsResp(stats)
+        stats_resp.response(req.context())
+    # end handle_query_cache_stats_req
+
 # end class OpserverSandeshReqImpl
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+
+#
+# Copyright (c) 2015 Juniper Networks, Inc. All rights reserved.
+#
+
+#
+# analytics_db_purge_test.py
+#
+# Unit Tests for purging old data from the analytics database
+#
+
+import gevent
+import signal
+import json
+import logging
+import unittest
+import mock
+
+from opserver.analytics_db import AnalyticsDb
+from opserver.sandesh.viz.constants import *
+from utils.fake_redis import FakeRedis
+
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s %(levelname)s %(message)s')
+
+_MURMUR3 = 'org.apache.cassandra.dht.Murmur3Partitioner'
+
+
+class FakeColumnFamily(object):
+    # Rows are spread evenly over the Murmur3 token space
+
+    def __init__(self, keys):
+        step = 2**64 / len(keys)
+        self.rows = [(-2**63 + 1 + i * step, key) \
+                     for i, key in enumerate(keys)]
+        self.scans = []
+        self.deleted = []
+        self.batches = []
+
+    def get_range(self, start_token, finish_token, column_count,
+                  filter_empty, buffer_size):
+        # keys only
+        assert column_count == 0
+        assert filter_empty is False
+        self.scans.append((start_token, finish_token))
+        for token, key in self.rows:
+            if int(start_token) < token <= int(finish_token):
+                yield key, {}
+
+    def batch(self):
+        cf = self
+
+        class Batch(object):
+            def __init__(self):
+                self.keys = []
+
+            def remove(self, key):
+                self.keys.append(key)
+
+            def send(self):
+                if self.keys:
+                    cf.batches.append(len(self.keys))
+                    cf.deleted.extend(self.keys)
+                    cf.rows = [row for row in cf.rows \
+                               if row[1] not in self.keys]
+                self.keys = []
+        return Batch()
+
+
+class AnalyticsDbPurgeTest(unittest.TestCase):
+
+    def setUp(self):
+        self._redis = FakeRedis()
+        self._cfs = {
+            'StatsTableByStrTagV3':
+                FakeColumnFamily([(t2, 0, 'tag') for t2 in range(90, 110)]),
+            'MessageTablePid':
+                FakeColumnFamily([(t2, 1) for t2 in range(95, 105)]),
+            'MessageTable':
+                FakeColumnFamily([(t2, 2) for t2 in range(0, 10)]),
+        }
+        self._purge_time = 100 * pow(2, RowTimeInBits)
+        sysm = mock.Mock()
+        sysm.get_keyspace_column_families.return_value = self._cfs.keys()
+        sysm.describe_partitioner.return_value = _MURMUR3
+        patches = [
+            mock.patch('opserver.analytics_db.ConnectionPool'),
+            mock.patch('opserver.analytics_db.pycassa.ColumnFamily',
+                       side_effect=lambda pool, table: self._cfs[table]),
+            mock.patch('opserver.analytics_db.redis.StrictRedis',
+                       return_value=self._redis),
+            mock.patch.object(AnalyticsDb, '_get_sysm', return_value=sysm),
+            mock.patch.object(AnalyticsDb, '_PURGE_BATCH_SIZE', 3),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        pass
+
+    def test_purge_token_ranges(self):
+        adb = AnalyticsDb(logging, [], 6379, None)
+        ranges = adb._purge_token_ranges(_MURMUR3)
+        self.assertEqual(AnalyticsDb._PURGE_TOKEN_RANGES, len(ranges))
+        self.assertEqual(str(-2**63), ranges[0][0])
+        self.assertEqual(str(2**63 - 1), ranges[-1][1])
+        for prev, cur in zip(ranges, ranges[1:]):
+            self.assertEqual(prev[1], cur[0])
+        self.assertEqual([(None, None)], adb._purge_token_ranges(
+            'org.apache.cassandra.dht.ByteOrderedPartitioner'))
+
+    def test_purge_old_data(self):
+        adb = AnalyticsDb(logging, [], 6379, None)
+        self.assertEqual(15, adb.purge_old_data('p1', self._purge_time))
+
+        stats_cf = self._cfs['StatsTableByStrTagV3']
+        self.assertEqual(sorted([(t2, 0, 'tag') for t2 in range(90, 100)]),
+                         sorted(stats_cf.deleted))
+        self.assertTrue(max(stats_cf.batches) <= 3)
+        self.assertEqual(AnalyticsDb._PURGE_TOKEN_RANGES,
+                         len(stats_cf.scans))
+        self.assertEqual(5, len(self._cfs['MessageTablePid'].deleted))
+        self.assertEqual([], self._cfs['MessageTable'].scans)
+
+        status = self._redis.hgetall('ANALYTICS_DB_PURGE')
+        self.assertEqual('15', status['rows_deleted'])
+        progress = json.loads(status['table:StatsTableByStrTagV3'])
+        self.assertEqual({'ranges': AnalyticsDb._PURGE_TOKEN_RANGES,
+                          'ranges_done': AnalyticsDb._PURGE_TOKEN_RANGES,
+                          'rows_deleted': 10}, progress)
+        checkpoint = self._redis.hgetall('ANALYTICS_DB_PURGE_CHECKPOINT')
+        self.assertEqual('p1', checkpoint['purge_id'])
+        self.assertEqual(2 * AnalyticsDb._PURGE_TOKEN_RANGES + 1,
+                         len(checkpoint))
+
+        adb.delete_db_purge_status()
+        self.assertEqual({}, self._redis.db)
+
+    def test_purge_resume(self):
+        adb = AnalyticsDb(logging, [], 6379, None)
+        self.assertEqual(None, adb.get_pending_purge())
+        self._redis.hset('ANALYTICS_DB_PURGE', 'status', 'running')
+        self._redis.hset('ANALYTICS_DB_PURGE', 'purge_id', 'p1')
+        self._redis.hset('ANALYTICS_DB_PURGE', 'purge_input',
+                         self._purge_time)
+        self.assertEqual(('p1', self._purge_time), adb.get_pending_purge())
+
+        # all of MessageTablePid and the first range of the stats table
+        # were purged before the restart
+        self._redis.hset('ANALYTICS_DB_PURGE_CHECKPOINT', 'purge_id', 'p1')
+        for index in range(AnalyticsDb._PURGE_TOKEN_RANGES):
+            self._redis.hset('ANALYTICS_DB_PURGE_CHECKPOINT',
+                             'MessageTablePid:%d' % index, 0)
+        self._redis.hset('ANALYTICS_DB_PURGE_CHECKPOINT',
+                         'MessageTablePid:0', 5)
+        self._redis.hset('ANALYTICS_DB_PURGE_CHECKPOINT',
+                         'StatsTableByStrTagV3:0', 2)
+        stats_cf = self._cfs['StatsTableByStrTagV3']
+        del stats_cf.rows[:2]
+
+        self.assertEqual(15, adb.purge_old_data('p1', self._purge_time))
+        self.assertEqual([], self._cfs['MessageTablePid'].scans)
+        self.assertEqual(AnalyticsDb._PURGE_TOKEN_RANGES - 1,
+                         len(stats_cf.scans))
+        self.assertEqual(8, len(stats_cf.deleted))
+
+        # a checkpoint of another purge is not used
+        self.assertEqual(5, adb.purge_old_data('p2', self._purge_time))
+        self.assertEqual(5, len(self._cfs['MessageTablePid'].deleted))
+        checkpoint = self._redis.hgetall('ANALYTICS_DB_PURGE_CHECKPOINT')
+        self.assertEqual('p2', checkpoint['purge_id'])
+
+    @mock.patch('opserver.analytics_db.time.time', return_value=1000.0)
+    @mock.patch('opserver.analytics_db.gevent.sleep')
+    def test_purge_rate_limit(self, mock_sleep, mock_time):
+        adb = AnalyticsDb(logging, [], 6379, None, purge_rate_limit=5)
+        self.assertEqual(15, adb.purge_old_data('p1', self._purge_time))
+        # rows removed so far divided by the rate, as no time passes
+        waits = sorted(call[0][0] for call in mock_sleep.call_args_list)
+        self.assertEqual(3.0, waits[-1])
+        self.assertTrue(all(wait > 0 for wait in waits))
+
+# end class AnalyticsDbPurgeTest
+
+
+def _term_handler(*_):
+    raise IntSignal()
+
+if __name__ == '__main__':
+    gevent.signal(signal.SIGINT, _term_handler)
+    unittest.main(verbosity=2, catchbreak=True)
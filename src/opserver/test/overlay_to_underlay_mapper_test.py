@@ -625,6 +625,64 @@ class TestOverlayToUnderlayMapper(unittest.TestCase):
                     query['flow_record_data'])
     # end test_get_underlay_flow_data_raise_exception
 
+    @mock.patch.object(OverlayToUnderlayMapper, '_UFLOW_DATA_WHERE_MAX', 2)
+    def test_get_underlay_flow_data_split(self):
+        query = {
+            'table': OVERLAY_TO_UNDERLAY_FLOW_MAP,
+            'start_time':  1416275005000000,
+            'end_time': 1416278605000000,
+            'select_fields': [U_PROUTER, U_PIFINDEX],
+            'sort_fields': [U_PIFINDEX],
+            'sort': 2,
+            'limit': 3
+        }
+        # 5 flows over 4 distinct tunnels
+        flow_record_data = [
+            {'vrouter_ip': '1.1.1.1', 'other_vrouter_ip': '2.2.2.2',
+             'underlay_source_port': 1001, 'underlay_proto': 1},
+            {'vrouter_ip': '1.1.1.1', 'other_vrouter_ip': '2.2.2.2',
+             'underlay_source_port': 1002, 'underlay_proto': 1},
+            {'vrouter_ip': '1.1.1.1', 'other_vrouter_ip': '2.2.2.2',
+             'underlay_source_port': 1001, 'underlay_proto': 1},
+            {'vrouter_ip': '2.2.2.2', 'other_vrouter_ip': '1.1.1.1',
+             'underlay_source_port': 1001, 'underlay_proto': 1},
+            {'vrouter_ip': '2.2.2.2', 'other_vrouter_ip': '1.1.1.1',
+             'underlay_source_port': 1001, 'underlay_proto': 2}
+        ]
+        uflow_data = [
+            [{UFLOW_PROUTER: 'p1', UFLOW_PIFINDEX: 1},
+             {UFLOW_PROUTER: 'p1', UFLOW_PIFINDEX: 3}],
+            [{UFLOW_PROUTER: 'p2', UFLOW_PIFINDEX: 4},
+             {UFLOW_PROUTER: 'p2', UFLOW_PIFINDEX: 2}]
+        ]
+        queries = []
+
+        def query_handler(query):
+            queries.append(json.loads(query))
+            return uflow_data[len(queries) - 1]
+
+        overlay_to_underlay_mapper = OverlayToUnderlayMapper(query,
+            None, None, logging, query_handler)
+        self.assertEqual([
+            {UFLOW_PROUTER: 'p2', UFLOW_PIFINDEX: 4},
+            {UFLOW_PROUTER: 'p1', UFLOW_PIFINDEX: 3},
+            {UFLOW_PROUTER: 'p2', UFLOW_PIFINDEX: 2}],
+            overlay_to_underlay_mapper._get_underlay_flow_data(
+                flow_record_data))
+        self.assertEqual(2, len(queries))
+        tunnels = []
+        for uflow_data_query in queries:
+            self.assertEqual(2, len(uflow_data_query['where']))
+            self.assertEqual(3, uflow_data_query['limit'])
+            for sip, dip, proto in uflow_data_query['where']:
+                tunnels.append((sip['value'], dip['value'],
+                                proto['suffix']['value'], proto['value']))
+        self.assertEqual([('1.1.1.1', '2.2.2.2', 1001, 47),
+                          ('1.1.1.1', '2.2.2.2', 1002, 47),
+                          ('2.2.2.2', '1.1.1.1', 1001, 47),
+                          ('2.2.2.2', '1.1.1.1', 1001, 17)], tunnels)
+    # end test_get_underlay_flow_data_split
+
     @mock.patch('opserver.overlay_to_underlay_mapper.OpServerUtils.post_url_http')
     def test_send_query_no_error(self, mock_post_url_http):
         input_output_list = [
@@ -751,6 +809,21 @@ class TestOverlayToUnderlayMapper(unittest.TestCase):
                 overlay_to_underlay_mapper._send_query, item['query'])
     # end test_send_query_raise_exception
 
+    def test_send_query_handler(self):
+        query = json.dumps({'table': FLOW_TABLE,
+            'start_time': 'now-10m', 'end_time': 'now-5m',
+            'select_fields': ['vrouter_ip'], 'where': [], 'dir': 1})
+        value = [{'vrouter_ip': '1.1.1.1'}]
+        query_handler = mock.Mock(return_value=value)
+        overlay_to_underlay_mapper = \
+            OverlayToUnderlayMapper(None, None, None, logging, query_handler)
+        self.assertEqual(value, overlay_to_underlay_mapper._send_query(query))
+        query_handler.assert_called_with(query)
+        query_handler.return_value = None
+        self.assertRaises(_QueryError,
+            overlay_to_underlay_mapper._send_query, query)
+    # end test_send_query_handler
+
     def test_send_response_no_error(self):
         input_output_list = [
             {
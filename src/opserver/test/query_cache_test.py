@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+
+#
+# Copyright (c) 2015 Juniper Networks, Inc. All rights reserved.
+#
+
+#
+# QueryResultCacheTest
+#
+# Unit Tests for the query result cache in Operational State Server
+#
+
+import gevent
+import signal
+import unittest
+import mock
+
+from opserver.query_cache import QueryResultCache
+from opserver.opserver import OpServer
+
+
+class QueryResultCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self._cache = QueryResultCache(60, 1024)
+
+    def tearDown(self):
+        pass
+
+    def test_key(self):
+        query = {'table': 'MessageTable', 'select_fields': ['Source'],
+                 'start_time': 1423458581000000,
+                 'end_time': 1423458591000000}
+        key = self._cache.key(query)
+        # same time bucket, different key order
+        same = {'end_time': 1423458591000001, 'select_fields': ['Source'],
+                'start_time': str(1423458581000002), 'table': 'MessageTable'}
+        self.assertEqual(key, self._cache.key(same))
+        query['start_time'] = 1423458581000000 - 60 * 1000000
+        self.assertNotEqual(key, self._cache.key(query))
+        # relative times are kept as is
+        rel = {'table': 'MessageTable', 'start_time': 'now-10m',
+               'end_time': 'now'}
+        self.assertTrue('now-10m' in self._cache.key(rel))
+
+    def test_get_release(self):
+        self.assertEqual(None, self._cache.acquire('q1'))
+        self.assertEqual(None, self._cache.get('q1'))
+        self._cache.release('q1', u'{"value": []}')
+        self.assertEqual(u'{"value": []}', self._cache.get('q1'))
+        self.assertEqual(1, self._cache.hits)
+        self.assertEqual(1, self._cache.misses)
+
+        # failed or too large responses are not kept
+        self.assertEqual(None, self._cache.acquire('q2'))
+        self._cache.release('q2', None)
+        self.assertEqual(None, self._cache.get('q2'))
+        self.assertEqual(None, self._cache.acquire('q3'))
+        self._cache.release('q3', u'x' * 257)
+        self.assertEqual(None, self._cache.get('q3'))
+        self.assertEqual(1, len(self._cache))
+
+    @mock.patch('opserver.query_cache.time')
+    def test_expiry(self, mock_time):
+        mock_time.time.return_value = 1000
+        self._cache.acquire('q1')
+        self._cache.release('q1', u'abc')
+        mock_time.time.return_value = 1059
+        self.assertEqual(u'abc', self._cache.get('q1'))
+        mock_time.time.return_value = 1060
+        self.assertEqual(None, self._cache.get('q1'))
+        self.assertEqual(0, len(self._cache))
+        self.assertEqual(0, self._cache.size())
+
+    def test_eviction(self):
+        for i in range(5):
+            self._cache.acquire('q%d' % i)
+            self._cache.release('q%d' % i, u'x' * 250)
+            if i == 2:
+                # q0 is now the most recently used
+                self.assertTrue(self._cache.get('q0') is not None)
+        self.assertEqual(4, len(self._cache))
+        self.assertEqual(1000, self._cache.size())
+        self.assertEqual(1, self._cache.evictions)
+        self.assertEqual(None, self._cache.get('q1'))
+        self.assertTrue(self._cache.get('q0') is not None)
+
+    def test_inflight(self):
+        self.assertEqual(None, self._cache.acquire('q1'))
+        results = []
+
+        def waiter():
+            inflight = self._cache.acquire('q1')
+            self.assertTrue(inflight is not None)
+            inflight.wait()
+            results.append(self._cache.get('q1'))
+
+        gevs = [gevent.spawn(waiter) for i in range(3)]
+        gevent.sleep(0)
+        self.assertEqual([], results)
+        self._cache.release('q1', u'{"value": []}')
+        gevent.joinall(gevs)
+        self.assertEqual([u'{"value": []}'] * 3, results)
+        # the next query for the key runs again
+        self.assertEqual(None, self._cache.acquire('q1'))
+
+# end class QueryResultCacheTest
+
+
+class CachedQueryTest(unittest.TestCase):
+
+    def setUp(self):
+        # skip OpServer.__new__, which adds the REST API routes
+        self._opserver = object.__new__(OpServer)
+        self._opserver._logger = mock.MagicMock()
+        self._opserver._query_cache = QueryResultCache(60, 1024)
+        self._opserver._query = mock.MagicMock(
+            side_effect=lambda request: iter([u'{"value": []}']))
+
+    @mock.patch('opserver.opserver.bottle')
+    def test_cached_query(self, mock_bottle):
+        request = mock.MagicMock(json={'table': 'MessageTable'})
+        for i in range(2):
+            self.assertEqual([u'{"value": []}'],
+                             list(self._opserver._cached_query(request)))
+        self.assertEqual(1, self._opserver._query.call_count)
+        self.assertEqual(1, self._opserver._query_cache.hits)
+
+    def test_cached_query_invalid(self):
+        # left to _query to reply with an error, and not cached
+        invalid = [mock.MagicMock(json=None),
+                   mock.MagicMock(json=['MessageTable'])]
+        bad_json = mock.MagicMock()
+        type(bad_json).json = mock.PropertyMock(side_effect=ValueError)
+        for request in invalid + [bad_json]:
+            self.assertEqual([u'{"value": []}'],
+                             list(self._opserver._cached_query(request)))
+            self._opserver._query.assert_called_with(request)
+        self.assertEqual(3, self._opserver._query.call_count)
+        self.assertEqual(0, len(self._opserver._query_cache))
+        self.assertEqual(0, self._opserver._query_cache.misses)
+
+# end class CachedQueryTest
+
+
+def _term_handler(*_):
+    raise IntSignal()
+
+if __name__ == '__main__':
+    gevent.signal(signal.SIGINT, _term_handler)
+    unittest.main(verbosity=2, catchbreak=True)
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+
+#
+# Copyright (c) 2015 Juniper Networks, Inc. All rights reserved.
+#
+
+#
+# QueryWaitTest
+#
+# Unit Tests for the wait on query engine replies in sync queries
+#
+
+import gevent
+import signal
+import json
+import errno
+import unittest
+import mock
+
+from opserver.opserver import OpServer, QueryStats, redis_query_start, \
+    _QUERY_EXPIRY
+from utils.fake_redis import FakeRedis
+
+
+class QueryEngineRedis(FakeRedis):
+    # Pushes the reply of the query engine on each blpop
+
+    def __init__(self):
+        super(QueryEngineRedis, self).__init__()
+        self.replies = []
+
+    def _blpop(self, key, timeout):
+        if self.replies:
+            reply = self.replies.pop(0)
+            if reply is None:
+                return None
+            self._rpush(key, json.dumps(reply))
+        return super(QueryEngineRedis, self)._blpop(key, timeout)
+# end class QueryEngineRedis
+
+
+class QueryWaitTest(unittest.TestCase):
+
+    def setUp(self):
+        self._redis = QueryEngineRedis()
+        self._redis_patch = mock.patch('opserver.opserver.redis.StrictRedis',
+                                       return_value=self._redis)
+        self._strict_redis = self._redis_patch.start()
+        # skip OpServer.__new__, which adds the REST API routes
+        self._opserver = object.__new__(OpServer)
+        self._opserver._logger = mock.MagicMock()
+        self._opserver._args = mock.MagicMock(redis_query_port=6380,
+                                              redis_password=None)
+        self._opserver._redis_query_pool = mock.MagicMock()
+        self._opserver._query_stats = QueryStats()
+
+    def tearDown(self):
+        self._redis_patch.stop()
+
+    def test_query_start(self):
+        self._redis.replies = [{'progress': 10}]
+        self.assertEqual(10, redis_query_start(self._redis, 'q1',
+                                               {'table': 'MessageTable'}))
+        self.assertEqual('"MessageTable"',
+                         self._redis.db['QUERY:q1']['table'])
+        self.assertEqual(['q1'], self._redis.db['QUERYQ'])
+        # the status is put back for the status URI
+        self.assertEqual([{'progress': 10}],
+                         map(json.loads, self._redis.db['REPLY:q1']))
+
+        self._redis.replies = [None]
+        self.assertEqual(None, redis_query_start(self._redis, 'q2', {}))
+
+    @mock.patch('opserver.opserver.redis_query_result_iter')
+    def test_query_rows(self, mock_result):
+        self._opserver._args.host_ip = '127.0.0.1'
+        mock_result.return_value = iter([{'vrouter': 'a1s1'}])
+        self._redis.replies = [{'progress': 50}, {'progress': 100}]
+        self.assertEqual([{'vrouter': 'a1s1'}], self._opserver._query_rows(
+            json.dumps({'table': 'FlowRecordTable'})))
+        # the query is started on a connection from the query pool
+        self._strict_redis.assert_called_with(
+            connection_pool=self._opserver._redis_query_pool)
+        (qid,) = self._redis.db['QUERYQ']
+        self.assertEqual([{'progress': 100}],
+                         map(json.loads, self._redis.db['REPLY:' + qid]))
+
+    def test_query_wait_final(self):
+        self._redis.hset('QUERY:q1', 'table', '"MessageTable"')
+        self._redis.replies = [{'progress': 10}, {'progress': 10},
+                               {'progress': 50}, None, {'progress': 100}]
+        self.assertEqual(100, self._opserver._query_wait('q1'))
+        self.assertEqual([], self._redis.replies)
+        # only the final status is left, with the query engine's expiry
+        self.assertEqual([{'progress': 100}],
+                         map(json.loads, self._redis.db['REPLY:q1']))
+        self.assertEqual(_QUERY_EXPIRY, self._redis.expiry['REPLY:q1'])
+
+    def test_query_wait_error(self):
+        self._redis.replies = [{'progress': 10}, {'progress': -errno.ENOENT}]
+        self.assertEqual(-errno.ENOENT, self._opserver._query_wait('q1'))
+        self.assertEqual([{'progress': -errno.ENOENT}],
+                         map(json.loads, self._redis.db['REPLY:q1']))
+
+    def test_query_wait_dropped(self):
+        # the query engine has dropped QUERY:<qid> and no reply comes
+        self._redis.replies = [{'progress': 10}, None]
+        self.assertEqual(-errno.EIO, self._opserver._query_wait('q1'))
+        self.assertEqual([{'progress': -errno.EIO}],
+                         map(json.loads, self._redis.db['REPLY:q1']))
+        self.assertEqual(_QUERY_EXPIRY, self._redis.expiry['REPLY:q1'])
+
+    def test_query_stats(self):
+        stats = QueryStats()
+        self.assertEqual({'queries': 0, 'errors': 0,
+                          'enqueue_time_avg': 0, 'enqueue_time_max': 0,
+                          'exec_time_avg': 0, 'exec_time_max': 0,
+                          'result_time_avg': 0, 'result_time_max': 0},
+                         stats.get())
+        stats.update(1000, 20000, 3000)
+        stats.update(3000, 40000, 1000)
+        stats.error()
+        self.assertEqual({'queries': 2, 'errors': 1,
+                          'enqueue_time_avg': 2, 'enqueue_time_max': 3,
+                          'exec_time_avg': 30, 'exec_time_max': 40,
+                          'result_time_avg': 2, 'result_time_max': 3},
+                         stats.get())
+
+    @mock.patch('opserver.opserver.bottle')
+    @mock.patch('opserver.opserver.redis_query_result')
+    @mock.patch('opserver.opserver.UTCTimestampUsec')
+    def test_sync_query_stats(self, mock_time, mock_result, mock_bottle):
+        # enqueued at 1000, accepted, done and streamed (usec)
+        mock_time.side_effect = [3000, 53000, 60000]
+        mock_result.return_value = iter(['{"value": [', ']}'])
+        self._redis.replies = [{'progress': 100}]
+        self.assertEqual(['{"value": [', ']}'],
+            list(self._opserver._sync_query(mock.MagicMock(), 'q1', 1000)))
+        stats = self._opserver._query_stats.get()
+        self.assertEqual((1, 0), (stats['queries'], stats['errors']))
+        self.assertEqual((2, 50, 7), (stats['enqueue_time_avg'],
+                                      stats['exec_time_avg'],
+                                      stats['result_time_avg']))
+
+        mock_time.side_effect = [3000, 4000]
+        self._redis.replies = [None]
+        reply = list(self._opserver._sync_query(mock.MagicMock(), 'q2', 1000))
+        mock_bottle.HTTPError.assert_called_with(500, 'EIO')
+        self.assertEqual(1, len(reply))
+        stats = self._opserver._query_stats.get()
+        self.assertEqual((1, 1), (stats['queries'], stats['errors']))
+
+# end class QueryWaitTest
+
+
+def _term_handler(*_):
+    raise IntSignal()
+
+if __name__ == '__main__':
+    gevent.signal(signal.SIGINT, _term_handler)
+    unittest.main(verbosity=2, catchbreak=True)
@@ -0,0 +1,82 @@
+#
+# Copyright (c) 2015 Juniper Networks, Inc. All rights reserved.
+#
+
+#
+# fake_redis.py
+#
+# In-memory stand-in for redis.StrictRedis, for the unit tests
+#
+
+
+class FakeRedis(object):
+    # The subset of redis.StrictRedis used by the opserver, with the keys
+    # in db (hashes as dicts, lists and sets). Pipelines execute their
+    # queued commands in order. Counts round-trips, a pipeline being one.
+
+    class Pipeline(object):
+        def __init__(self, redish):
+            self._redish = redish
+            self._cmds = []
+
+        def __getattr__(self, name):
+            def queue(*args, **kwargs):
+                self._cmds.append((name, args, kwargs))
+            return queue
+
+        def execute(self):
+            self._redish.round_trips += 1
+            return [getattr(self._redish, '_' + name)(*args, **kwargs)
+                    for name, args, kwargs in self._cmds]
+
+    def __init__(self):
+        self.db = {}
+        self.expiry = {}
+        self.round_trips = 0
+
+    def pipeline(self, transaction=True):
+        return FakeRedis.Pipeline(self)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        method = getattr(self, '_' + name)
+        def call(*args, **kwargs):
+            self.round_trips += 1
+            return method(*args, **kwargs)
+        return call
+
+    def _exists(self, key):
+        return key in self.db
+
+    def _delete(self, *keys):
+        for key in keys:
+            self.db.pop(key, None)
+
+    def _expire(self, key, ttl):
+        self.expiry[key] = ttl
+
+    def _smembers(self, key):
+        return set(self.db.get(key, set()))
+
+    def _hset(self, key, field, value):
+        self.db.setdefault(key, {})[field] = str(value)
+
+    def _hgetall(self, key):
+        return dict(self.db.get(key, {}))
+
+    def _hmget(self, key, fields):
+        return [self.db.get(key, {}).get(field) for field in fields]
+
+    def _lpush(self, key, value):
+        self.db.setdefault(key, []).insert(0, value)
+
+    def _rpush(self, key, value):
+        self.db.setdefault(key, []).append(value)
+
+    def _blpop(self, key, timeout):
+        # does not block, None as if timed out on an empty list
+        if not self.db.get(key):
+            return None
+        return (key, self.db[key].pop(0))
+# end class FakeRedis
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+#
+# Copyright (c) 2015 Juniper Networks, Inc. All rights reserved.
+#
+
+#
+# UVEServerPerfTest
+#
+# Micro-benchmark of UVE aggregation with large append and union lists
+# reported by many generators. Not part of the default test suite, run
+# it manually:
+#     python uveserver_perftest.py
+#
+
+import copy
+import sys
+import time
+import unittest
+
+from opserver.uveserver import ParallelAggregator
+from uveserver_test import MakeBasic, MakeList
+
+
+class UVEServerPerfTest(unittest.TestCase):
+
+    _KEY = "abc-corp:vn-00"
+    _GENERATORS = 50
+    _LIST_SIZE = 200
+    _ROUNDS = 10
+
+    def setUp(self):
+        # Each generator reports stats for an overlapping window of
+        # other VNs, so that append lists have listkeys to consolidate
+        # and union lists have duplicates to drop
+        self._state = {self._KEY: {'UVEVirtualNetwork': {
+            'connected_networks': {}, 'in_stats': {}}}}
+        uve = self._state[self._KEY]['UVEVirtualNetwork']
+        for gen in range(self._GENERATORS):
+            source = "10.10.%d.%d" % (gen / 256, gen % 256)
+            vns = ["vn-%d" % (gen * 10 + idx)
+                   for idx in range(self._LIST_SIZE)]
+            uve['connected_networks'][source] = self._make_list(
+                "string", "element", vns, "union")
+            uve['in_stats'][source] = self._make_list(
+                "struct", "VnStats",
+                [{'other_vn': MakeBasic("string", vn, "listkey"),
+                  'bytes': MakeBasic("i64", gen + 1)} for vn in vns],
+                "append")
+
+    @staticmethod
+    def _make_list(typ, valname, vals, aggtype):
+        result = MakeList(typ, valname, vals, aggtype)
+        result['list']['@size'] = str(len(vals))
+        return result
+
+    def _run(self, flat):
+        start = time.time()
+        for _ in range(self._ROUNDS):
+            res = ParallelAggregator(self._state).aggregate(self._KEY, flat)
+        return res, (time.time() - start) / self._ROUNDS
+
+    def test_aggregate(self):
+        state = copy.deepcopy(self._state)
+        nvns = (self._GENERATORS - 1) * 10 + self._LIST_SIZE
+        for flat in [False, True]:
+            res, elapsed = self._run(flat)
+            sys.stderr.write("\naggregate flat=%s %d generators, "
+                             "%d list elements: %.2f ms\n" %
+                             (flat, self._GENERATORS, self._LIST_SIZE,
+                              elapsed * 1000))
+            self.assertEqual(state, self._state)
+        self.assertEqual(len(res['UVEVirtualNetwork']['connected_networks']),
+                         nvns)
+        self.assertEqual(len(res['UVEVirtualNetwork']['in_stats']), nvns)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -16,16 +16,32 @@ import copy
 import unittest
 import pdb
 import json
+import logging
+import mock
 
 curfile = sys.path[0]
 from opserver.uveserver import UVEServer
 from opserver.uveserver import ParallelAggregator
+from utils.fake_redis import FakeRedis
 
 
 class RedisMock(object):
     pass
 
 
+class UVERedis(FakeRedis):
+    # FakeRedis with the UVEs written by the collector
+
+    def uve_update(self, key, sm, typ, attr, val):
+        # what uveupdate.lua writes for an attribute of a UVE
+        table = key.split(':', 1)[0]
+        self.db.setdefault('ORIGINS:' + key, set()).add(sm + ':' + typ)
+        self.db.setdefault('TABLE:' + table, set()).add(
+            key + ':' + sm + ':' + typ)
+        self.db.setdefault('VALUES:' + key + ':' + sm + ':' + typ,
+                           {})[attr] = val
+
+
 def MakeBasic(typ, val, aggtype=None):
     item = {}
     item['@type'] = typ
@@ -365,6 +381,141 @@ class UVEServerTest(unittest.TestCase):
             "UVEVirtualNetwork"]["in_stats"]["sample"]
         self.assertEqual(in_stats, res['UVEVirtualNetwork']['in_stats'])
 
+    def test_agg_state_unchanged(self):
+        print "*** Running test_agg_state_unchanged ***"
+
+        uvevn = MakeUVEVirtualNetwork(
+            None, "abc-corp:vn-00", "10.10.10.10",
+            attached_policies=[("100", "allow-some")],
+            connected_networks=["vn-01", "vn-02"],
+            total_virtual_machines=4,
+            in_stats=[("vn-01", "1000"), ("vn-02", "1800")],
+        )
+        uvevn2 = MakeUVEVirtualNetwork(
+            uvevn, "abc-corp:vn-00", "10.10.10.11",
+            attached_policies=[("100", "allow-some")],
+            connected_networks=["vn-02"],
+            total_virtual_machines=7,
+            in_stats=[("vn-02", "1200")],
+        )
+        # lists of size 1 are left as parsed by xmltodict
+        uvevn2["abc-corp:vn-00"]['UVEVirtualNetwork']['connected_networks'][
+            "10.10.10.11"]['list']['element'] = "vn-02"
+        state = copy.deepcopy(uvevn2)
+
+        for flat in [False, True]:
+            pa = ParallelAggregator(uvevn2)
+            res = pa.aggregate("abc-corp:vn-00", flat)
+            self.assertEqual(state, uvevn2)
+
+        self.assertEqual(res['UVEVirtualNetwork']['total_virtual_machines'],
+                         11)
+        self.assertEqual(
+            sorted(res['UVEVirtualNetwork']['connected_networks']),
+            ["vn-01", "vn-02"])
+        self.assertEqual(
+            sorted(res['UVEVirtualNetwork']['in_stats']),
+            [{'bytes': 1000, 'other_vn': 'vn-01'},
+             {'bytes': 3000, 'other_vn': 'vn-02'}])
+
+
+class UVEServerRedisTest(unittest.TestCase):
+
+    def setUp(self):
+        self._oss = UVEServer(None, logging.getLogger(__name__))
+        self._redis = UVERedis()
+        self._oss._redis_uve_list = [('127.0.0.1', 6381)]
+        self._oss._redis_uve_clients = {('127.0.0.1', 6381): self._redis}
+        for idx in range(250):
+            key = 'ObjectVMTable:vm-%d' % (idx)
+            for vrouter in range(2):
+                sm = 'vrouter-%d:Compute:contrail-vrouter-agent:0' % (vrouter)
+                self._redis.uve_update(key, sm, 'UveVirtualMachineAgent',
+                    'vrouter', '<vrouter type="string">vrouter-%d'
+                    '</vrouter>' % (vrouter))
+                self._redis.uve_update(key, sm, 'UveVirtualMachineAgent',
+                    'interface_count', '<interface_count type="i32" '
+                    'aggtype="sum">%d</interface_count>' % (idx))
+
+    def tearDown(self):
+        del self._oss
+
+    def test_multi_uve_get(self):
+        self._redis.round_trips = 0
+        uves = list(self._oss.multi_uve_get('ObjectVMTable:*', True, None,
+                                            None, None, None))
+        self.assertEqual(len(uves), 250)
+        # the table scan plus one pipeline per chunk of UVEs
+        self.assertEqual(self._redis.round_trips, 1 + 3)
+        for uve in uves:
+            self.assertEqual(uve['value'], self._oss.get_uve(
+                'ObjectVMTable:' + uve['name'], True))
+        self.assertEqual(uves[0]['value']['UveVirtualMachineAgent'][
+            'interface_count'], 2 * int(uves[0]['name'][3:]))
+
+    def test_multi_uve_get_filters(self):
+        uves = list(self._oss.multi_uve_get('ObjectVMTable:*', True,
+                                            ['vm-1*'], 'vrouter-1', None,
+                                            {'UveVirtualMachineAgent':
+                                             set(['vrouter'])}))
+        self.assertEqual(len(uves), 111)
+        for uve in uves:
+            self.assertEqual(uve['value'], {'UveVirtualMachineAgent':
+                                            {'vrouter': 'vrouter-1'}})
+
+    def test_get_uve_round_trips(self):
+        self._redis.round_trips = 0
+        self._oss.get_uve('ObjectVMTable:vm-7', True)
+        self.assertEqual(self._redis.round_trips, 2)
+
+    def test_get_uve_query_stats(self):
+        # as alarmgen reads a UVE with a stat of the query type
+        key = 'ObjectVMTable:vm-7'
+        sm = 'vrouter-0:Compute:contrail-vrouter-agent:0'
+        self._redis.uve_update(key, sm, 'VirtualMachineStats', 'if_stats',
+            json.dumps([{'rtype': 'query', 'aggtype': 'StatTable.VMStats',
+                         'select': ['T', 'SUM(if_stats.in_pkts)']}]))
+        with mock.patch.object(self._oss, '_uve_stats_query') as squery:
+            uve = self._oss.get_uve(key, True, multi=True)
+            self.assertEqual(uve['UveVirtualMachineAgent']['interface_count'],
+                             14)
+            self.assertEqual(uve['VirtualMachineStats'], {'if_stats': []})
+            uve = self._oss.get_uve(key, True, multi=True,
+                tfilter={'VirtualMachineStats': set()})
+            self.assertEqual(uve, {'VirtualMachineStats': {'if_stats': []}})
+            self.assertFalse(squery.called)
+        # without multi the stats query needs the analytics api
+        self.assertEqual(self._oss.get_uve(key, True), {})
+
+    def test_parse_cache(self):
+        key = 'ObjectVMTable:vm-7'
+        sm = 'vrouter-0:Compute:contrail-vrouter-agent:0'
+        first = self._oss.get_uve(key, True)
+        stats = self._oss.get_parse_cache_stats()
+        self.assertEqual((stats['hits'], stats['misses']), (0, 4))
+        self.assertEqual(self._oss.get_uve(key, True), first)
+        stats = self._oss.get_parse_cache_stats()
+        self.assertEqual((stats['hits'], stats['misses']), (4, 4))
+        # a changed attribute is parsed again
+        self._redis.uve_update(key, sm, 'UveVirtualMachineAgent',
+            'interface_count', '<interface_count type="i32" '
+            'aggtype="sum">100</interface_count>')
+        uve = self._oss.get_uve(key, True)
+        self.assertEqual(uve['UveVirtualMachineAgent']['interface_count'],
+                         107)
+        stats = self._oss.get_parse_cache_stats()
+        self.assertEqual((stats['hits'], stats['misses']), (7, 5))
+
+    def test_parse_cache_eviction(self):
+        oss = UVEServer(None, logging.getLogger(__name__),
+                        uve_parse_cache_size=2)
+        oss._redis_uve_list = self._oss._redis_uve_list
+        oss._redis_uve_clients = self._oss._redis_uve_clients
+        oss.get_uve('ObjectVMTable:vm-7', True)
+        stats = oss.get_parse_cache_stats()
+        self.assertEqual(stats['entries'], 2)
+        self.assertEqual(stats['evictions'], 2)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -10,22 +10,82 @@
 
 import gevent
 import json
-import copy
 import xmltodict
 import redis
 import datetime
 import sys
 from opserver_util import OpServerUtils
 import re
+from collections import OrderedDict
 from gevent.coros import BoundedSemaphore
 from pysandesh.util import UTCTimestampUsec
 from pysandesh.connection_info import ConnectionState
 
+class UVEParseCache(object):
+    '''
+    LRU cache of parsed Sandesh XML UVE attributes, keyed by (redis-uve
+    instance, VALUES key, attribute). An entry is valid while the stored
+    XML has the same length and hash as when it was parsed.
+    The parsed dicts are shared across queries and must not be modified.
+    '''
+
+    def __init__(self, max_entries):
+        self._max_entries = max_entries
+        self._cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._cache)
+
+    def max_entries(self):
+        return self._max_entries
+
+    def parse(self, ckey, attr, value):
+        token = (len(value), hash(value))
+        entry = self._cache.pop(ckey, None)
+        if entry is not None and entry[0] == token:
+            self.hits += 1
+            self._cache[ckey] = entry
+            return entry[1]
+
+        self.misses += 1
+        snhdict = xmltodict.parse(value)
+        if snhdict[attr]['@type'] == 'list':
+            # lists of size 1 are normalized once, here
+            if snhdict[attr]['list']['@size'] == '1':
+                sname = ParallelAggregator.get_list_name(snhdict[attr])
+                if not isinstance(snhdict[attr]['list'][sname], list):
+                    snhdict[attr]['list'][sname] = [
+                        snhdict[attr]['list'][sname]]
+        if self._max_entries > 0:
+            self._cache[ckey] = (token, snhdict)
+            if len(self._cache) > self._max_entries:
+                self._cache.popitem(last=False)
+                self.evictions += 1
+        return snhdict
+    # end parse
+
+# end UVEParseCache
+
+
 class UVEServer(object):
+    # UVEs fetched and aggregated together by multi_uve_get
+    _MULTI_UVE_CHUNK = 100
+    # parsed UVE attributes kept by the parse cache
+    _UVE_PARSE_CACHE_SIZE = 10000
 
-    def __init__(self, redis_uve_server, logger, redis_password=None):
+    def __init__(self, redis_uve_server, logger, redis_password=None,
+                 uve_parse_cache_size=None):
         self._local_redis_uve = redis_uve_server
         self._redis_uve_list = []
+        # (ip, port) -> client of the redis-uve instance, each client
+        # keeps its own connection pool across requests
+        self._redis_uve_clients = {}
+        if uve_parse_cache_size is None:
+            uve_parse_cache_size = self._UVE_PARSE_CACHE_SIZE
+        self._parse_cache = UVEParseCache(uve_parse_cache_size)
         self._logger = logger
         self._sem = BoundedSemaphore(1)
         self._redis = None
@@ -38,9 +98,30 @@ class UVEServer(object):
     #end __init__
 
     def update_redis_uve_list(self, redis_uve_list):
+        clients = {}
+        for redis_uve in redis_uve_list:
+            redis_inst = (redis_uve[0], redis_uve[1])
+            redish = self._redis_uve_clients.get(redis_inst)
+            if redish is None:
+                redish = redis.StrictRedis(host=redis_uve[0],
+                                           port=redis_uve[1],
+                                           password=self._redis_password,
+                                           db=1)
+            clients[redis_inst] = redish
+        self._redis_uve_clients = clients
         self._redis_uve_list = redis_uve_list
     # end update_redis_uve_list
 
+    def _redis_uve_client(self, redis_uve):
+        redis_inst = (redis_uve[0], redis_uve[1])
+        redish = self._redis_uve_clients.get(redis_inst)
+        if redish is None:
+            redish = redis.StrictRedis(host=redis_uve[0], port=redis_uve[1],
+                                       password=self._redis_password, db=1)
+            self._redis_uve_clients[redis_inst] = redish
+        return redish
+    # end _redis_uve_client
+
     def fill_redis_uve_info(self, redis_uve_info):
         redis_uve_info.ip = self._local_redis_uve[0]
         redis_uve_info.port = self._local_redis_uve[1]
@@ -55,29 +136,33 @@ class UVEServer(object):
     @staticmethod
     def merge_previous(state, key, typ, attr, prevdict):
         print "%s New    val is %s" % (attr, prevdict)
-        nstate = copy.deepcopy(state)
+        # The merged value is built from shallow copies, neither state
+        # nor prevdict is modified
+        previous = state[key][typ][attr]['previous']
         if UVEServer._is_agg_item(prevdict):
-            count = int(state[key][typ][attr]['previous']['#text'])
+            count = int(previous['#text'])
             count += int(prevdict['#text'])
-            nstate[key][typ][attr]['previous']['#text'] = str(count)
+            previous = dict(previous)
+            previous['#text'] = str(count)
 
         if UVEServer._is_agg_list(prevdict):
-            sname = ParallelAggregator.get_list_name(
-                state[key][typ][attr]['previous'])
-            count = len(prevdict['list'][sname]) + \
-                len(state[key][typ][attr]['previous']['list'][sname])
-            nstate[key][typ][attr]['previous']['list'][sname].extend(
-                prevdict['list'][sname])
-            nstate[key][typ][attr]['previous']['list']['@size'] = \
-                str(count)
+            sname = ParallelAggregator.get_list_name(previous)
+            previous = dict(previous)
+            previous['list'] = dict(previous['list'])
+            previous['list'][sname] = previous['list'][sname] + \
+                prevdict['list'][sname]
+            previous['list']['@size'] = str(len(previous['list'][sname]))
 
             tstate = {}
             tstate[typ] = {}
-            tstate[typ][attr] = copy.deepcopy(
-                nstate[key][typ][attr]['previous'])
-            nstate[key][typ][attr]['previous'] =\
-                ParallelAggregator.consolidate_list(tstate, typ, attr)
-
+            tstate[typ][attr] = previous
+            previous = ParallelAggregator.consolidate_list(tstate, typ, attr)
+
+        nstate = dict(state)
+        nstate[key] = dict(state[key])
+        nstate[key][typ] = dict(state[key][typ])
+        nstate[key][typ][attr] = dict(state[key][typ][attr])
+        nstate[key][typ][attr]['previous'] = previous
         print "%s Merged val is %s"\
             % (attr, nstate[key][typ][attr]['previous'])
         return nstate
@@ -208,8 +293,7 @@ class UVEServer(object):
         uves = {}
         for redis_uve in self._redis_uve_list:
             gen_uves = {}
-            redish = redis.StrictRedis(host=redis_uve[0],
-                                       port=redis_uve[1], db=1)
+            redish = self._redis_uve_client(redis_uve)
             for elems in redish.smembers("PART2KEY:" + str(part)): 
                 info = elems.split(":", 5)
                 gen = info[0] + ":" + info[1] + ":" + info[2] + ":" + info[3]
@@ -220,147 +304,225 @@ class UVEServer(object):
             uves[redis_uve[0] + ":" + str(redis_uve[1])] = gen_uves
         return uves
         
+    @staticmethod
+    def _parse_origin(origs, sfilter, mfilter, tfilter):
+        # origs is <source>:<node-type>:<module>:<instance-id>:<type>,
+        # returns (origs, source, module, type) or None if filtered out
+        info = origs.rsplit(":", 1)
+        sm = info[0].split(":", 1)
+        source = sm[0]
+        if sfilter is not None:
+            if sfilter != source:
+                return None
+        mdule = sm[1]
+        if mfilter is not None:
+            if mfilter != mdule:
+                return None
+        typ = info[1]
+        if tfilter is not None:
+            if typ not in tfilter:
+                return None
+        return (origs, source, mdule, typ)
+    # end _parse_origin
+
+    def get_parse_cache_stats(self):
+        return {'entries': len(self._parse_cache),
+                'max_entries': self._parse_cache.max_entries(),
+                'hits': self._parse_cache.hits,
+                'misses': self._parse_cache.misses,
+                'evictions': self._parse_cache.evictions}
+    # end get_parse_cache_stats
+
+    def _uve_values_add(self, redis_inst, state, statdict, key, ovalues,
+                        flat, sfilter, mfilter, tfilter, multi, qmap,
+                        sfetch):
+        # Load the VALUES hashes of the origins of a key into state and
+        # statdict. Stats kept in other redis keys are left in sfetch as
+        # (list to append to, stats element) in order of appearance.
+        for (origs, source, mdule, typ), odict in ovalues:
+            dsource = source + ":" + mdule
+            vkey = "VALUES:" + key + ":" + origs
+            afilter_list = set()
+            if tfilter is not None:
+                afilter_list = tfilter[typ]
+            for attr, value in odict.iteritems():
+                if len(afilter_list):
+                    if attr not in afilter_list:
+                        continue
+
+                if typ not in state[key]:
+                    state[key][typ] = {}
+
+                if value[0] == '<':
+                    snhdict = self._parse_cache.parse(
+                        (redis_inst, vkey, attr), attr, value)
+                    if snhdict[attr]['@type'] == 'list':
+                        if snhdict[attr]['list']['@size'] == '0':
+                            continue
+                else:
+                    if not flat:
+                        continue
+                    if typ not in statdict:
+                        statdict[typ] = {}
+                    statdict[typ][attr] = []
+                    statsattr = json.loads(value)
+                    for elem in statsattr:
+                        if elem["rtype"] == "query":
+                            if sfilter is None and mfilter is None and not multi:
+                                qdict = {}
+                                qdict["table"] = elem["aggtype"]
+                                qdict["select_fields"] = elem["select"]
+                                qdict["where"] =[[{"name":"name",
+                                    "value":key.split(":",1)[1],
+                                    "op":1}]]
+                                qmap[elem["aggtype"]] = {"query":qdict,
+                                    "type":typ, "attr":attr}
+                            # For the stats query case, defer processing
+                            continue
+                        sfetch.append((statdict[typ][attr], elem))
+                    continue
+
+                # print "Attr %s Value %s" % (attr, snhdict)
+                if attr not in state[key][typ]:
+                    state[key][typ][attr] = {}
+                if dsource in state[key][typ][attr]:
+                    print "Found Dup %s:%s:%s:%s:%s = %s" % \
+                        (key, typ, attr, source, mdule, state[
+                        key][typ][attr][dsource])
+                state[key][typ][attr][dsource] = snhdict[attr]
+    # end _uve_values_add
+
+    @staticmethod
+    def _uve_stats_get(redish, sfetch):
+        if not sfetch:
+            return
+        ppe = redish.pipeline(transaction=False)
+        for _, elem in sfetch:
+            if elem["rtype"] == "list":
+                ppe.lrange(elem["href"], 0, -1)
+            elif elem["rtype"] == "zset":
+                ppe.zrange(elem["href"], 0, -1, withscores=True)
+            elif elem["rtype"] == "hash":
+                ppe.hgetall(elem["href"])
+            else:
+                ppe.exists(elem["href"])
+        for (statlist, elem), elist in zip(sfetch, ppe.execute()):
+            edict = {}
+            if elem["rtype"] == "list":
+                for eelem in elist:
+                    jj = json.loads(eelem).items()
+                    edict[jj[0][0]] = jj[0][1]
+            elif elem["rtype"] == "zset":
+                for eelem in elist:
+                    tdict = json.loads(eelem[0])
+                    tval = long(tdict["ts"])
+                    dt = datetime.datetime.utcfromtimestamp(
+                        float(tval) / 1000000)
+                    tms = (tval % 1000000) / 1000
+                    tstr = dt.strftime('%Y %b %d %H:%M:%S')
+                    edict[tstr + "." + str(tms)] = eelem[1]
+            elif elem["rtype"] == "hash":
+                edict = elist
+            statlist.append({elem["aggtype"]: edict})
+    # end _uve_stats_get
+
+    def _uve_stats_query(self, statdict, qmap):
+        url = OpServerUtils.opserver_query_url(
+            self._local_redis_uve[0],
+            str(8081))
+        for t,q in qmap.iteritems():
+            try:
+                q["query"]["end_time"] = OpServerUtils.utc_timestamp_usec()
+                q["query"]["start_time"] = q["query"]["end_time"] - (3600 * 1000000)
+                json_str = json.dumps(q["query"])
+                resp = OpServerUtils.post_url_http(url, json_str, True)
+                if resp is not None:
+                    edict = json.loads(resp)
+                    edict = edict['value']
+                    statdict[q["type"]][q["attr"]].append(
+                        {t: edict})
+            except Exception as e:
+                print "Stats Query Exception:" + str(e)
+    # end _uve_stats_query
+
+    @staticmethod
+    def _uve_previous_add(state, key, previous, tfilter):
+        for ptyp, existing in previous:
+            afilter = None
+            if tfilter is not None:
+                afilter = tfilter[ptyp]
+            # convert_previous only adds freshly decoded values to state
+            state = UVEServer.convert_previous(
+                existing, state, key, ptyp, afilter)
+        return state
+    # end _uve_previous_add
+
+    @staticmethod
+    def _uve_stats_merge(rsp, statdict):
+        for k, v in statdict.iteritems():
+            if k in rsp:
+                mp = dict(v.items() + rsp[k].items())
+                statdict[k] = mp
+
+        return dict(rsp.items() + statdict.items())
+    # end _uve_stats_merge
+
     def get_uve(self, key, flat, sfilter=None, mfilter=None,
                 tfilter=None, multi=False, is_alarm=False):
         state = {}
         state[key] = {}
         statdict = {}
+        rsp = {}
         for redis_uve in self._redis_uve_list:
-            redish = redis.StrictRedis(host=redis_uve[0],
-                                       port=redis_uve[1],
-                                       password=self._redis_password, db=1)
+            redish = self._redis_uve_client(redis_uve)
             try:
                 qmap = {}
-                origins = redish.smembers("ALARM_ORIGINS:" + key)
+                # one round-trip for the origins (and previous types) of
+                # the key, one for all their values and one for the stats
+                # the values refer to
+                get_previous = sfilter is None and mfilter is None
+                ppe = redish.pipeline(transaction=False)
+                ppe.smembers("ALARM_ORIGINS:" + key)
                 if not is_alarm:
-                    origins = origins.union(redish.smembers("ORIGINS:" + key))
-                for origs in origins:
-                    info = origs.rsplit(":", 1)
-                    sm = info[0].split(":", 1)
-                    source = sm[0]
-                    if sfilter is not None:
-                        if sfilter != source:
-                            continue
-                    mdule = sm[1]
-                    if mfilter is not None:
-                        if mfilter != mdule:
-                            continue
-                    dsource = source + ":" + mdule
-
-                    typ = info[1]
-                    if tfilter is not None:
-                        if typ not in tfilter:
-                            continue
-
-                    odict = redish.hgetall("VALUES:" + key + ":" + origs)
-
-                    afilter_list = set()
-                    if tfilter is not None:
-                        afilter_list = tfilter[typ]
-                    for attr, value in odict.iteritems():
-                        if len(afilter_list):
-                            if attr not in afilter_list:
-                                continue
-
-                        if typ not in state[key]:
-                            state[key][typ] = {}
-
-                        if value[0] == '<':
-                            snhdict = xmltodict.parse(value)
-                            if snhdict[attr]['@type'] == 'list':
-                                if snhdict[attr]['list']['@size'] == '0':
-                                    continue
-                                elif snhdict[attr]['list']['@size'] == '1':
-                                    sname = ParallelAggregator.get_list_name(
-                                        snhdict[attr])
-                                    if not isinstance(
-                                        snhdict[attr]['list'][sname], list):
-                                        snhdict[attr]['list'][sname] = [
-                                            snhdict[attr]['list'][sname]]
-                        else:
-                            if not flat:
-                                continue
-                            if typ not in statdict:
-                                statdict[typ] = {}
-                            statdict[typ][attr] = []
-                            statsattr = json.loads(value)
-                            for elem in statsattr:
-                                #import pdb; pdb.set_trace()
-                                edict = {}
-                                if elem["rtype"] == "list":
-                                    elist = redish.lrange(elem["href"], 0, -1)
-                                    for eelem in elist:
-                                        jj = json.loads(eelem).items()
-                                        edict[jj[0][0]] = jj[0][1]
-                                elif elem["rtype"] == "zset":
-                                    elist = redish.zrange(
-                                        elem["href"], 0, -1, withscores=True)
-                                    for eelem in elist:
-                                        tdict = json.loads(eelem[0])
-                                        tval = long(tdict["ts"])
-                                        dt = datetime.datetime.utcfromtimestamp(
-                                            float(tval) / 1000000)
-                                        tms = (tval % 1000000) / 1000
-                                        tstr = dt.strftime('%Y %b %d %H:%M:%S')
-                                        edict[tstr + "." + str(tms)] = eelem[1]
-                                elif elem["rtype"] == "hash":
-                                    elist = redish.hgetall(elem["href"])
-                                    edict = elist
-                                elif elem["rtype"] == "query":
-                                    if sfilter is None and mfilter is None and not multi:
-                                        qdict = {}
-                                        qdict["table"] = elem["aggtype"]
-                                        qdict["select_fields"] = elem["select"]
-                                        qdict["where"] =[[{"name":"name",
-                                            "value":key.split(":",1)[1],
-                                            "op":1}]]
-                                        qmap[elem["aggtype"]] = {"query":qdict,
-                                            "type":typ, "attr":attr}
-                                    # For the stats query case, defer processing
-                                    continue
-
-                                statdict[typ][attr].append(
-                                    {elem["aggtype"]: edict})
-                            continue
-
-                        # print "Attr %s Value %s" % (attr, snhdict)
-                        if attr not in state[key][typ]:
-                            state[key][typ][attr] = {}
-                        if dsource in state[key][typ][attr]:
-                            print "Found Dup %s:%s:%s:%s:%s = %s" % \
-                                (key, typ, attr, source, mdule, state[
-                                key][typ][attr][dsource])
-                        state[key][typ][attr][dsource] = snhdict[attr]
-                
-                if len(qmap):
-                    url = OpServerUtils.opserver_query_url(
-                        self._local_redis_uve[0],
-                        str(8081))
-                    for t,q in qmap.iteritems():
-                        try:
-                            q["query"]["end_time"] = OpServerUtils.utc_timestamp_usec()
-                            q["query"]["start_time"] = qdict["end_time"] - (3600 * 1000000)
-                            json_str = json.dumps(q["query"])
-                            resp = OpServerUtils.post_url_http(url, json_str, True)
-                            if resp is not None:
-                                edict = json.loads(resp)
-                                edict = edict['value']
-                                statdict[q["type"]][q["attr"]].append(
-                                    {t: edict})
-                        except Exception as e:
-                            print "Stats Query Exception:" + str(e)
-                        
-                if sfilter is None and mfilter is None:
-                    for ptyp in redish.smembers("PTYPES:" + key):
-                        afilter = None
+                    ppe.smembers("ORIGINS:" + key)
+                if get_previous:
+                    ppe.smembers("PTYPES:" + key)
+                replies = ppe.execute()
+                origins = replies[0]
+                if not is_alarm:
+                    origins = origins.union(replies[1])
+                ptyps = []
+                if get_previous:
+                    for ptyp in replies[-1]:
                         if tfilter is not None:
                             if ptyp not in tfilter:
                                 continue
-                            afilter = tfilter[ptyp]
-                        existing = redish.hgetall("PREVIOUS:" + key + ":" + ptyp)
-                        nstate = UVEServer.convert_previous(
-                            existing, state, key, ptyp, afilter)
-                        state = copy.deepcopy(nstate)
+                        ptyps.append(ptyp)
+
+                ofetch = []
+                for origs in origins:
+                    origin = UVEServer._parse_origin(
+                        origs, sfilter, mfilter, tfilter)
+                    if origin is not None:
+                        ofetch.append(origin)
+
+                ppe = redish.pipeline(transaction=False)
+                for origin in ofetch:
+                    ppe.hgetall("VALUES:" + key + ":" + origin[0])
+                for ptyp in ptyps:
+                    ppe.hgetall("PREVIOUS:" + key + ":" + ptyp)
+                replies = ppe.execute()
+
+                sfetch = []
+                self._uve_values_add((redis_uve[0], redis_uve[1]),
+                    state, statdict, key,
+                    zip(ofetch, replies), flat, sfilter, mfilter, tfilter,
+                    multi, qmap, sfetch)
+                UVEServer._uve_stats_get(redish, sfetch)
+                if len(qmap):
+                    self._uve_stats_query(statdict, qmap)
+                state = UVEServer._uve_previous_add(state, key,
+                    zip(ptyps, replies[len(ofetch):]), tfilter)
 
                 pa = ParallelAggregator(state)
                 rsp = pa.aggregate(key, flat)
@@ -373,12 +535,7 @@ class UVEServer(object):
             else:
                 self._logger.debug("Computed %s" % key)
 
-        for k, v in statdict.iteritems():
-            if k in rsp:
-                mp = dict(v.items() + rsp[k].items())
-                statdict[k] = mp
-
-        return dict(rsp.items() + statdict.items())
+        return UVEServer._uve_stats_merge(rsp, statdict)
     # end get_uve
 
     def get_uve_regex(self, key):
@@ -393,37 +550,154 @@ class UVEServer(object):
 
     def multi_uve_get(self, key, flat, kfilter, sfilter, mfilter,
                       tfilter, is_alarm=False):
+        '''
+        Generator of {'name', 'value'} of all UVEs of a table matching
+        the filters. The table index of each redis-uve instance is read
+        once to find the origins of every UVE, which are then fetched and
+        aggregated _MULTI_UVE_CHUNK UVEs at a time.
+        '''
         tbl_uve = key.split(':', 1)
         table = tbl_uve[0]
-
-        # get_uve_list cannot handle attribute names very efficiently,
-        # so we don't pass them here
-        k1_filter = [tbl_uve[1]]
-        uve_list = self.get_uve_list(table, k1_filter, sfilter,
-                                     mfilter, tfilter, False, is_alarm)
+        patterns = [self.get_uve_regex(tbl_uve[1])]
+        kpatterns = None
         if kfilter is not None:
-            patterns = set()
-            for filt in kfilter:
-                patterns.add(self.get_uve_regex(filt))
-        for uve_name in uve_list:
-            if kfilter is not None:
-                kfilter_match = False
-                for pattern in patterns:
-                    if pattern.match(uve_name):
-                        kfilter_match = True
-                        break
-                if not kfilter_match:
-                    continue
-            uve_val = self.get_uve(
-                table + ':' + uve_name, flat,
-                sfilter, mfilter, tfilter, True, is_alarm)
-            if uve_val == {}:
-                continue
-            else:
-                uve = {'name': uve_name, 'value': uve_val}
+            kpatterns = [self.get_uve_regex(filt) for filt in kfilter]
+
+        # uve name -> redis-uve instance -> origins selected by the filters
+        uve_origins = {}
+        for redis_uve in self._redis_uve_list:
+            redis_inst = (redis_uve[0], redis_uve[1])
+            redish = self._redis_uve_client(redis_uve)
+            try:
+                ppe = redish.pipeline(transaction=False)
+                ppe.smembers('ALARM_TABLE:' + table)
+                if not is_alarm:
+                    ppe.smembers('TABLE:' + table)
+                entries = set()
+                for reply in ppe.execute():
+                    entries.update(reply)
+                for entry in entries:
+                    # <table>:<uve>:<source>:<node-type>:<module>:<inst>:<type>
+                    info = (entry.split(':', 1)[1]).rsplit(':', 5)
+                    uve_name = info[0]
+                    if not any(pattern.match(uve_name)
+                               for pattern in patterns):
+                        continue
+                    if kpatterns is not None and \
+                       not any(pattern.match(uve_name)
+                               for pattern in kpatterns):
+                        continue
+                    origin = UVEServer._parse_origin(':'.join(info[1:]),
+                        sfilter, mfilter, tfilter)
+                    if origin is None:
+                        continue
+                    uve_origins.setdefault(uve_name, {}).setdefault(
+                        redis_inst, []).append(origin)
+            except redis.exceptions.ConnectionError:
+                self._logger.error('Failed to connect to redis-uve: %s:%d' \
+                                   % (redis_uve[0], redis_uve[1]))
+            except Exception as e:
+                self._logger.error('Exception: %s' % e)
+                return
+
+        uve_names = uve_origins.keys()
+        for idx in range(0, len(uve_names), self._MULTI_UVE_CHUNK):
+            for uve in self._multi_uve_chunk_get(table,
+                    uve_names[idx:idx + self._MULTI_UVE_CHUNK], uve_origins,
+                    flat, sfilter, mfilter, tfilter):
                 yield uve
     # end multi_uve_get
 
+    def _multi_uve_chunk_get(self, table, uve_names, uve_origins, flat,
+                             sfilter, mfilter, tfilter):
+        get_previous = sfilter is None and mfilter is None
+        states = {}
+        statdicts = {}
+        for uve_name in uve_names:
+            states[uve_name] = {table + ':' + uve_name: {}}
+            statdicts[uve_name] = {}
+        failed = set()
+
+        for redis_uve in self._redis_uve_list:
+            redis_inst = (redis_uve[0], redis_uve[1])
+            redish = self._redis_uve_client(redis_uve)
+            try:
+                # values (and previous types) of all UVEs in one pipeline
+                ppe = redish.pipeline(transaction=False)
+                for uve_name in uve_names:
+                    key = table + ':' + uve_name
+                    for origin in uve_origins[uve_name].get(redis_inst, []):
+                        ppe.hgetall("VALUES:" + key + ":" + origin[0])
+                    if get_previous:
+                        ppe.smembers("PTYPES:" + key)
+                replies = iter(ppe.execute())
+
+                sfetch = []
+                pfetch = []
+                for uve_name in uve_names:
+                    key = table + ':' + uve_name
+                    ovalues = [(origin, replies.next()) for origin in
+                               uve_origins[uve_name].get(redis_inst, [])]
+                    ptyps = []
+                    if get_previous:
+                        ptyps = replies.next()
+                    if uve_name in failed:
+                        continue
+                    try:
+                        self._uve_values_add(redis_inst, states[uve_name],
+                            statdicts[uve_name], key, ovalues, flat,
+                            sfilter, mfilter, tfilter, True, {}, sfetch)
+                    except Exception as e:
+                        self._logger.error("Exception: %s" % e)
+                        failed.add(uve_name)
+                        continue
+                    for ptyp in ptyps:
+                        if tfilter is not None:
+                            if ptyp not in tfilter:
+                                continue
+                        pfetch.append((uve_name, ptyp))
+
+                UVEServer._uve_stats_get(redish, sfetch)
+
+                if pfetch:
+                    ppe = redish.pipeline(transaction=False)
+                    for uve_name, ptyp in pfetch:
+                        ppe.hgetall("PREVIOUS:" + table + ':' + uve_name +
+                                    ":" + ptyp)
+                    for (uve_name, ptyp), existing in \
+                            zip(pfetch, ppe.execute()):
+                        if uve_name in failed:
+                            continue
+                        try:
+                            states[uve_name] = UVEServer._uve_previous_add(
+                                states[uve_name], table + ':' + uve_name,
+                                [(ptyp, existing)], tfilter)
+                        except Exception as e:
+                            self._logger.error("Exception: %s" % e)
+                            failed.add(uve_name)
+            except redis.exceptions.ConnectionError:
+                self._logger.error("Failed to connect to redis-uve: %s:%d" \
+                                   % (redis_uve[0], redis_uve[1]))
+            except Exception as e:
+                self._logger.error("Exception: %s" % e)
+                failed.update(uve_names)
+
+        for uve_name in uve_names:
+            if uve_name in failed:
+                continue
+            key = table + ':' + uve_name
+            try:
+                pa = ParallelAggregator(states[uve_name])
+                uve_val = UVEServer._uve_stats_merge(
+                    pa.aggregate(key, flat), statdicts[uve_name])
+            except Exception as e:
+                self._logger.error("Exception: %s" % e)
+                continue
+            if uve_val == {}:
+                continue
+            yield {'name': uve_name, 'value': uve_val}
+    # end _multi_uve_chunk_get
+
     def get_uve_list(self, key, kfilter, sfilter,
                      mfilter, tfilter, parse_afilter, is_alarm=False):
         uve_list = set()
@@ -432,14 +706,20 @@ class UVEServer(object):
             for filt in kfilter:
                 patterns.add(self.get_uve_regex(filt))
         for redis_uve in self._redis_uve_list:
-            redish = redis.StrictRedis(host=redis_uve[0],
-                                       port=redis_uve[1],
-                                       password=self._redis_password, db=1)
+            redish = self._redis_uve_client(redis_uve)
             try:
                 # For UVE queries, we wanna read both UVE and Alarm table
-                entries = redish.smembers('ALARM_TABLE:' + key)
+                ppe = redish.pipeline(transaction=False)
+                ppe.smembers('ALARM_TABLE:' + key)
                 if not is_alarm:
-                    entries = entries.union(redish.smembers('TABLE:' + key))
+                    ppe.smembers('TABLE:' + key)
+                replies = ppe.execute()
+                entries = replies[0]
+                if not is_alarm:
+                    entries = entries.union(replies[1])
+                # uve keys to be listed only if one of the filter
+                # attributes is present, checked in a single round-trip
+                afetch = []
                 for entry in entries:
                     info = (entry.split(':', 1)[1]).rsplit(':', 5)
                     uve_key = info[0]
@@ -470,13 +750,17 @@ class UVEServer(object):
                             valkey = "VALUES:" + key + ":" + uve_key + ":" + \
                                  src + ":" + node_type + ":" + mdule + \
                                  ":" + inst + ":" + typ
-                            for afilter in tfilter[typ]:
-                                attrval = redish.hget(valkey, afilter)
-                                if attrval is not None:
-                                    break
-                            if attrval is None:
-                                continue
+                            afetch.append((uve_key, valkey, list(tfilter[typ])))
+                            continue
                     uve_list.add(uve_key)
+                if afetch:
+                    ppe = redish.pipeline(transaction=False)
+                    for _, valkey, afilters in afetch:
+                        ppe.hmget(valkey, afilters)
+                    for (uve_key, _, _), attrvals in \
+                            zip(afetch, ppe.execute()):
+                        if any(attrval is not None for attrval in attrvals):
+                            uve_list.add(uve_key)
             except redis.exceptions.ConnectionError:
                 self._logger.error('Failed to connect to redis-uve: %s:%d' \
                                    % (redis_uve[0], redis_uve[1]))
@@ -490,23 +774,34 @@ class UVEServer(object):
 
 
 class ParallelAggregator:
+    '''
+    Aggregates the per-source values of a UVE. The state is not modified,
+    it may hold parsed values shared with the UVEServer parse cache; the
+    results are built from shallow copies and share unchanged subtrees
+    with the state.
+    '''
 
     def __init__(self, state):
         self._state = state
 
+    @staticmethod
+    def _elem_key(elem):
+        # hashable identity of a list element or attribute value
+        if isinstance(elem, basestring):
+            return elem
+        return json.dumps(elem, sort_keys=True)
+
     def _default_agg(self, oattr):
-        itemset = set()
+        itemmap = {}
         result = []
         for source in oattr.keys():
             elem = oattr[source]
-            hdelem = json.dumps(elem)
-            if hdelem not in itemset:
-                itemset.add(hdelem)
-                result.append([elem, source])
+            hdelem = json.dumps(elem, sort_keys=True)
+            if hdelem not in itemmap:
+                itemmap[hdelem] = [elem, source]
+                result.append(itemmap[hdelem])
             else:
-                for items in result:
-                    if elem in items:
-                        items.append(source)
+                itemmap[hdelem].append(source)
         return result
 
     def _is_sum(self, oattr):
@@ -560,9 +855,24 @@ class ParallelAggregator:
                     skey = sattr
         return skey
 
+    @staticmethod
+    def _list_result(attr, sname, elems):
+        result = dict(attr)
+        result['list'] = dict(attr['list'])
+        result['list'][sname] = elems
+        result['list']['@size'] = str(len(elems))
+        return result
+
+    @staticmethod
+    def _list_elems(attr, sname):
+        elems = attr['list'][sname]
+        if not isinstance(elems, list):
+            return [elems]
+        return elems
+
     def _sum_agg(self, oattr):
         akey = oattr.keys()[0]
-        result = copy.deepcopy(oattr[akey])
+        result = dict(oattr[akey])
         count = 0
         for source in oattr.keys():
             count += int(oattr[source]['#text'])
@@ -571,39 +881,25 @@ class ParallelAggregator:
 
     def _union_agg(self, oattr):
         akey = oattr.keys()[0]
-        result = copy.deepcopy(oattr[akey])
         itemset = set()
         sname = ParallelAggregator.get_list_name(oattr[akey])
-        result['list'][sname] = []
-
-        siz = 0
+        elems = []
         for source in oattr.keys():
-            if isinstance(oattr[source]['list'][sname], basestring):
-                oattr[source]['list'][sname] = [oattr[source]['list'][sname]]
-            for elem in oattr[source]['list'][sname]:
-                hdelem = json.dumps(elem)
+            for elem in ParallelAggregator._list_elems(oattr[source], sname):
+                hdelem = ParallelAggregator._elem_key(elem)
                 if hdelem not in itemset:
                     itemset.add(hdelem)
-                    result['list'][sname].append(elem)
-                    siz += 1
-        result['list']['@size'] = str(siz)
-
-        return result
+                    elems.append(elem)
+        return ParallelAggregator._list_result(oattr[akey], sname, elems)
 
     def _append_agg(self, oattr):
         akey = oattr.keys()[0]
-        result = copy.deepcopy(oattr[akey])
         sname = ParallelAggregator.get_list_name(oattr[akey])
-        result['list'][sname] = []
-        siz = 0
+        elems = []
         for source in oattr.keys():
-            if not isinstance(oattr[source]['list'][sname], list):
-                oattr[source]['list'][sname] = [oattr[source]['list'][sname]]
-            for elem in oattr[source]['list'][sname]:
-                result['list'][sname].append(elem)
-                siz += 1
-        result['list']['@size'] = str(siz)
-        return result
+            elems.extend(
+                ParallelAggregator._list_elems(oattr[source], sname))
+        return ParallelAggregator._list_result(oattr[akey], sname, elems)
 
     @staticmethod
     def _list_agg_attrs(item):
@@ -628,33 +924,37 @@ class ParallelAggregator:
 
         # If the list's underlying struct has a listkey present,
         # we need to further aggregate entries that have the
-        # same listkey
-        mod_result = copy.deepcopy(result[typ][objattr])
-        mod_result['list'][applist] = []
-        res_size = 0
-        mod_result['list']['@size'] = int(res_size)
-
-        # Add up stats
+        # same listkey. Entries are indexed by listkey; only those
+        # seen more than once are copied, to hold the added up stats
+        res_items = []
+        res_index = {}
+        res_sums = {}
         for items in result[typ][objattr]['list'][applist]:
-            matched = False
-            for res_items in mod_result['list'][applist]:
-                if items[appkey]['#text'] in [res_items[appkey]['#text']]:
-                    for ctrs in ParallelAggregator._list_agg_attrs(items):
-                        res_items[ctrs]['#text'] += int(items[ctrs]['#text'])
-                    matched = True
-            if not matched:
-                newitem = copy.deepcopy(items)
-                for ctrs in ParallelAggregator._list_agg_attrs(items):
-                    newitem[ctrs]['#text'] = int(items[ctrs]['#text'])
-                mod_result['list'][applist].append(newitem)
-                res_size += 1
+            lkey = items[appkey]['#text']
+            idx = res_index.get(lkey)
+            if idx is None:
+                res_index[lkey] = len(res_items)
+                res_items.append(items)
+                continue
+            sums = res_sums.get(idx)
+            if sums is None:
+                sums = {}
+                for ctrs in ParallelAggregator._list_agg_attrs(
+                        res_items[idx]):
+                    sums[ctrs] = int(res_items[idx][ctrs]['#text'])
+                res_sums[idx] = sums
+            for ctrs in ParallelAggregator._list_agg_attrs(items):
+                sums[ctrs] += int(items[ctrs]['#text'])
 
         # Convert results back into strings
-        for res_items in mod_result['list'][applist]:
-            for ctrs in ParallelAggregator._list_agg_attrs(res_items):
-                res_items[ctrs]['#text'] = str(res_items[ctrs]['#text'])
-        mod_result['list']['@size'] = str(res_size)
-        return mod_result
+        for idx, sums in res_sums.iteritems():
+            newitem = dict(res_items[idx])
+            for ctrs, count in sums.iteritems():
+                newitem[ctrs] = dict(newitem[ctrs])
+                newitem[ctrs]['#text'] = str(count)
+            res_items[idx] = newitem
+        return ParallelAggregator._list_result(
+            result[typ][objattr], applist, res_items)
 
     def aggregate(self, key, flat):
         '''